@@ -105,6 +105,17 @@ app.use(
   })
 );
 
+app.use(
+  "/api/reference",
+  authMiddleware,
+  createProxyMiddleware({
+    target: PYTHON_BACKEND,
+    changeOrigin: true,
+    pathRewrite: { "^/api/reference": "/reference" },
+    onProxyReq: fixRequestBody,
+  })
+);
+
 // WebSocket proxy for real-time updates
 app.use(
   "/ws",
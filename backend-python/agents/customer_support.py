@@ -3,9 +3,24 @@ Customer Support Agent
 Handles ticket triage, response drafting, sentiment analysis, escalation logic
 """
 import asyncio
+import os
 import random
-from typing import Dict, Any
+from collections import Counter, deque
+from typing import Dict, Any, AsyncIterable, AsyncIterator, List, Optional
 from agents.base import BaseAgent
+from core.progress import report_progress
+from core.result_store import open_result_stream
+from core.task_inputs import task_inputs
+
+
+# bulk_classify micro-batches: whichever limit is hit first closes a batch
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "500"))
+CLASSIFY_BATCH_BYTES = int(os.getenv("CLASSIFY_BATCH_BYTES", str(256 * 1024)))
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", "4"))
+# Micro-batches in flight across every bulk_classify task in the process
+CLASSIFY_MAX_IN_FLIGHT = int(os.getenv("CLASSIFY_MAX_IN_FLIGHT", "16"))
+# Larger runs write their per-ticket results straight to the result store
+CLASSIFY_STREAM_THRESHOLD = int(os.getenv("CLASSIFY_STREAM_THRESHOLD", "1000"))
 
 
 RESPONSE_TEMPLATES = {
@@ -152,17 +167,76 @@ class CustomerSupportAgent(BaseAgent):
         }
 
     async def _bulk_classify(self, payload: dict) -> dict:
-        await asyncio.sleep(random.uniform(0.8, 2.5))
-        tickets = payload.get("tickets", [])
+        # Large jobs are uploaded (POST /agents/{id}/tickets) and read back from
+        # GridFS page by page; small ones can carry their tickets inline
+        input_id = payload.get("input_id")
+        if input_id:
+            pages, total = task_inputs.pages(input_id), None
+        else:
+            tickets = payload.get("tickets", [])
+            pages, total = _single_page(tickets), len(tickets)
+        batch_size = max(int(payload.get("batch_size", CLASSIFY_BATCH_SIZE)), 1)
+        concurrency = min(max(int(payload.get("concurrency", CLASSIFY_CONCURRENCY)), 1), CLASSIFY_MAX_IN_FLIGHT)
+        stream = open_result_stream() if input_id or total >= CLASSIFY_STREAM_THRESHOLD else None
+        
         results = []
-        for ticket in tickets[:50]:  # cap at 50
-            results.append({
+        by_category, by_priority = Counter(), Counter()
+        totals = {"classified": 0, "batches": 0, "low_confidence": 0}
+        
+        async def consume(shard: List[dict]):
+            for r in shard:
+                by_category[r["category"]] += 1
+                by_priority[r["priority"]] += 1
+            totals["low_confidence"] += sum(1 for r in shard if r["confidence"] < self.auto_resolve_threshold)
+            totals["classified"] += len(shard)
+            totals["batches"] += 1
+            if stream is not None:
+                await stream.write_many(shard)
+            else:
+                results.extend(shard)
+            await report_progress(stage="bulk_classify", processed=totals["classified"], total=total,
+                                  batches=totals["batches"])
+        
+        # Up to `concurrency` micro-batches in flight, consumed in input order
+        pending: deque = deque()
+        try:
+            async for batch in micro_batches(pages, batch_size, CLASSIFY_BATCH_BYTES):
+                pending.append(asyncio.create_task(self._classify_batch(batch)))
+                if len(pending) >= concurrency:
+                    await consume(await pending.popleft())
+            while pending:
+                await consume(await pending.popleft())
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            if stream is not None:
+                await stream.abort()
+            raise
+        
+        summary = {
+            **totals,
+            "by_category": dict(by_category),
+            "by_priority": dict(by_priority),
+        }
+        if stream is not None:
+            # Per-ticket results live in the result store; see /tasks/{id}/result
+            await stream.finish(summary)
+            return summary
+        return {**summary, "results": results}
+
+    async def _classify_batch(self, tickets: List[dict]) -> List[dict]:
+        # One simulated model call per micro-batch
+        async with _classify_slots():
+            await asyncio.sleep(random.uniform(0.05, 0.2))
+        return [
+            {
                 "id": ticket.get("id"),
                 "category": random.choice(self.handled_categories),
                 "priority": random.choice(["LOW", "MEDIUM", "HIGH"]),
                 "confidence": round(random.uniform(0.7, 0.99), 2)
-            })
-        return {"classified": len(results), "results": results}
+            }
+            for ticket in tickets
+        ]
 
     # ── Social Media Task Handlers ────────────────────────────────────────────
 
@@ -347,3 +421,34 @@ class CustomerSupportAgent(BaseAgent):
                 f"Overall brand sentiment is mostly {max(sentiment_breakdown, key=sentiment_breakdown.get)}",
             ],
         }
+
+
+async def micro_batches(pages: AsyncIterable[List[dict]], max_items: int, max_bytes: int) -> AsyncIterator[List[dict]]:
+    """Consecutive slices of at most `max_items` tickets and (unless a single
+    ticket is larger) `max_bytes` of text, across pages of tickets."""
+    batch, size = [], 0
+    async for page in pages:
+        for ticket in page:
+            ticket_size = sum(len(v) for v in ticket.values() if isinstance(v, str))
+            if batch and (len(batch) >= max_items or size + ticket_size > max_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append(ticket)
+            size += ticket_size
+    if batch:
+        yield batch
+
+
+async def _single_page(tickets: List[dict]) -> AsyncIterator[List[dict]]:
+    yield tickets
+
+
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def _classify_slots() -> asyncio.Semaphore:
+    # Created lazily so it binds to the running loop
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(1, CLASSIFY_MAX_IN_FLIGHT))
+    return _slots
@@ -3,20 +3,21 @@ Data Entry & Processing Agent
 Handles structured data extraction, validation, transformation, and enrichment
 """
 import asyncio
+import os
 import random
-import re
 from typing import Dict, Any, List
 from agents.base import BaseAgent
-from datetime import datetime
+from agents.validation import compile_schema
+from agents.fuzzy_dedup import FuzzyDeduplicator, fuzzy_deduplicate, fuzzy_options
+from agents.transforms import compile_plan, transform_records
+from agents.pipeline import PipelineStage, RecordPipeline, PIPELINE_CHUNK_SIZE
+from agents.documents import document_path, parse_document, parse_text
+from core.dedup_index import dedup_indexes, key_digest
+from core.reference_data import join_lookups
 
 
-FIELD_VALIDATORS = {
-    "email": r"^[\w\.-]+@[\w\.-]+\.\w{2,}$",
-    "phone": r"^\+?[\d\s\-\(\)]{7,15}$",
-    "date": r"^\d{4}-\d{2}-\d{2}$",
-    "amount": r"^\$?[\d,]+\.?\d{0,2}$",
-    "zip": r"^\d{5}(-\d{4})?$",
-}
+# Batches at least this large are validated off the event loop
+VALIDATION_THREAD_THRESHOLD = int(os.getenv("VALIDATION_THREAD_THRESHOLD", "5000"))
 
 
 class DataEntryAgent(BaseAgent):
@@ -36,6 +37,7 @@ class DataEntryAgent(BaseAgent):
             "enrich_records": self._enrich_records,
             "deduplicate": self._deduplicate,
             "parse_document": self._parse_document,
+            "run_pipeline": self._run_pipeline,
         }
         
         handler = dispatch.get(task_type)
@@ -74,59 +76,18 @@ class DataEntryAgent(BaseAgent):
         await asyncio.sleep(random.uniform(0.2, 0.8))
         
         records = payload.get("records", [])
-        schema = payload.get("schema", {})
-        
-        valid = []
-        invalid = []
-        
-        for i, record in enumerate(records):
-            errors = []
-            for field, rules in schema.items():
-                value = record.get(field, "")
-                if rules.get("required") and not value:
-                    errors.append({"field": field, "error": "required_missing"})
-                if rules.get("type") == "email" and value:
-                    if not re.match(FIELD_VALIDATORS["email"], str(value)):
-                        errors.append({"field": field, "error": "invalid_email_format"})
-                if rules.get("max_length") and len(str(value)) > rules["max_length"]:
-                    errors.append({"field": field, "error": f"exceeds_max_length_{rules['max_length']}"})
-            
-            if errors:
-                invalid.append({"index": i, "record": record, "errors": errors})
-            else:
-                valid.append(record)
-        
-        return {
-            "total": len(records),
-            "valid": len(valid),
-            "invalid": len(invalid),
-            "validation_rate": round(len(valid) / max(len(records), 1) * 100, 1),
-            "errors": invalid[:10],  # Return first 10 errors
-            "valid_records": valid
-        }
+        validator = compile_schema(payload.get("schema", {}))
+        if len(records) >= VALIDATION_THREAD_THRESHOLD:
+            return await asyncio.to_thread(validator.summarize, records)
+        return validator.summarize(records)
 
     async def _transform_data(self, payload: dict) -> dict:
-        await asyncio.sleep(random.uniform(0.3, 1.0))
-        
         records = payload.get("records", [])
         transformations = payload.get("transformations", [])
         
         transformed = []
-        for record in records:
-            new_record = dict(record)
-            for transform in transformations:
-                field = transform.get("field")
-                op = transform.get("operation")
-                if field in new_record:
-                    if op == "uppercase":
-                        new_record[field] = str(new_record[field]).upper()
-                    elif op == "lowercase":
-                        new_record[field] = str(new_record[field]).lower()
-                    elif op == "trim":
-                        new_record[field] = str(new_record[field]).strip()
-                    elif op == "format_date":
-                        new_record[field] = datetime.now().strftime("%Y-%m-%d")
-            transformed.append(new_record)
+        async for shard in transform_records(transformations, records):
+            transformed.extend(shard)
         
         return {
             "transformed_count": len(transformed),
@@ -136,20 +97,18 @@ class DataEntryAgent(BaseAgent):
         }
 
     async def _enrich_records(self, payload: dict) -> dict:
+        records = payload.get("records", [])
+        lookups = payload.get("lookups")
+        if lookups:
+            return await self._lookup_enrich(records, lookups)
+        
         await asyncio.sleep(random.uniform(0.8, 2.5))
         
-        records = payload.get("records", [])
         enrichment_sources = payload.get("sources", ["company_db", "geo_api"])
         
         enriched = []
         for record in records:
-            enrichment = {}
-            if "company_db" in enrichment_sources:
-                enrichment["company_size"] = random.choice(["1-10", "11-50", "51-200", "201-1000", "1000+"])
-                enrichment["industry"] = random.choice(["SaaS", "FinTech", "Healthcare", "E-commerce", "Enterprise"])
-            if "geo_api" in enrichment_sources:
-                enrichment["timezone"] = random.choice(["America/New_York", "Europe/London", "Asia/Tokyo"])
-                enrichment["country_code"] = random.choice(["US", "GB", "DE", "FR", "JP"])
+            enrichment = enrichment_for(record, enrichment_sources)
             enriched.append({**record, **enrichment})
         
         return {
@@ -159,18 +118,38 @@ class DataEntryAgent(BaseAgent):
             "records": enriched
         }
 
+    async def _lookup_enrich(self, records: List[dict], lookups: List[dict]) -> dict:
+        """Join rows from loaded reference datasets; each dataset is hit once
+        per batch with the batch's distinct keys."""
+        enriched, lookup_stats = await join_lookups(records, lookups)
+        added = [r.keys() - src.keys() for r, src in zip(enriched, records)]
+        
+        return {
+            "enriched_count": sum(1 for fields in added if fields),
+            "sources_used": [s["dataset"] for s in lookup_stats],
+            "fields_added": sorted(set().union(*added)),
+            "lookups": lookup_stats,
+            "records": enriched
+        }
+
     async def _deduplicate(self, payload: dict) -> dict:
         await asyncio.sleep(random.uniform(0.3, 1.2))
         
         records = payload.get("records", [])
         key_fields = payload.get("key_fields", ["email"])
         
+        check_dedup_options(payload)
+        if payload.get("mode", "exact") == "fuzzy":
+            return await self._fuzzy_deduplicate(records, key_fields, payload)
+        if payload.get("persistent"):
+            return await self._persistent_deduplicate(records, key_fields)
+        
         seen = set()
         unique = []
         duplicates = []
         
         for record in records:
-            key = tuple(str(record.get(f, "")).lower() for f in key_fields)
+            key = dedup_key(record, key_fields)
             if key in seen:
                 duplicates.append(record)
             else:
@@ -185,24 +164,173 @@ class DataEntryAgent(BaseAgent):
             "records": unique
         }
 
-    async def _parse_document(self, payload: dict) -> dict:
-        await asyncio.sleep(random.uniform(1.0, 3.0))
-        
-        doc_type = payload.get("document_type", "invoice")
+    async def _persistent_deduplicate(self, records: List[dict], key_fields: List[str]) -> dict:
+        """Exact dedup against every key this agent has seen for `key_fields`,
+        across batches; this batch's new keys are added to the index."""
+        index = await dedup_indexes.get(self.agent_id, key_fields)
+        seen = await index.mark_seen([key_digest(dedup_key(r, key_fields)) for r in records])
+        await index.flush()
+        unique = [r for r, was_seen in zip(records, seen) if not was_seen]
+        removed = len(records) - len(unique)
         
-        parsed_fields = {
-            "invoice": ["invoice_number", "date", "vendor", "amount", "tax", "line_items"],
-            "contract": ["parties", "effective_date", "term_months", "value", "clauses"],
-            "form": ["applicant_name", "date", "fields", "signatures"],
+        return {
+            "total_input": len(records),
+            "unique_records": len(unique),
+            "duplicates_removed": removed,
+            "dedup_rate": round(removed / max(len(records), 1) * 100, 1),
+            "mode": "persistent",
+            "index_keys": index.count,
+            "records": unique
         }
+
+    async def _fuzzy_deduplicate(self, records: List[dict], key_fields: List[str], payload: dict) -> dict:
+        """Near-duplicate clustering (MinHash/LSH); one survivor kept per cluster."""
+        unique, clusters, comparisons = await asyncio.to_thread(
+            fuzzy_deduplicate, records, key_fields,
+            payload.get("survivor", "most_complete"), **fuzzy_options(payload),
+        )
+        removed = len(records) - len(unique)
         
-        fields = parsed_fields.get(doc_type, ["field_1", "field_2", "field_3"])
+        return {
+            "total_input": len(records),
+            "unique_records": len(unique),
+            "duplicates_removed": removed,
+            "dedup_rate": round(removed / max(len(records), 1) * 100, 1),
+            "mode": "fuzzy",
+            "clusters_found": len(clusters),
+            "clusters": clusters[:100],  # Return first 100 clusters
+            "comparisons": comparisons,
+            "records": unique
+        }
+
+    async def _run_pipeline(self, payload: dict) -> dict:
+        records = payload.get("records", [])
+        stages = [self._pipeline_stage(spec) for spec in payload.get("stages", [])]
+        if not stages:
+            raise ValueError("run_pipeline needs at least one stage")
+        pipeline = RecordPipeline(stages, chunk_size=payload.get("chunk_size", PIPELINE_CHUNK_SIZE))
+        output = await pipeline.run(records)
         
         return {
-            "document_type": doc_type,
-            "pages_processed": random.randint(1, 10),
-            "fields_extracted": len(fields),
-            "extracted_data": {f: f"<parsed_{f}>" for f in fields},
-            "confidence_score": round(random.uniform(0.78, 0.98), 2),
-            "requires_review": random.random() < 0.15
+            "total_input": len(records),
+            "output_count": len(output),
+            "stages": pipeline.stats(),
+            "records": output
         }
+
+    def _pipeline_stage(self, spec: dict) -> PipelineStage:
+        """Build one run_pipeline stage, e.g. {"type": "validate", "schema": {...}}."""
+        kind = spec.get("type")
+        
+        if kind == "validate":
+            validator = compile_schema(spec.get("schema", {}))
+            
+            def validate(chunk, offset, stats):
+                valid, failures = validator.validate(chunk)
+                stats["invalid"] = stats.get("invalid", 0) + len(failures)
+                errors = stats.setdefault("errors", [])
+                for i in sorted(failures)[:max(10 - len(errors), 0)]:
+                    errors.append({"index": offset + i, "record": chunk[i], "errors": failures[i]})
+                return valid
+            return PipelineStage(kind, validate)
+        
+        if kind == "transform":
+            plan = compile_plan(spec.get("transformations", []))
+            return PipelineStage(kind, lambda chunk, offset, stats: plan.apply_all(chunk))
+        
+        if kind == "deduplicate":
+            check_dedup_options(spec)
+        
+        if kind == "deduplicate" and spec.get("mode") == "fuzzy":
+            # Streaming: the first record of each cluster is the survivor
+            fuzzy = FuzzyDeduplicator(spec.get("key_fields", ["email"]), **fuzzy_options(spec))
+            
+            def fuzzy_deduplicate_chunk(chunk, offset, stats):
+                unique = [r for r in chunk if fuzzy.add(r)[1] is None]
+                stats["duplicates_removed"] = stats.get("duplicates_removed", 0) + len(chunk) - len(unique)
+                stats["clusters_found"] = len(fuzzy.clusters)
+                return unique
+            return PipelineStage(kind, fuzzy_deduplicate_chunk)
+        
+        if kind == "deduplicate" and spec.get("persistent"):
+            key_fields = spec.get("key_fields", ["email"])
+            
+            async def persistent_deduplicate(chunk, offset, stats):
+                index = await dedup_indexes.get(self.agent_id, key_fields)
+                seen = await index.mark_seen([key_digest(dedup_key(r, key_fields)) for r in chunk])
+                unique = [r for r, was_seen in zip(chunk, seen) if not was_seen]
+                stats["duplicates_removed"] = stats.get("duplicates_removed", 0) + len(chunk) - len(unique)
+                return unique
+            
+            async def flush_index(stats):
+                # Snapshot once per task rather than per chunk
+                await (await dedup_indexes.get(self.agent_id, key_fields)).flush()
+            return PipelineStage(kind, persistent_deduplicate, finish=flush_index)
+        
+        if kind == "deduplicate":
+            key_fields = spec.get("key_fields", ["email"])
+            seen = set()  # spans chunks, so duplicates are caught batch-wide
+            
+            def deduplicate(chunk, offset, stats):
+                unique = []
+                for record in chunk:
+                    key = dedup_key(record, key_fields)
+                    if key not in seen:
+                        seen.add(key)
+                        unique.append(record)
+                stats["duplicates_removed"] = stats.get("duplicates_removed", 0) + len(chunk) - len(unique)
+                return unique
+            return PipelineStage(kind, deduplicate)
+        
+        if kind == "enrich" and spec.get("lookups"):
+            lookups = spec["lookups"]
+            
+            async def lookup_enrich(chunk, offset, stats):
+                enriched, lookup_stats = await join_lookups(chunk, lookups)
+                stats["matched"] = stats.get("matched", 0) + sum(s["matched"] for s in lookup_stats)
+                return enriched
+            return PipelineStage(kind, lookup_enrich)
+        
+        if kind == "enrich":
+            sources = spec.get("sources", ["company_db", "geo_api"])
+            return PipelineStage(kind, lambda chunk, offset, stats: [{**r, **enrichment_for(r, sources)} for r in chunk])
+        
+        raise ValueError(f"Unknown pipeline stage: {kind}")
+
+    async def _parse_document(self, payload: dict) -> dict:
+        doc_type = payload.get("document_type", "invoice")
+        document_id = payload.get("document_id")
+        
+        if document_id:
+            # Uploaded via /agents/{id}/documents and spooled to disk. The file
+            # stays until the task is finished (a retry needs it again)
+            result = await parse_document(document_path(document_id), doc_type)
+            return {"document_id": document_id, "filename": payload.get("filename"), **result}
+        
+        text = payload.get("content") or payload.get("text")
+        if not text:
+            raise ValueError("parse_document needs a document_id (upload) or inline content")
+        return await asyncio.to_thread(parse_text, text, doc_type)
+
+
+# ── record helpers shared by the single-step tasks and run_pipeline ──────────
+
+def enrichment_for(record: dict, sources: List[str]) -> dict:
+    enrichment = {}
+    if "company_db" in sources:
+        enrichment["company_size"] = random.choice(["1-10", "11-50", "51-200", "201-1000", "1000+"])
+        enrichment["industry"] = random.choice(["SaaS", "FinTech", "Healthcare", "E-commerce", "Enterprise"])
+    if "geo_api" in sources:
+        enrichment["timezone"] = random.choice(["America/New_York", "Europe/London", "Asia/Tokyo"])
+        enrichment["country_code"] = random.choice(["US", "GB", "DE", "FR", "JP"])
+    return enrichment
+
+
+def check_dedup_options(spec: dict) -> None:
+    # The persistent index stores exact keys; fuzzy matches can't be looked up in it
+    if spec.get("mode") == "fuzzy" and spec.get("persistent"):
+        raise ValueError("deduplicate: 'persistent' can't be combined with mode 'fuzzy'")
+
+
+def dedup_key(record: dict, key_fields: List[str]) -> tuple:
+    return tuple(str(record.get(f, "")).lower() for f in key_fields)
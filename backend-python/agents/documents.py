@@ -0,0 +1,482 @@
+"""
+Document Parsing — field extraction from plain-text, CSV and simple PDF
+documents without reading them into memory.
+Uploads are spooled to DOCUMENT_SPOOL_DIR and memory-mapped. The parent only
+scans the map for page boundaries (form feeds, or DOCUMENT_PAGE_BYTES spans
+snapped to a newline; CSV row spans; PDF content streams); each page is then
+read and parsed on its own, on a process pool for documents of at least
+DOCUMENT_PROCESS_MIN_BYTES, so memory stays flat however many pages there are.
+
+Fields are found with labelled regexes per document type ("Invoice No: ...",
+"Total: ..."). A candidate's confidence starts at 0.6 for a labelled match
+(0.4 for a bare one), gains 0.3 if it passes the field's FIELD_VALIDATORS
+regex (dates are normalized to ISO first) or loses 0.25 if it fails, and
+fields without a validator get 0.15. Across pages, repeats of the same value
+add 0.05 each and conflicting values subtract 0.1 each (two at most).
+"""
+import asyncio
+import csv
+import mmap
+import os
+import re
+import tempfile
+import time
+import uuid
+import zlib
+from functools import lru_cache
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from agents.transforms import OPERATIONS
+from agents.validation import FIELD_VALIDATORS
+from core.process_pool import ProcessPool
+from core.progress import report_progress
+
+DOCUMENT_SPOOL_DIR = os.getenv("DOCUMENT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "findaworker-documents"))
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(200 * 1024 * 1024)))
+DOCUMENT_PAGE_BYTES = int(os.getenv("DOCUMENT_PAGE_BYTES", str(64 * 1024)))
+DOCUMENT_PROCESS_MIN_BYTES = int(os.getenv("DOCUMENT_PROCESS_MIN_BYTES", str(1024 * 1024)))
+DOCUMENT_SPOOL_TTL_HOURS = float(os.getenv("DOCUMENT_SPOOL_TTL_HOURS", "168"))
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", str(min(os.cpu_count() or 2, 8))))
+DOCUMENT_REVIEW_CONFIDENCE = float(os.getenv("DOCUMENT_REVIEW_CONFIDENCE", "0.75"))
+
+FORMATS = ("text", "csv", "pdf")
+LIST_LIMIT = 200        # items kept per list field (line items, clauses, ...)
+_VALUES_PER_FIELD = 20  # distinct candidate values tracked per scalar field
+_COPY_CHUNK = 1024 * 1024
+_DOCUMENT_ID = re.compile(r"^[0-9a-f]{32}\.(txt|csv|pdf)$")
+
+
+# ── field specs ───────────────────────────────────────────────────────────
+class FieldSpec(NamedTuple):
+    name: str
+    pattern: Optional["re.Pattern"]  # None for labelled fields; see _label_pattern
+    validator: Optional[str] = None  # FIELD_VALIDATORS key
+    label: Optional[str] = None
+    items: Optional[Tuple[str, ...]] = None  # set for list fields: one key per group
+
+
+def _labelled(name: str, label: str, validator: Optional[str] = None) -> FieldSpec:
+    return FieldSpec(name, None, validator, label=label)
+
+
+def _bare(name: str, pattern: str, validator: Optional[str] = None, flags: int = re.I) -> FieldSpec:
+    return FieldSpec(name, re.compile(pattern, flags), validator)
+
+
+def _items(name: str, pattern: str, *keys: str, flags: int = re.M) -> FieldSpec:
+    return FieldSpec(name, re.compile(pattern, flags), items=keys)
+
+
+_AMOUNT = r"[-−]?\$?\s?[\d,]+(?:\.\d{1,2})?"
+
+DOCUMENT_FIELDS: Dict[str, List[FieldSpec]] = {
+    "invoice": [
+        _labelled("invoice_number", r"invoice[\s_]*(?:no\.?|number|num|#|id)"),
+        _labelled("date", r"(?:invoice[\s_]*)?date|issued(?:[\s_]*on)?", "date"),
+        _labelled("vendor", r"vendor|supplier|seller|bill(?:ed)?[\s_]*from|from"),
+        _labelled("amount", r"(?:grand[\s_]*)?total(?:[\s_]*amount)?|amount(?:[\s_]*due)?|balance[\s_]*due", "amount"),
+        _labelled("tax", r"(?:sales[\s_]*)?tax|vat|gst", "amount"),
+        _items("line_items",
+               rf"^[ \t]*(\S.*?)[ \t]{{2,}}(\d+(?:\.\d+)?)[ \t]+({_AMOUNT})[ \t]+({_AMOUNT})[ \t]*$",
+               "description", "quantity", "unit_price", "total"),
+    ],
+    "contract": [
+        _bare("parties", r"\bbetween[ \t]+(.+?),?[ \t]+and[ \t]+(.+?)(?:[ \t]*[,.(]|$)", flags=re.I | re.M),
+        _labelled("effective_date", r"effective[\s_]*date|commencement[\s_]*date|dated", "date"),
+        _bare("term_months", r"\b(?:term|period)[ \t]+of[ \t]+(\d+)[ \t]+months?"),
+        _labelled("value", r"(?:contract[\s_]*)?value|total[\s_]*(?:fee|price|value)|consideration", "amount"),
+        _items("clauses", r"^[ \t]*(\d+(?:\.\d+)*)\.?[ \t]+([A-Z][^\n]{2,80}?)[ \t]*$", "number", "title"),
+    ],
+    "form": [
+        _labelled("applicant_name", r"(?:applicant|full)[\s_]*name|name"),
+        _labelled("date", r"date(?:[\s_]*signed)?", "date"),
+        _labelled("email", r"e-?mail(?:[\s_]*address)?", "email"),
+        _labelled("phone", r"phone(?:[\s_]*number)?|tel(?:ephone)?|mobile", "phone"),
+        _items("fields", r"^[ \t]*([A-Za-z][\w /]{1,40}?)[ \t]*:[ \t]*(\S.*?)[ \t]*$", "label", "value"),
+        _items("signatures", r"^[ \t]*(?:signature|signed(?:[ \t]+by)?)[ \t]*[:\-][ \t]*(\S.*?)[ \t]*$", "signed_by",
+               flags=re.I | re.M),
+    ],
+}
+# Anything else: unlabelled values that look like a known field type
+GENERIC_FIELDS = [
+    _bare("email", r"[\w.\-]+@[\w\-]+(?:\.[\w\-]+)*\.\w{2,}", "email"),
+    _bare("phone", r"(?<!\d)\+?\(?\d{3}\)?[ \-.]?\d{3}[ \-.]?\d{4}(?!\d)", "phone"),
+    _bare("date", r"\b(?:\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{4})\b", "date"),
+    _bare("amount", r"\$[\d,]+(?:\.\d{2})?", "amount"),
+]
+
+
+def fields_for(document_type: str) -> List[FieldSpec]:
+    return DOCUMENT_FIELDS.get(document_type, GENERIC_FIELDS)
+
+
+@lru_cache(maxsize=None)
+def _label_pattern(document_type: str) -> Optional["re.Pattern"]:
+    """All of a type's labelled fields in one pattern, so a page is scanned
+    once for them. "Label: value" starts a line or a column (after 2+
+    spaces); the value runs to the line end or the next column. Group
+    `f<i>` names the spec that matched."""
+    specs = [s for s in fields_for(document_type) if s.label]
+    if not specs:
+        return None
+    labels = "|".join(f"(?P<f{i}>{s.label})" for i, s in enumerate(specs))
+    return re.compile(
+        rf"(?:^[ \t]*|[ \t]{{2,}})(?:{labels})(?![a-z])[ \t]*[:#\-]?[ \t]*(?P<value>\S.*?)(?=[ \t]{{2,}}|[ \t]*$)",
+        re.I | re.M,
+    )
+
+
+_VALIDATORS = {name: re.compile(p) for name, p in FIELD_VALIDATORS.items()}
+_to_iso_date = OPERATIONS["format_date"]({})
+
+
+def _normalize(value: str, validator: Optional[str]) -> str:
+    value = value.strip().rstrip(".,;")
+    if validator == "date":
+        return _to_iso_date(value)
+    if validator == "amount":
+        return value.replace(" ", "").replace("−", "-").lstrip("-")
+    return value
+
+
+def _score(value: str, spec: FieldSpec) -> float:
+    score = 0.6 if spec.label else 0.4
+    if spec.validator:
+        return score + (0.3 if _VALIDATORS[spec.validator].match(value) else -0.25)
+    return score + 0.15
+
+
+# ── page extraction (runs in worker processes) ────────────────────────────
+def extract_fields(text: str, document_type: str) -> dict:
+    """Candidates from one page: {"scalars": {field: [(value, score)]},
+    "lists": {field: [item, ...]}}."""
+    specs = fields_for(document_type)
+    scalars: Dict[str, List[Tuple]] = {s.name: [] for s in specs if not s.items}
+    lists: Dict[str, List[dict]] = {}
+
+    labelled = [s for s in specs if s.label]
+    pattern = _label_pattern(document_type)
+    if pattern is not None:
+        for match in pattern.finditer(text):
+            groups = match.groupdict()
+            spec = next(s for i, s in enumerate(labelled) if groups[f"f{i}"] is not None)
+            _add_candidate(scalars[spec.name], match.group("value"), spec)
+
+    for spec in specs:
+        if spec.label:
+            continue
+        if spec.items:
+            found = lists.setdefault(spec.name, [])
+            for match in spec.pattern.finditer(text):
+                if len(found) >= LIST_LIMIT:
+                    break
+                found.append(dict(zip(spec.items, (g.strip() for g in match.groups()))))
+            continue
+        found = scalars[spec.name]
+        for match in spec.pattern.finditer(text):
+            groups = match.groups()
+            if len(groups) > 1:
+                found.append((tuple(g.strip() for g in groups), _score("", spec)))
+            else:
+                _add_candidate(found, groups[0] if groups else match.group(0), spec)
+            if len(found) >= _VALUES_PER_FIELD:
+                break
+    return {"scalars": scalars, "lists": lists}
+
+
+def _add_candidate(found: List[Tuple], raw: str, spec: FieldSpec) -> None:
+    value = _normalize(raw, spec.validator)
+    if value and len(found) < _VALUES_PER_FIELD:
+        found.append((value, _score(value, spec)))
+
+
+Span = Tuple[int, int, bool]  # byte range, and whether it is a Flate-compressed PDF stream
+
+
+def _parse_page(path: str, fmt: str, span: Span, document_type: str, header: Optional[List[str]]) -> dict:
+    # Each worker maps the file itself and reads only its own page
+    start, end, flate = span
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        raw = mm[start:end]
+    rows = 0
+    if fmt == "pdf":
+        text = _pdf_text(raw, flate)
+    elif fmt == "csv":
+        lines = raw.decode("utf-8", errors="replace").splitlines()
+        rendered = []
+        for row in csv.reader(lines):
+            if header and row != header and any(row):
+                rows += 1
+                # Headers act as labels: "invoice_number: INV-1"
+                rendered.extend(f"{h}: {v}" for h, v in zip(header, row) if v)
+        text = "\n".join(rendered)
+    else:
+        text = raw.decode("utf-8", errors="replace")
+    result = extract_fields(text, document_type)
+    result["rows"] = rows
+    return result
+
+
+# ── PDF content streams ───────────────────────────────────────────────────
+_PDF_STREAM = re.compile(rb"(?<!end)stream\r?\n")
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+_PDF_TEXT = re.compile(
+    rb"\[((?:[^\]\\]|\\.)*)\]\s*TJ"          # [(a) -20 (b)] TJ
+    rb"|\(((?:[^)\\]|\\.)*)\)\s*(?:Tj|'|\")"  # (text) Tj
+    rb"|(?<![A-Za-z])(T\*|Td|TD|ET)(?![A-Za-z])",  # line moves
+    re.S,
+)
+_PDF_STRING = re.compile(rb"\(((?:[^)\\]|\\.)*)\)", re.S)
+_PDF_ESCAPE = re.compile(rb"\\([nrtbf()\\]|[0-7]{1,3})")
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+def _pdf_unescape(s: bytes) -> str:
+    def sub(m):
+        code = m.group(1)
+        if code[:1].isdigit():
+            return bytes([int(code, 8) & 0xFF])
+        return _PDF_ESCAPES.get(code, code)
+    return _PDF_ESCAPE.sub(sub, s).decode("latin-1")
+
+
+def _pdf_text(data: bytes, flate: bool) -> str:
+    if flate:
+        try:
+            data = zlib.decompressobj().decompress(data)
+        except zlib.error:
+            return ""
+    parts = []
+    for match in _PDF_TEXT.finditer(data):
+        array, string, move = match.groups()
+        if array is not None:
+            parts.extend(_pdf_unescape(s) for s in _PDF_STRING.findall(array))
+        elif string is not None:
+            parts.append(_pdf_unescape(string))
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+
+# ── page splitting (parent process, over the memory map) ──────────────────
+def _text_pages(mm: mmap.mmap) -> Iterator[Span]:
+    size, pos = len(mm), 0
+    while pos < size:
+        end = mm.find(b"\f", pos)
+        step = 1
+        if end == -1 or end - pos > DOCUMENT_PAGE_BYTES:
+            newline = mm.find(b"\n", min(pos + DOCUMENT_PAGE_BYTES, size))
+            end, step = (newline + 1, 0) if newline != -1 else (size, 0)
+        if end > pos:
+            yield pos, end, False
+        pos = end + step
+
+
+def _pdf_streams(mm: mmap.mmap) -> Iterator[Span]:
+    for match in _PDF_STREAM.finditer(mm):
+        start = match.end()
+        end = mm.find(b"endstream", start)
+        if end == -1:
+            break
+        head = mm[max(mm.rfind(b"obj", 0, match.start()), 0):match.start()]
+        if b"/Subtype" in head or b"/Length1" in head or b"/Type /XRef" in head:
+            continue  # images, embedded fonts, cross-reference streams
+        yield start, end, b"/FlateDecode" in head
+
+
+def _split(path: str, fmt: str) -> Tuple[List[Span], int, Optional[List[str]]]:
+    """Page spans, the page count to report, and the CSV header."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if fmt == "pdf":
+            spans = list(_pdf_streams(mm))
+            return spans, len(_PDF_PAGE.findall(mm)) or len(spans), None
+        if fmt == "csv":
+            first = mm.find(b"\n")
+            header_end = len(mm) if first == -1 else first + 1
+            header = next(csv.reader([mm[:header_end].decode("utf-8", errors="replace")]), [])
+            spans = [(start + header_end, end + header_end, False)
+                     for start, end, _ in _text_pages(_Offset(mm, header_end))]
+            return spans, len(spans), header
+        spans = list(_text_pages(mm))
+        return spans, len(spans), None
+
+
+class _Offset:
+    """The part of a map after `offset`, with just what _text_pages uses."""
+
+    def __init__(self, mm: mmap.mmap, offset: int):
+        self.mm, self.offset = mm, offset
+
+    def __len__(self) -> int:
+        return len(self.mm) - self.offset
+
+    def find(self, sub: bytes, start: int) -> int:
+        found = self.mm.find(sub, start + self.offset)
+        return -1 if found == -1 else found - self.offset
+
+
+# ── merging ───────────────────────────────────────────────────────────────
+class _Merged:
+    """Running merge of page results; holds only bounded candidate tables."""
+
+    def __init__(self, document_type: str):
+        self.specs = fields_for(document_type)
+        # field → {value: [occurrences, best score, first page]}
+        self.candidates: Dict[str, Dict] = {s.name: {} for s in self.specs if not s.items}
+        self.lists: Dict[str, List[dict]] = {s.name: [] for s in self.specs if s.items}
+        self.rows = 0
+
+    def add(self, page: int, result: dict) -> None:
+        self.rows += result["rows"]
+        for field, found in result["scalars"].items():
+            table = self.candidates[field]
+            for value, score in found:
+                entry = table.get(value)
+                if entry is not None:
+                    entry[0] += 1
+                    entry[1] = max(entry[1], score)
+                elif len(table) < _VALUES_PER_FIELD:
+                    table[value] = [1, score, page]
+        for field, items in result["lists"].items():
+            kept = self.lists[field]
+            kept.extend({**item, "page": page} for item in items[:LIST_LIMIT - len(kept)])
+
+    def fields(self) -> Tuple[dict, dict]:
+        data, confidence = {}, {}
+        for field, table in self.candidates.items():
+            if not table:
+                continue
+            # Best-scoring value; ties go to the most frequent, then the earliest
+            value, (count, score, _) = max(table.items(), key=lambda kv: (kv[1][1], kv[1][0], -kv[1][2]))
+            score += 0.05 * min(count - 1, 2) - 0.1 * min(len(table) - 1, 2)
+            data[field] = list(value) if isinstance(value, tuple) else value
+            confidence[field] = round(min(max(score, 0.0), 0.99), 2)
+        for field, items in self.lists.items():
+            if items:
+                data[field] = items
+                confidence[field] = 0.9
+        return data, confidence
+
+
+# ── entry points ──────────────────────────────────────────────────────────
+def detect_format(filename: str, head: bytes = b"") -> str:
+    if head.startswith(b"%PDF-") or filename.lower().endswith(".pdf"):
+        return "pdf"
+    if filename.lower().endswith(".csv"):
+        return "csv"
+    return "text"
+
+
+def spool_document(source: IO[bytes], filename: str) -> Tuple[str, str, int]:
+    """Copy an upload to the spool directory in bounded chunks. Returns
+    (document_id, format, size); raises ValueError past DOCUMENT_MAX_BYTES."""
+    os.makedirs(DOCUMENT_SPOOL_DIR, exist_ok=True)
+    head = source.read(5)
+    fmt = detect_format(filename or "", head)
+    document_id = f"{uuid.uuid4().hex}.{'txt' if fmt == 'text' else fmt}"
+    path = os.path.join(DOCUMENT_SPOOL_DIR, document_id)
+    size = len(head)
+    with open(path, "wb") as out:
+        out.write(head)
+        while True:
+            chunk = source.read(_COPY_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > DOCUMENT_MAX_BYTES:
+                out.close()
+                os.remove(path)
+                raise ValueError(f"Document exceeds {DOCUMENT_MAX_BYTES} bytes")
+            out.write(chunk)
+    return document_id, fmt, size
+
+
+def document_path(document_id: str) -> str:
+    if not _DOCUMENT_ID.match(document_id or ""):
+        raise ValueError(f"Invalid document_id: {document_id}")
+    path = os.path.join(DOCUMENT_SPOOL_DIR, document_id)
+    if not os.path.exists(path):
+        raise ValueError(f"Document {document_id} not found (already parsed, or spooled on another host?)")
+    return path
+
+
+def discard_document(document_id: str) -> None:
+    try:
+        os.remove(document_path(document_id))
+    except (ValueError, OSError):
+        pass
+
+
+def sweep_spool(max_age_hours: float = DOCUMENT_SPOOL_TTL_HOURS) -> int:
+    """Delete spooled documents older than `max_age_hours` — uploads whose
+    task ended without the spool being discarded (e.g. a worker crash
+    on the last attempt). Returns how many were removed."""
+    if max_age_hours <= 0 or not os.path.isdir(DOCUMENT_SPOOL_DIR):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in os.scandir(DOCUMENT_SPOOL_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+async def parse_document(path: str, document_type: str) -> dict:
+    """Parse a spooled document page by page. Returns extracted fields with
+    per-field confidence; pages are merged as they complete, in order."""
+    fmt = detect_format(path)
+    size = os.path.getsize(path)
+    if not size:
+        raise ValueError("Document is empty")
+    spans, pages, header = await asyncio.to_thread(_split, path, fmt)
+    merged = _Merged(document_type)
+
+    if size < DOCUMENT_PROCESS_MIN_BYTES:
+        def parse_all():
+            for page, span in enumerate(spans, 1):
+                merged.add(page, _parse_page(path, fmt, span, document_type, header))
+        await asyncio.to_thread(parse_all)
+    else:
+        pages_args = ((path, fmt, span, document_type, header) for span in spans)
+        page = 0
+        async for fields in _pool.map_ordered(_parse_page, pages_args):
+            page += 1
+            merged.add(page, fields)
+            await report_progress(stage="parse_document", processed=page, total=len(spans))
+
+    return _result(merged, document_type, fmt, size, pages)
+
+
+def parse_text(text: str, document_type: str) -> dict:
+    """Inline text from a task payload (already in memory): one page, parsed
+    in-process."""
+    merged = _Merged(document_type)
+    merged.add(1, {**extract_fields(text, document_type), "rows": 0})
+    return _result(merged, document_type, "text", len(text.encode()), 1)
+
+
+def _result(merged: _Merged, document_type: str, fmt: str, size: int, pages: int) -> dict:
+    data, confidence = merged.fields()
+    missing = [s.name for s in merged.specs if s.name not in data]
+    result = {
+        "document_type": document_type,
+        "format": fmt,
+        "bytes": size,
+        "pages_processed": pages,
+        "fields_extracted": len(data),
+        "extracted_data": data,
+        "field_confidence": confidence,
+        "missing_fields": missing,
+        "confidence_score": round(sum(confidence.values()) / len(confidence), 2) if confidence else 0.0,
+        "requires_review": bool(missing) or any(c < DOCUMENT_REVIEW_CONFIDENCE for c in confidence.values()),
+    }
+    if fmt == "csv":
+        result["rows"] = merged.rows
+    return result
+
+
+_pool = ProcessPool(DOCUMENT_WORKERS)
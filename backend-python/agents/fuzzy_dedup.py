@@ -0,0 +1,187 @@
+"""
+Fuzzy Deduplication — MinHash signatures bucketed with LSH bands.
+Each record's key fields are normalized and cut into character shingles; a
+MinHash signature over the shingles estimates Jaccard similarity between
+records. Signatures use one-permutation hashing (each shingle hashed once
+into one of `num_perm` bins, empty bins densified from their neighbours),
+so building one costs O(shingles) rather than O(shingles × num_perm).
+Signatures are split into bands, and records sharing any band bucket
+become candidates. Up to `max_candidates` of them, most shared bands
+first, are verified by exact shingle Jaccard against `threshold`. Each
+record is compared only with a bounded number of cluster representatives,
+so work grows roughly linearly with the batch.
+
+Clusters are formed incrementally: a record joins the most similar
+representative that passes verification, otherwise it becomes a new
+representative. That lets the same index serve whole batches and chunked
+run_pipeline streams.
+"""
+import operator
+import re
+import zlib
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Optional, Sequence, Tuple
+
+_MIX = 0x9E3779B1  # spreads crc32 values evenly across bins
+_SPACE = re.compile(r"\s+")
+
+SURVIVOR_STRATEGIES = ("first", "most_complete")
+# Payload keys passed through to FuzzyDeduplicator
+FUZZY_OPTIONS = ("threshold", "num_perm", "bands", "shingle_size", "max_candidates")
+
+
+class FuzzyDeduplicator:
+    def __init__(
+        self,
+        key_fields: Sequence[str],
+        threshold: float = 0.6,
+        num_perm: int = 96,
+        bands: int = 32,
+        shingle_size: int = 3,
+        max_candidates: int = 16,
+        bucket_cap: int = 64,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+        self.key_fields = list(key_fields)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_candidates = max_candidates
+        self.bucket_cap = bucket_cap
+        # Bin values stay below `_span`, so borrowed (offset) values fit in uint32
+        self._span = (1 << 32) // num_perm
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        # Shingle hashes of representatives only, for exact verification
+        self._shingle_sets: Dict[int, array] = {}
+        self.clusters: Dict[int, List[int]] = {}  # representative → duplicate indices
+        self._count = 0
+        self.comparisons = 0
+
+    # ── public API ────────────────────────────────────────────────────────
+    def add(self, record: dict) -> Tuple[int, Optional[int]]:
+        """Index the next record. Returns (its index, the representative it
+        duplicates or None if it starts a new cluster)."""
+        index = self._count
+        self._count += 1
+        shingles = self._shingles(record)
+        if not shingles:
+            return index, None  # nothing to compare on; always kept
+        signature = self._signature(shingles)
+        # Bands take every `bands`-th bin so a run of densified neighbours
+        # (all borrowed from one filled bin) doesn't make up a whole band
+        band_keys = [(b, signature[b::self.bands].tobytes()) for b in range(self.bands)]
+
+        # Representatives sharing more bands are likelier matches; verify those first
+        buckets = self._buckets
+        hits = Counter(chain.from_iterable(buckets[key] for key in band_keys if key in buckets))
+        best, best_score = None, self.threshold
+        if hits:
+            mine = set(shingles)
+            for rep, _ in hits.most_common(self.max_candidates):
+                self.comparisons += 1
+                score = _jaccard(mine, self._shingle_sets[rep])
+                if score >= best_score:
+                    best, best_score = rep, score
+
+        if best is not None:
+            self.clusters.setdefault(best, []).append(index)
+            return index, best
+        self._shingle_sets[index] = array("I", shingles)
+        for key in band_keys:
+            bucket = self._buckets.setdefault(key, [])
+            if len(bucket) < self.bucket_cap:
+                bucket.append(index)
+        return index, None
+
+    def similarity(self, a: dict, b: dict) -> float:
+        """Jaccard similarity of two records' key-field shingles."""
+        return _jaccard(set(self._shingles(a)), self._shingles(b))
+
+    # ── internals ─────────────────────────────────────────────────────────
+    def _shingles(self, record: dict) -> List[int]:
+        k = self.shingle_size
+        grams = set()
+        for position, field in enumerate(self.key_fields):
+            value = record.get(field)
+            if value in (None, ""):
+                continue
+            text = _SPACE.sub(" ", str(value).lower()).strip()
+            prefix = f"{position}\x1f"  # keep grams from different fields apart
+            if len(text) <= k:
+                grams.add(prefix + text)
+            else:
+                grams.update(prefix + text[i:i + k] for i in range(len(text) - k + 1))
+        return [zlib.crc32(g.encode()) for g in grams]
+
+    def _signature(self, hashes: List[int]) -> array:
+        n = self.num_perm
+        slots: List[Optional[int]] = [None] * n
+        for h in hashes:
+            h = (h * _MIX) & 0xFFFFFFFF
+            b, v = h % n, h // n
+            current = slots[b]
+            if current is None or v < current:
+                slots[b] = v
+        # Densify: an empty bin borrows the next filled bin's value (wrapping),
+        # offset by the distance so only identical borrows compare equal
+        signature = list(slots)
+        nearest, distance = None, 0
+        for i in range(2 * n - 1, -1, -1):
+            value = slots[i % n]
+            if value is not None:
+                nearest, distance = value, 0
+            else:
+                distance += 1
+                if i < n:
+                    signature[i] = nearest + distance * self._span
+        return array("I", signature)
+
+    def estimate(self, a: dict, b: dict) -> float:
+        """MinHash estimate of the similarity of two records (what LSH sees)."""
+        sa, sb = self._shingles(a), self._shingles(b)
+        if not sa or not sb:
+            return 0.0
+        return sum(map(operator.eq, self._signature(sa), self._signature(sb))) / self.num_perm
+
+
+def _jaccard(mine: set, other) -> float:
+    if not mine:
+        return 0.0
+    shared = len(mine.intersection(other))
+    return shared / (len(mine) + len(other) - shared)
+
+
+def fuzzy_deduplicate(
+    records: List[dict], key_fields: Sequence[str], survivor: str = "most_complete", **options
+) -> Tuple[List[dict], List[dict], int]:
+    """Cluster a whole batch. Returns (unique records in input order, clusters,
+    candidate comparisons). Each cluster names its surviving record; the
+    others are dropped."""
+    if survivor not in SURVIVOR_STRATEGIES:
+        raise ValueError(f"survivor must be one of: {', '.join(SURVIVOR_STRATEGIES)}")
+    dedup = FuzzyDeduplicator(key_fields, **options)
+    for record in records:
+        dedup.add(record)
+
+    dropped = set()
+    clusters = []
+    for rep, duplicates in dedup.clusters.items():
+        members = [rep] + duplicates
+        keep = rep if survivor == "first" else max(members, key=lambda i: (_filled(records[i]), -i))
+        dropped.update(i for i in members if i != keep)
+        clusters.append({"survivor": keep, "members": members, "size": len(members)})
+    unique = [r for i, r in enumerate(records) if i not in dropped]
+    return unique, clusters, dedup.comparisons
+
+
+def fuzzy_options(payload: dict) -> dict:
+    return {k: payload[k] for k in FUZZY_OPTIONS if k in payload}
+
+
+def _filled(record: dict) -> int:
+    return sum(1 for v in record.values() if v not in (None, ""))
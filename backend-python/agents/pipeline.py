@@ -0,0 +1,78 @@
+"""
+Record Pipeline — streams records through an ordered list of stages.
+Records are cut into bounded chunks and pulled through chained async
+generators, so each chunk passes every stage before the next one is read
+and no stage materializes a full intermediate copy. Only the final output
+and per-stage stats are kept.
+"""
+import asyncio
+import inspect
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+
+from core.progress import report_progress
+
+PIPELINE_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", "1000"))
+
+# process(chunk, offset, stats) -> output chunk (or an awaitable of one, for
+# stages that do I/O). `offset` is the index of the chunk's first record in
+# the stage's input; `stats` is the stage's own dict for stage counters.
+StageFn = Callable[[List[dict], int, dict], List[dict]]
+# finish(stats) -> awaitable, run once after the stage's last chunk
+FinishFn = Callable[[dict], Awaitable[None]]
+
+
+class PipelineStage:
+    def __init__(self, name: str, process: StageFn, finish: Optional[FinishFn] = None):
+        self.name = name
+        self.process = process
+        self.finish = finish
+        self.stats = {"stage": name, "input": 0, "output": 0, "seconds": 0.0}
+
+    async def run(self, chunks: AsyncIterator[List[dict]]) -> AsyncIterator[List[dict]]:
+        stats = self.stats
+        async for chunk in chunks:
+            started = time.perf_counter()
+            out = self.process(chunk, stats["input"], stats)
+            if inspect.isawaitable(out):
+                out = await out
+            stats["seconds"] += time.perf_counter() - started
+            stats["input"] += len(chunk)
+            stats["output"] += len(out)
+            if out:
+                yield out
+        if self.finish is not None:
+            await self.finish(stats)
+
+
+class RecordPipeline:
+    def __init__(self, stages: List[PipelineStage], chunk_size: int = PIPELINE_CHUNK_SIZE):
+        self.stages = stages
+        self.chunk_size = max(int(chunk_size), 1)
+
+    async def run(self, records: List[dict]) -> List[dict]:
+        stream: AsyncIterator[List[dict]] = _aiter(chunked(records, self.chunk_size))
+        for stage in self.stages:
+            stream = stage.run(stream)
+        output: List[dict] = []
+        async for chunk in stream:
+            output.extend(chunk)
+            consumed = self.stages[0].stats["input"] if self.stages else len(output)
+            await report_progress(stage="pipeline", processed=consumed, total=len(records), output=len(output))
+            # One chunk at a time: let other tasks run between chunks
+            await asyncio.sleep(0)
+        return output
+
+    def stats(self) -> List[dict]:
+        return [{**s.stats, "seconds": round(s.stats["seconds"], 4)} for s in self.stages]
+
+
+def chunked(records: List[dict], size: int) -> Iterator[List[dict]]:
+    for start in range(0, len(records), size):
+        yield records[start:start + size]
+
+
+async def _aiter(chunks: Iterator[List[dict]]) -> AsyncIterator[List[dict]]:
+    for chunk in chunks:
+        yield chunk
@@ -0,0 +1,13 @@
+"""
+Agent Registry - maps persisted agent types to their implementation classes
+"""
+from agents.customer_support import CustomerSupportAgent
+from agents.data_entry import DataEntryAgent
+from agents.software_engineer import SoftwareEngineerAgent
+
+
+AGENT_CLASSES = {
+    "customer_support": CustomerSupportAgent,
+    "data_entry": DataEntryAgent,
+    "software_engineer": SoftwareEngineerAgent,
+}
@@ -3,29 +3,25 @@ Software Engineer Agent
 Handles code generation, review, testing, bug detection, documentation, and refactoring.
 Powered by Claude (Anthropic) for real AI-driven results.
 """
-import asyncio
 import os
 import json
 import random
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Awaitable, Callable, List, Optional
 from agents.base import BaseAgent
 
-try:
-    from anthropic import Anthropic
-except ImportError:
-    Anthropic = None
+from core.llm import get_llm_client, llm_slot
+from core.llm_cache import cache_key, llm_cache
+from core.progress import progress_enabled, report_progress
+from core.prometheus import LLM_CACHE, LLM_CALLS, LLM_TOKENS
 
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 MODEL = "claude-sonnet-4-20250514"
 
-
-def _get_client():
-    key = os.getenv("ANTHROPIC_API_KEY", "")
-    if not key or Anthropic is None:
-        return None
-    return Anthropic(api_key=key)
+# Minimum gap between streamed task_progress events, in seconds
+STREAM_PROGRESS_INTERVAL = float(os.getenv("STREAM_PROGRESS_INTERVAL", "0.25"))
 
 
 def _strip_fences(text: str) -> str:
@@ -39,18 +35,118 @@ def _strip_fences(text: str) -> str:
     return text.strip()
 
 
-def _ask_claude(system: str, prompt: str, max_tokens: int = 4096) -> str:
-    """Synchronous helper — called inside asyncio.to_thread so it won't block."""
-    client = _get_client()
+async def _ask_claude(
+    system: str, prompt: str, max_tokens: int = 4096, no_cache: bool = False,
+    stream: bool = False, on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
+    """Call Claude on the shared async client, within the global concurrency cap.
+    Responses are cached; `no_cache` skips the lookup and refreshes the entry.
+    With `stream`, partial output is reported as task progress while it is
+    generated (and passed to `on_text`); the returned text is the same."""
+    key = cache_key(MODEL, system, prompt, max_tokens)
+    if not no_cache:
+        cached = await llm_cache.get(key)
+        LLM_CACHE.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+    client = get_llm_client()
     if client is None:
         return "[Claude unavailable — ANTHROPIC_API_KEY not set or anthropic package missing]"
-    message = client.messages.create(
+    mode = "stream" if stream and progress_enabled() else "create"
+    async with llm_slot():
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            if mode == "stream":
+                text, usage = await _stream_claude(client, system, prompt, max_tokens, on_text)
+            else:
+                message = await client.messages.create(
+                    model=MODEL,
+                    max_tokens=max_tokens,
+                    system=system,
+                    messages=[{"role": "user", "content": prompt}],
+                )
+                text, usage = message.content[0].text, message.usage
+            outcome = "ok"
+        finally:
+            LLM_CALLS.observe(time.perf_counter() - started, model=MODEL, mode=mode, outcome=outcome)
+    LLM_TOKENS.inc(usage.input_tokens, model=MODEL, kind="input")
+    LLM_TOKENS.inc(usage.output_tokens, model=MODEL, kind="output")
+    await llm_cache.put(key, text, model=MODEL)
+    return text
+
+
+async def _stream_claude(client, system: str, prompt: str, max_tokens: int, on_text):
+    """Stream a completion; returns (text, usage)."""
+    chunks: List[str] = []
+    pending: List[str] = []
+    chars = 0
+    last_emit = time.monotonic()
+    async with client.messages.stream(
         model=MODEL,
         max_tokens=max_tokens,
         system=system,
         messages=[{"role": "user", "content": prompt}],
-    )
-    return message.content[0].text
+    ) as response:
+        async for delta in response.text_stream:
+            chunks.append(delta)
+            pending.append(delta)
+            chars += len(delta)
+            if on_text is not None:
+                await on_text(delta)
+            now = time.monotonic()
+            if now - last_emit >= STREAM_PROGRESS_INTERVAL:
+                await report_progress(stage="generating", delta="".join(pending), chars=chars)
+                pending.clear()
+                last_emit = now
+        final = await response.get_final_message()
+    if pending:
+        await report_progress(stage="generating", delta="".join(pending), chars=chars)
+    return "".join(chunks), final.usage
+
+
+class _ProjectFileScanner:
+    """Incrementally scans generate_project JSON output and yields each
+    file object as soon as its closing brace arrives."""
+
+    def __init__(self):
+        self._buf: List[str] = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._obj_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[dict]:
+        files = []
+        for ch in text:
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+                if self._depth == 2:
+                    self._obj_start = self._pos
+            elif ch == "}":
+                if self._depth == 2 and self._obj_start is not None:
+                    try:
+                        obj = json.loads("".join(self._buf[self._obj_start:]))
+                    except json.JSONDecodeError:
+                        obj = None
+                    if isinstance(obj, dict) and "path" in obj and "content" in obj:
+                        files.append(obj)
+                    self._obj_start = None
+                self._depth -= 1
+            self._pos += 1
+        return files
 
 
 class SoftwareEngineerAgent(BaseAgent):
@@ -99,7 +195,7 @@ class SoftwareEngineerAgent(BaseAgent):
         parts.append(f"Preferred frameworks: {', '.join(self.frameworks)}")
         prompt = "\n".join(parts)
 
-        code = await asyncio.to_thread(_ask_claude, system, prompt)
+        code = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False), stream=True)
         code = _strip_fences(code)
         lines = len(code.strip().split("\n"))
 
@@ -140,7 +236,7 @@ class SoftwareEngineerAgent(BaseAgent):
         else:
             prompt += "\nNo code diff provided — give a generic but helpful review template."
 
-        raw = await asyncio.to_thread(_ask_claude, system, prompt)
+        raw = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False))
         try:
             result = json.loads(raw)
         except json.JSONDecodeError:
@@ -178,7 +274,7 @@ class SoftwareEngineerAgent(BaseAgent):
         if code:
             prompt += f"\nSource code:\n{code}\n"
 
-        test_code = await asyncio.to_thread(_ask_claude, system, prompt)
+        test_code = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False))
 
         return {
             "test_code": test_code.strip(),
@@ -203,7 +299,7 @@ class SoftwareEngineerAgent(BaseAgent):
             "No code was provided. Return an example bug report structure so the user knows what to send."
         )
 
-        raw = await asyncio.to_thread(_ask_claude, system, prompt)
+        raw = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False))
         try:
             result = json.loads(raw)
         except json.JSONDecodeError:
@@ -226,7 +322,7 @@ class SoftwareEngineerAgent(BaseAgent):
         if code:
             prompt += f"\nSource code:\n{code}\n"
 
-        docs = await asyncio.to_thread(_ask_claude, system, prompt)
+        docs = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False))
 
         return {
             "documentation": docs.strip(),
@@ -252,7 +348,7 @@ class SoftwareEngineerAgent(BaseAgent):
             prompt += f" (focus on `{target}`)"
         prompt += f":\n\n{code}\n" if code else ".\nNo code provided — return an explanation of what you'd need."
 
-        raw = await asyncio.to_thread(_ask_claude, system, prompt)
+        raw = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False))
         try:
             result = json.loads(raw)
         except json.JSONDecodeError:
@@ -283,7 +379,7 @@ class SoftwareEngineerAgent(BaseAgent):
             f"Include: timestamps, indexes, and a rollback statement as a SQL comment at the end."
         )
 
-        sql = await asyncio.to_thread(_ask_claude, system, prompt)
+        sql = await _ask_claude(system, prompt, no_cache=payload.get("no_cache", False))
 
         return {
             "migration_sql": sql.strip(),
@@ -334,7 +430,19 @@ class SoftwareEngineerAgent(BaseAgent):
         parts.append("\nRespond with ONLY the JSON object. No other text.")
         prompt = "\n".join(parts)
 
-        raw = await asyncio.to_thread(_ask_claude, system, prompt, max_tokens=16000)
+        scanner = _ProjectFileScanner()
+        files_streamed = 0
+
+        async def surface_files(delta: str) -> None:
+            nonlocal files_streamed
+            for f in scanner.feed(delta):
+                files_streamed += 1
+                await report_progress(stage="file", file=f, files_completed=files_streamed)
+
+        raw = await _ask_claude(
+            system, prompt, max_tokens=16000, no_cache=payload.get("no_cache", False),
+            stream=True, on_text=surface_files,
+        )
         raw = _strip_fences(raw)
 
         # Try to extract JSON if Claude added any preamble
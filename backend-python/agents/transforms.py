@@ -0,0 +1,217 @@
+"""
+Transformation Plans — compiles a DataEntryAgent `transformations` list into
+per-field callables once per task.
+Each step is resolved to a function up front (regexes compiled, formats and
+casts looked up), and consecutive steps on the same field are composed, so
+applying a plan is one dict copy plus a call per field. Batches above
+TRANSFORM_PROCESS_THRESHOLD are split into shards and run on a process pool;
+shards come back in input order.
+
+Step spec: {"field": ..., "operation": ..., "target": <optional output field>, ...}
+    uppercase, lowercase, trim
+    regex_replace   pattern, replacement (default ""), ignore_case
+    cast            to: int | float | str | bool
+    split           separator (default ","), maxsplit, strip (default true)
+    join            separator (default ", ")
+    format_date     input_format (str or list; default: ISO and common formats),
+                    output_format (default "%Y-%m-%d")
+    default         value — used when the field is missing, None or ""
+cast and format_date leave a value unchanged if it can't be converted,
+or set it to None with "on_error": "null".
+"""
+import asyncio
+import json
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+from core.process_pool import ProcessPool
+
+TRANSFORM_PROCESS_THRESHOLD = int(os.getenv("TRANSFORM_PROCESS_THRESHOLD", "50000"))
+TRANSFORM_SHARD_SIZE = int(os.getenv("TRANSFORM_SHARD_SIZE", "10000"))
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", str(min(os.cpu_count() or 2, 8))))
+
+DATE_FORMATS = (
+    "%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y", "%d.%m.%Y",
+    "%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y", "%Y%m%d",
+)
+
+_MISSING = object()
+Fn = Callable[[Any], Any]
+
+
+class TransformPlan:
+    def __init__(self, transformations: List[dict]):
+        # (source field, target field, fn, fills missing values)
+        self.steps: List[Tuple[str, str, Fn, bool]] = []
+        for spec in transformations:
+            field = spec.get("field")
+            if not field:
+                raise ValueError("Each transformation needs a field")
+            target = spec.get("target") or field
+            fn = _compile_step(spec)
+            fills = spec.get("operation") == "default"
+            last = self.steps[-1] if self.steps else None
+            if last and last[0] == last[1] == field == target and not fills and not last[3]:
+                self.steps[-1] = (field, field, _compose(last[2], fn), False)
+            else:
+                self.steps.append((field, target, fn, fills))
+
+    def apply(self, record: dict) -> dict:
+        new_record = dict(record)
+        for field, target, fn, fills in self.steps:
+            value = new_record.get(field, _MISSING)
+            if value is _MISSING:
+                if fills:
+                    new_record[target] = fn(None)
+                continue
+            new_record[target] = fn(value)
+        return new_record
+
+    def apply_all(self, records: List[dict]) -> List[dict]:
+        apply = self.apply
+        return [apply(r) for r in records]
+
+
+def compile_plan(transformations: List[dict]) -> TransformPlan:
+    return _compile_cached(json.dumps(transformations))
+
+
+@lru_cache(maxsize=128)
+def _compile_cached(key: str) -> TransformPlan:
+    return TransformPlan(json.loads(key))
+
+
+async def transform_records(transformations: List[dict], records: List[dict]) -> AsyncIterator[List[dict]]:
+    """Yield transformed records in input order, shard by shard, off the
+    event loop: in a thread for small batches, on the process pool above
+    TRANSFORM_PROCESS_THRESHOLD."""
+    plan = compile_plan(transformations)  # fail fast on bad specs
+    if len(records) < TRANSFORM_PROCESS_THRESHOLD:
+        yield await asyncio.to_thread(plan.apply_all, records)
+        return
+
+    key = json.dumps(transformations)
+    shards = ((key, records[start:start + TRANSFORM_SHARD_SIZE])
+              for start in range(0, len(records), TRANSFORM_SHARD_SIZE))
+    async for shard in _pool.map_ordered(_transform_shard, shards):
+        yield shard
+
+
+_pool = ProcessPool(TRANSFORM_WORKERS)
+
+
+def _transform_shard(key: str, records: List[dict]) -> List[dict]:
+    # Runs in a worker process; the plan is compiled once per worker
+    return _compile_cached(key).apply_all(records)
+
+
+# ── operations ────────────────────────────────────────────────────────────
+def _compile_step(spec: dict) -> Fn:
+    op = spec.get("operation")
+    builder = OPERATIONS.get(op)
+    if builder is None:
+        raise ValueError(f"Unknown transformation: {op}")
+    return builder(spec)
+
+
+def _compose(first: Fn, second: Fn) -> Fn:
+    return lambda value: second(first(value))
+
+
+def _on_error(spec: dict, value: Any) -> Any:
+    return None if spec.get("on_error") == "null" else value
+
+
+def _regex_replace(spec: dict) -> Fn:
+    source = spec.get("pattern")
+    if not isinstance(source, str) or not source:
+        raise ValueError("regex_replace: 'pattern' must be a non-empty string")
+    try:
+        pattern = re.compile(source, re.IGNORECASE if spec.get("ignore_case") else 0)
+    except re.error as e:
+        raise ValueError(f"regex_replace: invalid pattern {source!r}: {e}") from e
+    replacement = spec.get("replacement", "")
+    return lambda value: pattern.sub(replacement, str(value))
+
+
+_CASTS: Dict[str, Fn] = {
+    "int": lambda v: int(float(v)) if isinstance(v, str) and "." in v else int(v),
+    "float": float,
+    "str": str,
+    "bool": lambda v: v if isinstance(v, bool) else str(v).strip().lower() in ("1", "true", "yes", "y", "t"),
+}
+
+
+def _cast(spec: dict) -> Fn:
+    to = spec.get("to")
+    if to not in _CASTS:
+        raise ValueError(f"cast: 'to' must be one of: {', '.join(_CASTS)}")
+    convert = _CASTS[to]
+
+    def cast(value):
+        try:
+            return convert(value.strip() if isinstance(value, str) and to != "str" else value)
+        except (TypeError, ValueError):
+            return _on_error(spec, value)
+    return cast
+
+
+def _split(spec: dict) -> Fn:
+    separator = spec.get("separator", ",")
+    maxsplit = spec.get("maxsplit", -1)
+    strip = spec.get("strip", True)
+
+    def split(value):
+        if isinstance(value, list):
+            return value
+        parts = str(value).split(separator, maxsplit)
+        return [p.strip() for p in parts] if strip else parts
+    return split
+
+
+def _join(spec: dict) -> Fn:
+    separator = spec.get("separator", ", ")
+    return lambda value: separator.join(str(v) for v in value) if isinstance(value, (list, tuple)) else str(value)
+
+
+def _format_date(spec: dict) -> Fn:
+    input_format = spec.get("input_format")
+    formats = [input_format] if isinstance(input_format, str) else list(input_format or DATE_FORMATS)
+    output_format = spec.get("output_format", "%Y-%m-%d")
+    try_iso = not input_format
+
+    def format_date(value):
+        text = str(value).strip()
+        if try_iso:
+            try:
+                return datetime.fromisoformat(text).strftime(output_format)
+            except ValueError:
+                pass
+        for fmt in formats:
+            try:
+                return datetime.strptime(text, fmt).strftime(output_format)
+            except ValueError:
+                continue
+        return _on_error(spec, value)
+    return format_date
+
+
+def _default(spec: dict) -> Fn:
+    fill = spec.get("value")
+    return lambda value: fill if value is None or value == "" else value
+
+
+OPERATIONS: Dict[str, Callable[[dict], Fn]] = {
+    "uppercase": lambda spec: lambda value: str(value).upper(),
+    "lowercase": lambda spec: lambda value: str(value).lower(),
+    "trim": lambda spec: lambda value: str(value).strip(),
+    "regex_replace": _regex_replace,
+    "cast": _cast,
+    "split": _split,
+    "join": _join,
+    "format_date": _format_date,
+    "default": _default,
+}
@@ -0,0 +1,187 @@
+"""
+Record Validation — compiles a DataEntryAgent `schema` into column checks.
+Each schema field becomes a list of precompiled checks (regexes compiled once,
+limits and enum sets resolved up front). Validation pulls one column out of
+the batch at a time and runs every check over it in a single pass, instead
+of re-reading the rules for every record.
+
+Supported rules per field:
+    required      value must be truthy
+    type          one of FIELD_VALIDATORS (email, phone, date, amount, zip)
+    max_length    maximum length of str(value)
+    min / max     numeric range; non-numeric values fail with not_numeric
+    enum          list of allowed values
+"""
+import heapq
+import json
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+FIELD_VALIDATORS = {
+    "email": r"^[\w\.-]+@[\w\.-]+\.\w{2,}$",
+    "phone": r"^\+?[\d\s\-\(\)]{7,15}$",
+    "date": r"^\d{4}-\d{2}-\d{2}$",
+    "amount": r"^\$?[\d,]+\.?\d{0,2}$",
+    "zip": r"^\d{5}(-\d{4})?$",
+}
+
+
+class _Column:
+    """One field's values across the batch; text/number views are built lazily
+    and shared by every check on the field."""
+    __slots__ = ("values", "_texts", "_numbers")
+
+    def __init__(self, values: list):
+        self.values = values
+        self._texts = None
+        self._numbers = None
+
+    @property
+    def texts(self) -> List[str]:
+        if self._texts is None:
+            self._texts = [v if v.__class__ is str else str(v) for v in self.values]
+        return self._texts
+
+    @property
+    def numbers(self) -> list:
+        if self._numbers is None:
+            self._numbers = [_to_number(v) if _present(v) else None for v in self.values]
+        return self._numbers
+
+
+Check = Callable[[_Column], List[int]]  # returns indices of failing values
+
+
+class CompiledSchema:
+    def __init__(self, schema: Dict[str, dict]):
+        self.columns: List[Tuple[str, List[Tuple[str, Check]]]] = []
+        for field, rules in schema.items():
+            checks = _compile_rules(rules or {})
+            if checks:
+                self.columns.append((field, checks))
+
+    def validate(self, records: List[dict]) -> Tuple[List[dict], Dict[int, List[dict]]]:
+        """Return (valid_records, {index: errors}) for the batch.
+        Errors per record are ordered by schema field, then rule."""
+        failures: Dict[int, List[dict]] = {}
+        for field, checks in self.columns:
+            column = _Column([r.get(field, "") for r in records])
+            for code, check in checks:
+                for i in check(column):
+                    failures.setdefault(i, []).append({"field": field, "error": code})
+        if not failures:
+            return list(records), failures
+        valid = [r for i, r in enumerate(records) if i not in failures]
+        return valid, failures
+
+    def summarize(self, records: List[dict], limit: int = 10) -> dict:
+        """Validate and shape the result like the validate_records task output."""
+        valid, failures = self.validate(records)
+        first = heapq.nsmallest(limit, failures)
+        return {
+            "total": len(records),
+            "valid": len(valid),
+            "invalid": len(failures),
+            "validation_rate": round(len(valid) / max(len(records), 1) * 100, 1),
+            "errors": [{"index": i, "record": records[i], "errors": failures[i]} for i in first],
+            "valid_records": valid,
+        }
+
+
+def compile_schema(schema: Dict[str, dict]) -> CompiledSchema:
+    """Compiled schemas are cached, so repeated batches with the same schema
+    skip compilation entirely. Field order is part of the key since it
+    orders each record's errors."""
+    try:
+        key = json.dumps(schema)
+    except TypeError:
+        return CompiledSchema(schema)
+    return _compile_cached(key)
+
+
+@lru_cache(maxsize=128)
+def _compile_cached(key: str) -> CompiledSchema:
+    return CompiledSchema(json.loads(key))
+
+
+def _compile_rules(rules: dict) -> List[Tuple[str, Check]]:
+    checks: List[Tuple[str, Check]] = []
+    if rules.get("required"):
+        checks.append(("required_missing", _required))
+    field_type = rules.get("type")
+    if field_type in FIELD_VALIDATORS:
+        checks.append((f"invalid_{field_type}_format", _pattern(FIELD_VALIDATORS[field_type])))
+    if rules.get("max_length"):
+        checks.append((f"exceeds_max_length_{rules['max_length']}", _max_length(rules["max_length"])))
+    low, high = rules.get("min"), rules.get("max")
+    if low is not None or high is not None:
+        checks.append(("not_numeric", _not_numeric))
+        if low is not None:
+            checks.append((f"below_min_{low}", _below(low)))
+        if high is not None:
+            checks.append((f"above_max_{high}", _above(high)))
+    if rules.get("enum") is not None:
+        checks.append(("not_in_enum", _enum(rules["enum"])))
+    return checks
+
+
+# ── checks ────────────────────────────────────────────────────────────────
+def _required(column: _Column) -> List[int]:
+    return [i for i, v in enumerate(column.values) if not v]
+
+
+def _pattern(regex: str) -> Check:
+    match = re.compile(regex).match
+
+    def check(column: _Column) -> List[int]:
+        values, texts = column.values, column.texts
+        return [i for i, t in enumerate(texts) if values[i] and not match(t)]
+    return check
+
+
+def _max_length(limit: int) -> Check:
+    def check(column: _Column) -> List[int]:
+        return [i for i, t in enumerate(column.texts) if len(t) > limit]
+    return check
+
+
+def _not_numeric(column: _Column) -> List[int]:
+    values = column.values
+    return [i for i, n in enumerate(column.numbers) if n is None and _present(values[i])]
+
+
+def _below(low: float) -> Check:
+    def check(column: _Column) -> List[int]:
+        return [i for i, n in enumerate(column.numbers) if n is not None and n < low]
+    return check
+
+
+def _above(high: float) -> Check:
+    def check(column: _Column) -> List[int]:
+        return [i for i, n in enumerate(column.numbers) if n is not None and n > high]
+    return check
+
+
+def _enum(allowed: list) -> Check:
+    allowed_text = frozenset(str(a) for a in allowed)
+
+    def check(column: _Column) -> List[int]:
+        values = column.values
+        return [i for i, t in enumerate(column.texts) if _present(values[i]) and t not in allowed_text]
+    return check
+
+
+def _present(value) -> bool:
+    return value is not None and value != ""
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).strip().lstrip("$").replace(",", ""))
+    except ValueError:
+        return None
@@ -0,0 +1,283 @@
+"""
+Broadcast Hub — concurrent WebSocket fan-out.
+Every connection gets a bounded outbound queue drained by its own writer
+task, so publishing never awaits a socket: one slow dashboard tab can't
+stall task processing or the other clients. A client whose queue
+overflows is either evicted or has its backlog replaced by a single
+fresh snapshot, depending on WS_OVERFLOW_POLICY.
+
+Clients may narrow what they receive by subscribing to agent ids, task
+types or event kinds. Subscriptions are kept in an inverted index, so
+publishing looks up interested clients instead of testing every one.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "snapshot")  # "snapshot" | "drop"
+
+# Queue marker: the writer replaces it with a freshly built snapshot
+_RESYNC = object()
+
+# Subscription dimensions, keyed by the field name used in client messages
+SUBSCRIPTION_FIELDS = {"agent_ids": "agent_id", "task_types": "task_type", "events": "event"}
+DIMENSIONS = tuple(SUBSCRIPTION_FIELDS.values())
+
+
+class _Client:
+    def __init__(self, client_id: str, websocket, queue_size: int):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.overflows = 0
+        self.resyncing = False
+        self.send_latencies: deque = deque(maxlen=200)  # enqueue → sent, seconds
+        # Empty set for a dimension means "everything"
+        self.filters: Dict[str, Set[str]] = {dim: set() for dim in DIMENSIONS}
+
+    def subscriptions(self) -> dict:
+        return {field: sorted(self.filters[dim]) for field, dim in SUBSCRIPTION_FIELDS.items()}
+
+    def stats(self) -> dict:
+        latencies = sorted(self.send_latencies)
+        n = len(latencies)
+        return {
+            "client_id": self.client_id,
+            "connected_seconds": round(time.time() - self.connected_at, 1),
+            "queue_depth": self.queue.qsize(),
+            "queue_max": self.queue.maxsize,
+            "sent": self.sent,
+            "overflows": self.overflows,
+            "subscriptions": self.subscriptions(),
+            "send_latency_ms": {
+                "p50": round(latencies[n // 2] * 1000, 2) if n else 0.0,
+                "p95": round(latencies[min(n - 1, int(n * 0.95))] * 1000, 2) if n else 0.0,
+                "max": round(latencies[-1] * 1000, 2) if n else 0.0,
+            },
+        }
+
+
+class BroadcastHub:
+    def __init__(
+        self,
+        queue_size: int = WS_SEND_QUEUE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT,
+    ):
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self._clients: Dict[str, _Client] = {}
+        # dimension → value → client ids filtering on that value
+        self._index: Dict[str, Dict[str, Set[str]]] = {dim: {} for dim in DIMENSIONS}
+        # dimension → client ids with no filter on it
+        self._unfiltered: Dict[str, Set[str]] = {dim: set() for dim in DIMENSIONS}
+        self._snapshot: Optional[Callable[[], Awaitable[dict]]] = None
+        self._evicted = 0
+        # Strong refs to pending evictions so they aren't collected before running
+        self._tasks: Set[asyncio.Task] = set()
+
+    def set_snapshot_provider(self, provider: Callable[[], Awaitable[dict]]) -> None:
+        """Async callable returning the message sent to a resyncing client."""
+        self._snapshot = provider
+
+    # ── connections ───────────────────────────────────────────────────────
+    async def connect(self, client_id: str, websocket, initial: Optional[dict] = None) -> None:
+        if client_id in self._clients:
+            await self.disconnect(client_id)
+        client = _Client(client_id, websocket, self.queue_size)
+        if initial is not None:
+            client.queue.put_nowait((time.monotonic(), _encode(initial)))
+        client.writer = asyncio.create_task(self._writer(client), name=f"ws-writer-{client_id}")
+        self._clients[client_id] = client
+        for dim in DIMENSIONS:
+            self._unfiltered[dim].add(client_id)
+
+    async def disconnect(self, client_id: str, websocket=None) -> None:
+        """Drop a client. When `websocket` is given, only drop it if that
+        socket is still the registered one (the id may have reconnected)."""
+        client = self._clients.get(client_id)
+        if client is None or (websocket is not None and client.websocket is not websocket):
+            return
+        del self._clients[client_id]
+        for dim in DIMENSIONS:
+            self._unfiltered[dim].discard(client_id)
+            self._unindex(dim, client.filters[dim], client_id)
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+            await asyncio.gather(client.writer, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Disconnect every client. Call on shutdown."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for client_id in list(self._clients):
+            await self.disconnect(client_id)
+
+    # ── subscriptions ─────────────────────────────────────────────────────
+    def subscribe(self, client_id: str, **fields: Iterable[str]) -> dict:
+        """Add values to a client's filters, e.g. subscribe(cid, agent_ids=["a1"])."""
+        client = self._clients.get(client_id)
+        if client is None:
+            return {}
+        for field, values in fields.items():
+            dim = SUBSCRIPTION_FIELDS.get(field)
+            if dim is None or not values:
+                continue
+            new = {str(v) for v in values} - client.filters[dim]
+            client.filters[dim] |= new
+            self._unfiltered[dim].discard(client_id)
+            for value in new:
+                self._index[dim].setdefault(value, set()).add(client_id)
+        return client.subscriptions()
+
+    def unsubscribe(self, client_id: str, **fields: Iterable[str]) -> dict:
+        """Remove values from a client's filters; with no fields, clear them all.
+        A dimension left with no values goes back to receiving everything."""
+        client = self._clients.get(client_id)
+        if client is None:
+            return {}
+        if not any(fields.values()):
+            fields = {field: list(client.filters[dim]) for field, dim in SUBSCRIPTION_FIELDS.items()}
+        for field, values in fields.items():
+            dim = SUBSCRIPTION_FIELDS.get(field)
+            if dim is None or not values:
+                continue
+            gone = {str(v) for v in values} & client.filters[dim]
+            client.filters[dim] -= gone
+            self._unindex(dim, gone, client_id)
+            if not client.filters[dim]:
+                self._unfiltered[dim].add(client_id)
+        return client.subscriptions()
+
+    # ── publishing ────────────────────────────────────────────────────────
+    def publish(self, message: dict, **routing: Optional[str]) -> int:
+        """Fan a message out to interested clients without awaiting any socket.
+        Routing keys (agent_id, task_type) are taken from the message's task
+        unless given explicitly. Returns the number of clients it was queued for."""
+        if not self._clients:
+            return 0
+        recipients = self._recipients(message, routing)
+        if not recipients:
+            return 0
+        item = (time.monotonic(), _encode(message))
+        queued = 0
+        for client_id in recipients:
+            client = self._clients.get(client_id)
+            if client is not None and self._offer(client, item):
+                queued += 1
+        return queued
+
+    def send(self, client_id: str, message: dict) -> bool:
+        """Queue a message for a single client (e.g. a pong)."""
+        client = self._clients.get(client_id)
+        if client is None:
+            return False
+        return self._offer(client, (time.monotonic(), _encode(message)))
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self._clients),
+            "overflow_policy": self.overflow_policy,
+            "evicted": self._evicted,
+            "clients": [c.stats() for c in self._clients.values()],
+        }
+
+    def connection_count(self) -> int:
+        return len(self._clients)
+
+    # ── internals ─────────────────────────────────────────────────────────
+    def _recipients(self, message: dict, routing: dict) -> Set[str]:
+        task = message.get("task") or {}
+        keys = {
+            "event": message.get("type"),
+            "agent_id": routing.get("agent_id") or message.get("agent_id") or task.get("agent_id"),
+            "task_type": routing.get("task_type") or message.get("task_type") or task.get("type"),
+        }
+        # A dimension only restricts delivery if the message carries it and
+        # at least one client filters on it; smallest candidate set first.
+        allowed = []
+        for dim, value in keys.items():
+            if value is None or not self._index[dim]:
+                continue
+            matched = self._index[dim].get(str(value))
+            allowed.append(self._unfiltered[dim] | matched if matched else self._unfiltered[dim])
+        if not allowed:
+            return set(self._clients)
+        allowed.sort(key=len)
+        return allowed[0].intersection(*allowed[1:])
+
+    def _unindex(self, dim: str, values: Iterable[str], client_id: str) -> None:
+        for value in values:
+            ids = self._index[dim].get(value)
+            if ids is None:
+                continue
+            ids.discard(client_id)
+            if not ids:
+                del self._index[dim][value]
+
+    def _offer(self, client: _Client, item) -> bool:
+        if client.resyncing:
+            # A snapshot is already pending; it will supersede this message
+            return True
+        try:
+            client.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            client.overflows += 1
+        if self.overflow_policy == "snapshot" and self._snapshot is not None:
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            client.resyncing = True
+            client.queue.put_nowait(_RESYNC)
+            return True
+        self._spawn_evict(client, "send queue overflow")
+        return False
+
+    def _spawn_evict(self, client: _Client, reason: str) -> None:
+        task = asyncio.create_task(self._evict(client, reason))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _evict(self, client: _Client, reason: str) -> None:
+        if self._clients.get(client.client_id) is not client:
+            return
+        self._evicted += 1
+        print(f"✗ evicting websocket client {client.client_id}: {reason}")
+        await self.disconnect(client.client_id)
+        try:
+            await client.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def _writer(self, client: _Client) -> None:
+        while True:
+            item = await client.queue.get()
+            try:
+                if item is _RESYNC:
+                    client.resyncing = False
+                    enqueued_at, text = time.monotonic(), _encode(await self._snapshot())
+                else:
+                    enqueued_at, text = item
+                await asyncio.wait_for(client.websocket.send_text(text), self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._spawn_evict(client, f"send failed: {e!r}")
+                return
+            client.sent += 1
+            client.send_latencies.append(time.monotonic() - enqueued_at)
+
+
+def _encode(message: dict) -> str:
+    # Serialized once per publish, not once per client
+    return json.dumps(message, default=str)
@@ -4,6 +4,7 @@ Uses MONGODB_URI from environment, falls back to localhost.
 """
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGODB_DB", "workforce")
@@ -25,10 +26,21 @@ def get_db():
 async def ensure_indexes():
     """Create indexes on first startup."""
     db = get_db()
+    try:
+        await db.tasks.create_index("id", unique=True)
+    except OperationFailure as e:
+        # Existing duplicates (short ids from older versions) block the build
+        print(f"✗ could not create unique index on tasks.id: {e}")
     await db.tasks.create_index("agent_id")
     await db.tasks.create_index("status")
     await db.tasks.create_index([("created_at", -1)])
+    await db.tasks.create_index([("created_at", -1), ("id", -1)])
+    await db.tasks.create_index([("status", 1), ("priority", -1), ("created_at", 1)])
     await db.agents.create_index("agent_id", unique=True)
+    await db.task_timeseries.create_index("minute")
+    await db.llm_cache.create_index("expires_at", expireAfterSeconds=0)
+    await db.dedup_keys.create_index("index")
+    await db.dedup_indexes.create_index("agent_id")
 
 
 async def ping() -> bool:
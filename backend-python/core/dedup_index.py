@@ -0,0 +1,259 @@
+"""
+Dedup Index — persistent "seen keys" per agent and key_fields combination.
+Lets deduplicate drop records ingested by earlier batches without reloading
+history. Each key is hashed; an in-memory Bloom filter answers "definitely
+new" for most keys, and only Bloom hits are confirmed against the
+`dedup_keys` collection. New keys are inserted under a unique _id, so a key
+another process added since this one loaded its filter fails the insert and
+is still counted as seen. The filter itself is snapshotted to
+`dedup_indexes` so a restart doesn't have to rescan the keys. Snapshots are
+taken every DEDUP_SNAPSHOT_KEYS new keys or DEDUP_SNAPSHOT_SECONDS, and on
+flush() at the end of a task; a stale snapshot only costs extra inserts
+that fail as duplicates, never a wrong answer.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from bson import Binary
+from pymongo.errors import BulkWriteError
+
+from .database import get_db
+from .prometheus import MONGO_OPS
+
+DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", "1000000"))
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.01"))
+# Snapshots are single documents: keep the bitmap well under the 16 MB BSON limit
+DEDUP_BLOOM_MAX_BYTES = int(os.getenv("DEDUP_BLOOM_MAX_BYTES", str(12 * 1024 * 1024)))
+DEDUP_SNAPSHOT_KEYS = int(os.getenv("DEDUP_SNAPSHOT_KEYS", "100000"))
+DEDUP_SNAPSHOT_SECONDS = float(os.getenv("DEDUP_SNAPSHOT_SECONDS", "30"))
+
+_CONFIRM_BATCH = 10000
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float, bits: Optional[bytes] = None):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: bytes):
+        # Double hashing over the two halves of a 16-byte digest
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, digest: bytes) -> None:
+        bits = self.bits
+        for p in self._positions(digest):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(digest))
+
+
+def max_capacity(error_rate: float, max_bytes: int = DEDUP_BLOOM_MAX_BYTES) -> int:
+    """Largest capacity whose bitmap fits in `max_bytes` at `error_rate`.
+    Past it the filter just answers "maybe" more often."""
+    return int(max_bytes * 8 * (math.log(2) ** 2) / -math.log(error_rate))
+
+
+def key_digest(key: Sequence) -> bytes:
+    return hashlib.blake2b(json.dumps(list(key), default=str).encode(), digest_size=16).digest()
+
+
+class DedupIndex:
+    def __init__(self, agent_id: str, key_fields: Sequence[str], bloom: BloomFilter, count: int = 0):
+        self.agent_id = agent_id
+        self.key_fields = list(key_fields)
+        self.index_id = index_id(agent_id, key_fields)
+        self.bloom = bloom
+        self.count = count
+        self._lock = asyncio.Lock()
+        self._bloom_hits = 0
+        self._false_positives = 0
+        self._unsaved = 0  # keys added since the last snapshot
+        self._saved_at = time.monotonic()
+
+    def _doc_id(self, digest: bytes) -> str:
+        return f"{self.index_id}:{digest.hex()}"
+
+    async def mark_seen(self, digests: List[bytes]) -> List[bool]:
+        """For each key digest, return whether it was seen before (in history
+        or earlier in this batch); every unseen key is recorded."""
+        seen = [False] * len(digests)
+        async with self._lock:
+            first: Dict[bytes, int] = {}
+            maybe: List[int] = []
+            fresh: List[int] = []
+            for i, digest in enumerate(digests):
+                if digest in first:
+                    seen[i] = True
+                    continue
+                first[digest] = i
+                (maybe if digest in self.bloom else fresh).append(i)
+
+            db = get_db()
+            if maybe:
+                self._bloom_hits += len(maybe)
+                known = set()
+                for start in range(0, len(maybe), _CONFIRM_BATCH):
+                    ids = [self._doc_id(digests[i]) for i in maybe[start:start + _CONFIRM_BATCH]]
+                    with MONGO_OPS.time(collection="dedup_keys", operation="find"):
+                        async for doc in db.dedup_keys.find({"_id": {"$in": ids}}, {"_id": 1}):
+                            known.add(doc["_id"])
+                for i in maybe:
+                    if self._doc_id(digests[i]) in known:
+                        seen[i] = True
+                    else:
+                        self._false_positives += 1
+                        fresh.append(i)
+
+            if fresh:
+                now = datetime.utcnow()
+                docs = [{"_id": self._doc_id(digests[i]), "index": self.index_id, "created_at": now} for i in fresh]
+                try:
+                    with MONGO_OPS.time(collection="dedup_keys", operation="insert_many"):
+                        await db.dedup_keys.insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    # Added by another process since our filter was loaded
+                    for err in e.details.get("writeErrors", []):
+                        if err.get("code") == 11000:
+                            seen[fresh[err["index"]]] = True
+                        else:
+                            raise
+                for i in fresh:
+                    self.bloom.add(digests[i])
+                    if not seen[i]:
+                        self.count += 1
+                self._unsaved += len(fresh)
+                if (self._unsaved >= DEDUP_SNAPSHOT_KEYS
+                        or time.monotonic() - self._saved_at >= DEDUP_SNAPSHOT_SECONDS):
+                    await self._save_snapshot()
+        return seen
+
+    async def flush(self) -> None:
+        """Snapshot the filter if keys were added since the last snapshot."""
+        async with self._lock:
+            if self._unsaved:
+                await self._save_snapshot()
+
+    async def _save_snapshot(self) -> None:
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        await get_db().dedup_indexes.replace_one(
+            {"_id": self.index_id},
+            {
+                "agent_id": self.agent_id,
+                "key_fields": self.key_fields,
+                "count": self.count,
+                "capacity": self.bloom.capacity,
+                "error_rate": self.bloom.error_rate,
+                "bloom": Binary(bytes(self.bloom.bits)),
+                "updated_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "agent_id": self.agent_id,
+            "key_fields": self.key_fields,
+            "keys": self.count,
+            "capacity": self.bloom.capacity,
+            "bloom_bytes": len(self.bloom.bits),
+            "bloom_hits": self._bloom_hits,
+            "false_positives": self._false_positives,
+        }
+
+
+class DedupIndexes:
+    """Per-process registry of loaded indexes."""
+
+    def __init__(self, capacity: int = DEDUP_BLOOM_CAPACITY, error_rate: float = DEDUP_BLOOM_ERROR_RATE):
+        self.max_capacity = max_capacity(error_rate)
+        if capacity > self.max_capacity:
+            print(f"✗ DEDUP_BLOOM_CAPACITY {capacity} exceeds the snapshot limit; using {self.max_capacity}")
+        self.capacity = min(capacity, self.max_capacity)
+        self.error_rate = error_rate
+        self._indexes: Dict[str, DedupIndex] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, agent_id: str, key_fields: Sequence[str]) -> DedupIndex:
+        iid = index_id(agent_id, key_fields)
+        index = self._indexes.get(iid)
+        if index is not None:
+            return index
+        async with self._lock:
+            if iid not in self._indexes:
+                self._indexes[iid] = await self._load(agent_id, key_fields)
+            return self._indexes[iid]
+
+    async def flush_all(self) -> None:
+        for index in list(self._indexes.values()):
+            await index.flush()
+
+    async def list(self, agent_id: str) -> List[dict]:
+        docs = await get_db().dedup_indexes.find(
+            {"agent_id": agent_id}, {"bloom": 0}
+        ).to_list(length=None)
+        for doc in docs:
+            doc["index_id"] = doc.pop("_id")
+        return docs
+
+    async def reset(self, agent_id: str, key_fields: Sequence[str]) -> int:
+        """Forget every key in the index. Returns how many were removed."""
+        iid = index_id(agent_id, key_fields)
+        async with self._lock:
+            self._indexes.pop(iid, None)
+            db = get_db()
+            result = await db.dedup_keys.delete_many({"index": iid})
+            await db.dedup_indexes.delete_one({"_id": iid})
+        return result.deleted_count
+
+    async def rebuild(self, agent_id: str, key_fields: Sequence[str]) -> dict:
+        """Rebuild the Bloom filter from the stored keys, sized for the
+        current key count (e.g. after it has outgrown its capacity)."""
+        iid = index_id(agent_id, key_fields)
+        async with self._lock:
+            self._indexes.pop(iid, None)
+            index = await self._scan(agent_id, key_fields)
+            self._indexes[iid] = index
+        return index.stats()
+
+    # ── internals ─────────────────────────────────────────────────────────
+    async def _load(self, agent_id: str, key_fields: Sequence[str]) -> DedupIndex:
+        doc = await get_db().dedup_indexes.find_one({"_id": index_id(agent_id, key_fields)})
+        if doc is None:
+            return await self._scan(agent_id, key_fields)
+        bloom = BloomFilter(doc["capacity"], doc["error_rate"], bits=doc["bloom"])
+        return DedupIndex(agent_id, key_fields, bloom, count=doc.get("count", 0))
+
+    async def _scan(self, agent_id: str, key_fields: Sequence[str]) -> DedupIndex:
+        iid = index_id(agent_id, key_fields)
+        db = get_db()
+        count = await db.dedup_keys.count_documents({"index": iid})
+        bloom = BloomFilter(min(max(self.capacity, count * 2), self.max_capacity), self.error_rate)
+        prefix = len(iid) + 1
+        async for doc in db.dedup_keys.find({"index": iid}, {"_id": 1}).batch_size(_CONFIRM_BATCH):
+            bloom.add(bytes.fromhex(doc["_id"][prefix:]))
+        index = DedupIndex(agent_id, key_fields, bloom, count=count)
+        if count:
+            await index._save_snapshot()
+        return index
+
+
+def index_id(agent_id: str, key_fields: Sequence[str]) -> str:
+    return f"{agent_id}:{','.join(key_fields)}"
+
+
+dedup_indexes = DedupIndexes()
@@ -0,0 +1,174 @@
+"""
+Event Bus — carries WebSocket updates between processes.
+Every update is published to the bus and each process's BroadcastHub is
+fed from it, so a dashboard connected to one worker sees tasks finished
+on any other. The in-process backend delivers directly; the MongoDB
+backend writes to a capped `events` collection and consumes it with a
+change stream, falling back to a tailable cursor on a standalone mongod
+where change streams aren't available.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from .database import get_db
+
+EVENT_BUS = os.getenv("EVENT_BUS", "memory")  # "memory" | "mongo"
+EVENT_BUS_CAPPED_BYTES = int(os.getenv("EVENT_BUS_CAPPED_BYTES", str(64 * 1024 * 1024)))
+
+# Server error codes that change how the consumer recovers
+_NOT_A_REPLICA_SET = 40573
+_CHANGE_STREAM_HISTORY_LOST = 286
+
+EventHandler = Callable[[dict, dict], Awaitable[None]]  # (message, routing)
+
+
+class InProcessEventBus:
+    backend = "memory"
+
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+        self._published = 0
+
+    async def start(self, handler: EventHandler) -> None:
+        self._handler = handler
+
+    async def stop(self) -> None:
+        self._handler = None
+
+    async def publish(self, message: dict, routing: Optional[dict] = None) -> None:
+        self._published += 1
+        if self._handler is not None:
+            await self._handler(message, routing or {})
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "published": self._published}
+
+
+class MongoEventBus:
+    backend = "mongo"
+
+    def __init__(self, collection: str = "events", capped_bytes: int = EVENT_BUS_CAPPED_BYTES):
+        self.collection = collection
+        self.capped_bytes = capped_bytes
+        self._handler: Optional[EventHandler] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._mode = "starting"
+        self._published = 0
+        self._delivered = 0
+        self._errors = 0
+
+    async def start(self, handler: EventHandler) -> None:
+        self._handler = handler
+        await self._ensure_capped()
+        self._consumer = asyncio.create_task(self._consume(), name="event-bus-consumer")
+
+    async def stop(self) -> None:
+        if self._consumer is not None:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+            self._consumer = None
+
+    async def publish(self, message: dict, routing: Optional[dict] = None) -> None:
+        self._published += 1
+        try:
+            await get_db()[self.collection].insert_one({
+                "message": message,
+                "routing": routing or {},
+                "ts": datetime.utcnow(),
+            })
+        except Exception as e:
+            self._errors += 1
+            print(f"✗ event bus publish failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "mode": self._mode,
+            "published": self._published,
+            "delivered": self._delivered,
+            "errors": self._errors,
+        }
+
+    # ── internals ─────────────────────────────────────────────────────────
+    async def _ensure_capped(self) -> None:
+        db = get_db()
+        try:
+            await db.create_collection(self.collection, capped=True, size=self.capped_bytes)
+        except (CollectionInvalid, OperationFailure):
+            pass  # already exists (possibly created by another process just now)
+        options = await db[self.collection].options()
+        if options.get("capped"):
+            return
+        # Created uncapped, e.g. by a publish that ran before any bus started:
+        # left alone it grows forever and tailable cursors can't read it
+        try:
+            await db.command("convertToCapped", self.collection, size=self.capped_bytes)
+            print(f"✓ event bus: converted '{self.collection}' to a capped collection")
+        except OperationFailure as e:
+            self._errors += 1
+            print(f"✗ event bus: '{self.collection}' is not capped and could not be converted: {e}")
+
+    async def _consume(self) -> None:
+        coll = get_db()[self.collection]
+        # Start from the newest event so a (re)starting process doesn't replay history
+        newest = await coll.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        last_id = newest["_id"] if newest else None
+        use_change_stream = True
+        resume_token = None  # so a restarted stream doesn't skip events
+        while True:
+            try:
+                if use_change_stream:
+                    self._mode = "change_stream"
+                    async with coll.watch(
+                        [{"$match": {"operationType": "insert"}}], resume_after=resume_token,
+                    ) as stream:
+                        async for change in stream:
+                            last_id = change["fullDocument"]["_id"]
+                            resume_token = stream.resume_token
+                            await self._deliver(change["fullDocument"])
+                else:
+                    self._mode = "tailable_cursor"
+                    query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                    cursor = coll.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                    while cursor.alive:
+                        async for doc in cursor:
+                            last_id = doc["_id"]
+                            await self._deliver(doc)
+                        await asyncio.sleep(0.05)
+                    # Tailable cursors die on an empty collection; retry shortly
+                    await asyncio.sleep(0.5)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if use_change_stream and e.code == _NOT_A_REPLICA_SET:
+                    # Standalone mongod: change streams need a replica set
+                    print(f"✓ event bus falling back to tailable cursor ({e.code})")
+                    use_change_stream = False
+                    continue
+                self._errors += 1
+                print(f"✗ event bus consumer error: {e}")
+                if e.code == _CHANGE_STREAM_HISTORY_LOST:
+                    # The resume point fell off the oplog; events in between are gone
+                    resume_token = None
+                await asyncio.sleep(1)
+            except Exception as e:
+                self._errors += 1
+                print(f"✗ event bus consumer error: {e}")
+                await asyncio.sleep(1)
+
+    async def _deliver(self, doc: dict) -> None:
+        self._delivered += 1
+        try:
+            await self._handler(doc["message"], doc.get("routing") or {})
+        except Exception as e:
+            self._errors += 1
+            print(f"✗ event bus delivery failed: {e}")
+
+
+def create_event_bus(backend: str = EVENT_BUS):
+    return MongoEventBus() if backend == "mongo" else InProcessEventBus()
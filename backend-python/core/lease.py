@@ -0,0 +1,165 @@
+"""
+Task Leasing — lets any number of processes or hosts share the task queue.
+Instead of running tasks in the process that accepted the HTTP call, each
+process claims queued tasks from the tasks collection with an atomic
+find_one_and_update that stamps a lease (owner + expiry). Leases on running
+tasks are renewed periodically; if a worker dies its leases expire and the
+tasks are claimed again by someone else, up to TASK_MAX_ATTEMPTS times.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from pymongo import ReturnDocument
+
+from .database import get_db
+
+TASK_EXECUTION_MODE = os.getenv("TASK_EXECUTION_MODE", "local")  # "local" | "lease"
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "60"))
+TASK_LEASE_POLL_SECONDS = float(os.getenv("TASK_LEASE_POLL_SECONDS", "1"))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
+
+_EXPIRE_BATCH = 500  # expired tasks failed per renewal round
+
+
+class TaskLeaseManager:
+    def __init__(
+        self,
+        lease_seconds: float = TASK_LEASE_SECONDS,
+        poll_seconds: float = TASK_LEASE_POLL_SECONDS,
+        max_attempts: int = TASK_MAX_ATTEMPTS,
+    ):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._held: Set[str] = set()
+        self._wake = asyncio.Event()
+        self._loops = []
+        self._on_unrunnable = None
+        self._claimed = 0
+        self._reclaimed = 0
+        self._expired_failed = 0
+
+    # ── lifecycle ─────────────────────────────────────────────────────────
+    def start(self, orchestrator, scheduler, on_unrunnable) -> None:
+        """Start claiming tasks into `scheduler`. `on_unrunnable(task, reason,
+        fence)` is awaited for claimed tasks whose agent can't be rebuilt and
+        for tasks whose leases ran out of attempts; it fails the task only if
+        it still matches `fence`, and returns whether it did."""
+        if self._loops:
+            return
+        self._on_unrunnable = on_unrunnable
+        self._loops = [
+            asyncio.create_task(self._claim_loop(orchestrator, scheduler, on_unrunnable), name="lease-claim"),
+            asyncio.create_task(self._renew_loop(), name="lease-renew"),
+        ]
+
+    async def stop(self) -> None:
+        for loop in self._loops:
+            loop.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = []
+
+    # ── public API ────────────────────────────────────────────────────────
+    def notify(self) -> None:
+        """A task was just queued; claim now instead of waiting for the poll."""
+        self._wake.set()
+
+    def release(self, task_id: str) -> None:
+        self._held.discard(task_id)
+
+    async def claim(self) -> Optional[dict]:
+        """Atomically take the most urgent runnable task, or None."""
+        now = datetime.utcnow()
+        doc = await get_db().tasks.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_expires_at": {"$lt": now},
+                 "attempts": {"$lt": self.max_attempts}},
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is not None:
+            self._held.add(doc["id"])
+            self._claimed += 1
+            if doc.get("attempts", 1) > 1:
+                self._reclaimed += 1
+        return doc
+
+    def stats(self) -> dict:
+        return {
+            "mode": TASK_EXECUTION_MODE,
+            "owner": self.owner,
+            "lease_seconds": self.lease_seconds,
+            "held": len(self._held),
+            "claimed": self._claimed,
+            "reclaimed": self._reclaimed,
+            "expired_failed": self._expired_failed,
+        }
+
+    # ── internals ─────────────────────────────────────────────────────────
+    async def _claim_loop(self, orchestrator, scheduler, on_unrunnable) -> None:
+        while True:
+            # Only claim what a local worker can start now, so one process
+            # doesn't hoard tasks other processes could be running
+            if scheduler.busy() + scheduler.depth() >= scheduler.workers:
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                task = await self.claim()
+            except Exception as e:
+                print(f"✗ task claim failed: {e}")
+                task = None
+            if task is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            agent = await orchestrator.get_or_load(task["agent_id"])
+            if agent is None:
+                self.release(task["id"])
+                await on_unrunnable(task, f"Agent {task['agent_id']} not found or terminated",
+                                    {"lease_owner": self.owner})
+                continue
+            scheduler.submit(task["id"], agent, task)
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            now = datetime.utcnow()
+            db = get_db()
+            try:
+                if self._held:
+                    await db.tasks.update_many(
+                        {"id": {"$in": list(self._held)}, "lease_owner": self.owner, "status": "running"},
+                        {"$set": {"lease_expires_at": now + timedelta(seconds=self.lease_seconds)}},
+                    )
+                # Tasks that keep killing their workers are failed, not retried
+                # forever. Each goes through on_unrunnable so metrics and clients
+                # see the transition; the fence keeps two processes from both
+                # failing the same task.
+                expired = {"status": "running", "lease_expires_at": {"$lt": now},
+                           "attempts": {"$gte": self.max_attempts}}
+                tasks = await db.tasks.find(expired, {"_id": 0}).limit(_EXPIRE_BATCH).to_list(length=None)
+                for task in tasks:
+                    if await self._on_unrunnable(task, f"Lease expired after {self.max_attempts} attempts", expired):
+                        self._expired_failed += 1
+            except Exception as e:
+                print(f"✗ lease renewal failed: {e}")
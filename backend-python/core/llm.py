@@ -0,0 +1,82 @@
+"""
+LLM Client — one process-wide AsyncAnthropic client.
+Shares a keep-alive HTTP connection pool across every agent call and caps
+in-flight requests with a semaphore, so LLM calls neither pay a TLS
+handshake each time nor tie up default-executor threads.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+try:
+    from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+except ImportError:
+    AsyncAnthropic = None
+    DefaultAsyncHttpxClient = None
+
+import httpx
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+
+_client: Optional["AsyncAnthropic"] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_in_flight = 0
+_waiting = 0
+_calls = 0
+
+
+def get_llm_client() -> Optional["AsyncAnthropic"]:
+    """Return the shared client, or None when the SDK or API key is missing."""
+    global _client
+    if _client is not None:
+        return _client
+    key = os.getenv("ANTHROPIC_API_KEY", "")
+    if not key or AsyncAnthropic is None:
+        return None
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+    )
+    _client = AsyncAnthropic(api_key=key, http_client=DefaultAsyncHttpxClient(limits=limits))
+    return _client
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Hold one of LLM_MAX_CONCURRENCY in-flight call slots."""
+    global _semaphore, _in_flight, _waiting, _calls
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, LLM_MAX_CONCURRENCY))
+    _waiting += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        _waiting -= 1
+    _in_flight += 1
+    _calls += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+        _semaphore.release()
+
+
+async def close_llm_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def llm_stats() -> dict:
+    return {
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "in_flight": _in_flight,
+        "waiting": _waiting,
+        "calls": _calls,
+        "client_ready": _client is not None,
+    }
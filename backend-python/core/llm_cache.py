@@ -0,0 +1,118 @@
+"""
+LLM Response Cache — two-tier cache for Claude completions.
+Keyed on a hash of (model, system, prompt, max_tokens). An in-process LRU
+with a TTL answers repeats without I/O; a MongoDB collection with a TTL
+index keeps responses across restarts and worker processes.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .database import get_db
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "1") == "1"
+
+
+def cache_key(model: str, system: str, prompt: str, max_tokens: int) -> str:
+    raw = json.dumps([model, system, prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(
+        self,
+        max_entries: int = LLM_CACHE_SIZE,
+        ttl_seconds: float = LLM_CACHE_TTL,
+        persist: bool = LLM_CACHE_PERSIST,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key → (expires_at, text)
+        self._memory_hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._errors = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self._memory_hits += 1
+                return entry[1]
+            del self._entries[key]
+            self._expirations += 1
+
+        if self.persist:
+            try:
+                doc = await get_db().llm_cache.find_one(
+                    {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+                    {"response": 1, "expires_at": 1},
+                )
+            except Exception:
+                self._errors += 1
+                doc = None
+            if doc is not None:
+                self._persistent_hits += 1
+                remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds()
+                self._remember(key, doc["response"], time.time() + remaining)
+                return doc["response"]
+
+        self._misses += 1
+        return None
+
+    async def put(self, key: str, text: str, model: str = "") -> None:
+        self._remember(key, text, time.time() + self.ttl_seconds)
+        if not self.persist:
+            return
+        now = datetime.utcnow()
+        try:
+            await get_db().llm_cache.replace_one(
+                {"_id": key},
+                {
+                    "response": text,
+                    "model": model,
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                },
+                upsert=True,
+            )
+        except Exception:
+            self._errors += 1
+
+    def stats(self) -> dict:
+        hits = self._memory_hits + self._persistent_hits
+        lookups = hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "persistent": self.persist,
+            "hits": hits,
+            "memory_hits": self._memory_hits,
+            "persistent_hits": self._persistent_hits,
+            "misses": self._misses,
+            "hit_rate": round(hits / max(lookups, 1) * 100, 1),
+            "evictions": self._evictions,
+            "expirations": self._expirations,
+            "errors": self._errors,
+        }
+
+    def _remember(self, key: str, text: str, expires_at: float) -> None:
+        self._entries[key] = (expires_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,133 @@
+"""
+Metrics Aggregator — incrementally maintained platform counters.
+Seeded once from a MongoDB $group at startup, then kept current by the
+TaskQueue and AgentOrchestrator as tasks and agents change status, so
+/metrics is O(1) and accurate at any collection size. When several
+processes share the task queue (lease mode) each one only sees its own
+transitions, so the counts are also re-seeded every
+METRICS_REFRESH_SECONDS there (see start_refresh).
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+from .database import get_db
+
+METRICS_REFRESH_SECONDS = float(os.getenv("METRICS_REFRESH_SECONDS", "10"))
+
+TERMINAL_TASK_STATUSES = ("completed", "failed")
+
+
+class MetricsAggregator:
+    def __init__(self):
+        self._task_counts: Dict[str, int] = {}
+        self._agent_counts: Dict[str, int] = {}
+        # Last known status of in-flight tasks; terminal tasks are dropped
+        self._inflight: Dict[str, str] = {}
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def seed(self) -> None:
+        """Load status counts from MongoDB. Call once at startup."""
+        await self._load_counts()
+        self._inflight.clear()
+
+    def start_refresh(self, interval: float = METRICS_REFRESH_SECONDS) -> None:
+        """Periodically replace the counts with MongoDB's, for deployments
+        where other processes change task statuses too."""
+        if self._refresher is None and interval > 0:
+            self._refresher = asyncio.create_task(self._refresh_loop(interval), name="metrics-refresh")
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    async def _refresh_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._load_counts()
+            except Exception as e:
+                print(f"✗ metrics refresh failed: {e}")
+
+    async def _load_counts(self) -> None:
+        db = get_db()
+        tasks = await db.tasks.aggregate(
+            [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        ).to_list(length=None)
+        agents = await db.agents.aggregate(
+            [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        ).to_list(length=None)
+        self._task_counts = {d["_id"]: d["count"] for d in tasks if d["_id"]}
+        self._agent_counts = {d["_id"]: d["count"] for d in agents if d["_id"]}
+
+    # ── tasks ─────────────────────────────────────────────────────────────
+    def task_enqueued(self, task_id: str, status: str = "queued") -> None:
+        self._bump(self._task_counts, None, status)
+        self._inflight[task_id] = status
+
+    def track(self, task_id: str, status: str) -> None:
+        """Note the current status of an already-counted task (e.g. one
+        recovered at startup) so its next transition is attributed right."""
+        self._inflight[task_id] = status
+
+    def task_transition(self, task_id: str, status: str) -> None:
+        previous = self._inflight.pop(task_id, None)
+        if previous is None:
+            # Enqueued before this process started (or by another process):
+            # assume the normal queued → running → terminal lifecycle.
+            previous = "running" if status in TERMINAL_TASK_STATUSES else "queued"
+        if status not in TERMINAL_TASK_STATUSES:
+            self._inflight[task_id] = status
+        self._bump(self._task_counts, previous, status)
+
+    def tasks_transition(self, task_ids: List[str], status: str) -> None:
+        """task_transition for a batch: one count adjustment per previous status."""
+        moved: Dict[str, int] = {}
+        for task_id in task_ids:
+            previous = self._inflight.pop(task_id, None)
+            if previous is None:
+                previous = "running" if status in TERMINAL_TASK_STATUSES else "queued"
+            if status not in TERMINAL_TASK_STATUSES:
+                self._inflight[task_id] = status
+            moved[previous] = moved.get(previous, 0) + 1
+        counts = self._task_counts
+        for previous, n in moved.items():
+            if previous != status:
+                counts[previous] = max(counts.get(previous, 0) - n, 0)
+                counts[status] = counts.get(status, 0) + n
+
+    # ── agents ────────────────────────────────────────────────────────────
+    def agent_transition(self, previous: Optional[str], status: str) -> None:
+        self._bump(self._agent_counts, previous, status)
+
+    # ── reads ─────────────────────────────────────────────────────────────
+    def snapshot(self) -> dict:
+        tasks = self._task_counts
+        agents = self._agent_counts
+        total_tasks = sum(tasks.values())
+        completed = tasks.get("completed", 0)
+        return {
+            "agents": {
+                "total": sum(agents.values()),
+                "running": agents.get("running", 0),
+                "idle": agents.get("idle", 0),
+            },
+            "tasks": {
+                "total": total_tasks,
+                "queued": tasks.get("queued", 0),
+                "completed": completed,
+                "failed": tasks.get("failed", 0),
+                "running": tasks.get("running", 0),
+                "success_rate": round(completed / max(total_tasks, 1) * 100, 1),
+            },
+        }
+
+    @staticmethod
+    def _bump(counts: Dict[str, int], previous: Optional[str], status: str) -> None:
+        if previous == status:
+            return
+        if previous is not None:
+            counts[previous] = max(counts.get(previous, 0) - 1, 0)
+        counts[status] = counts.get(status, 0) + 1
@@ -1,7 +1,9 @@
 """
 Agent Orchestrator — MongoDB-backed, persists agents across restarts.
 Agents are still instantiated in-memory for task execution, but their
-metadata is stored in MongoDB so the list survives restarts.
+metadata is stored in MongoDB so the list survives restarts. On startup
+the persisted agents are loaded as dormant metadata and instantiated on
+first use.
 """
 from typing import Dict, Optional, List
 from datetime import datetime
@@ -11,9 +13,25 @@ from .database import get_db
 
 
 class AgentOrchestrator:
-    def __init__(self):
+    def __init__(self, metrics=None, agent_classes: Optional[Dict[str, type]] = None):
         # Live agent instances (needed for execute())
         self._agents: Dict[str, object] = {}
+        # Optional MetricsAggregator kept in step with agent status changes
+        self._metrics = metrics
+        # agent type → class, used to rebuild instances from persisted metadata
+        self._agent_classes = agent_classes or {}
+        # Persisted, non-terminated agents not yet instantiated in this process
+        self._dormant: Dict[str, dict] = {}
+
+    async def rehydrate(self) -> int:
+        """Load every non-terminated agent's metadata so get() can rebuild it
+        lazily. Returns the number of agents restored."""
+        db = get_db()
+        cursor = db.agents.find({"status": {"$ne": "terminated"}}, {"_id": 0})
+        async for doc in cursor:
+            if doc["agent_id"] not in self._agents and doc.get("type") in self._agent_classes:
+                self._dormant[doc["agent_id"]] = doc
+        return len(self._dormant)
 
     async def register(self, agent) -> None:
         """Register a live agent instance and persist its metadata."""
@@ -34,14 +52,54 @@ class AgentOrchestrator:
             }},
             upsert=True,
         )
+        if self._metrics:
+            self._metrics.agent_transition(None, agent.status)
 
     def get(self, agent_id: str) -> Optional[object]:
-        return self._agents.get(agent_id)
+        agent = self._agents.get(agent_id)
+        if agent is None and agent_id in self._dormant:
+            agent = self.instantiate(self._dormant.pop(agent_id))
+            if agent is not None:
+                self._agents[agent_id] = agent
+        return agent
+
+    async def get_or_load(self, agent_id: str) -> Optional[object]:
+        """Return the live instance, rebuilding it from the agents collection
+        if it was deployed by another process (or before a restart)."""
+        agent = self.get(agent_id)
+        if agent is not None:
+            return agent
+        db = get_db()
+        doc = await db.agents.find_one({"agent_id": agent_id}, {"_id": 0})
+        if not doc or doc.get("status") == "terminated":
+            return None
+        agent = self.instantiate(doc)
+        if agent is not None:
+            self._agents[agent_id] = agent
+        return agent
+
+    def instantiate(self, doc: dict) -> Optional[object]:
+        """Build a live agent from its persisted document, restoring counters."""
+        AgentClass = self._agent_classes.get(doc.get("type"))
+        if AgentClass is None:
+            return None
+        agent = AgentClass(
+            agent_id=doc["agent_id"],
+            name=doc.get("name", ""),
+            config=doc.get("config") or {},
+            description=doc.get("description", ""),
+        )
+        agent.status = doc.get("status", agent.status)
+        agent.created_at = doc.get("created_at", agent.created_at)
+        agent.tasks_completed = doc.get("tasks_completed", 0)
+        agent.tasks_failed = doc.get("tasks_failed", 0)
+        return agent
 
     async def terminate(self, agent_id: str) -> bool:
-        if agent_id not in self._agents:
+        if await self.get_or_load(agent_id) is None:
             return False
         agent = self._agents[agent_id]
+        previous = agent.status
         agent.status = "terminated"
         del self._agents[agent_id]
         db = get_db()
@@ -49,6 +107,8 @@ class AgentOrchestrator:
             {"agent_id": agent_id},
             {"$set": {"status": "terminated"}},
         )
+        if self._metrics:
+            self._metrics.agent_transition(previous, "terminated")
         return True
 
     async def list_agents(self) -> List[dict]:
@@ -73,13 +133,12 @@ class AgentOrchestrator:
 
         return live + historical
 
-    async def sync_counters(self, agent_id: str, completed: int, failed: int):
-        """Persist updated task counters after each task finishes."""
+    async def record_outcome(self, agent_id: str, succeeded: bool):
+        """Persist a finished task against the agent's counters. $inc keeps
+        the totals right when several processes run the same agent."""
         db = get_db()
-        await db.agents.update_one(
-            {"agent_id": agent_id},
-            {"$set": {"tasks_completed": completed, "tasks_failed": failed}},
-        )
+        field = "tasks_completed" if succeeded else "tasks_failed"
+        await db.agents.update_one({"agent_id": agent_id}, {"$inc": {field: 1}})
 
     def get_running_count(self) -> int:
         return sum(1 for a in self._agents.values() if a.status == "running")
@@ -0,0 +1,67 @@
+"""
+Process Pools — lazily started worker pools for CPU-bound batch work
+(record transforms, document pages).
+Workers are started with forkserver (spawn where it isn't available), never
+fork: a forked copy of this process would inherit Motor/pymongo monitor
+threads' locks mid-flight and can deadlock. `map_ordered` keeps every
+worker busy with one item queued behind it and yields results in input
+order, so memory is bounded by the window rather than the input.
+"""
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterable, List, Optional
+
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class ProcessPool:
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        _pools.append(self)
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(_START_METHOD))
+        return self._executor
+
+    async def map_ordered(self, fn: Callable, args: Iterable[tuple]) -> AsyncIterator[Any]:
+        """Run fn(*a) for each tuple in `args` (consumed lazily) and yield
+        the results in order. fn must be a module-level function."""
+        loop = asyncio.get_running_loop()
+        executor = self.executor()
+        queued = iter(args)
+        pending: deque = deque()
+
+        def submit_next() -> None:
+            item = next(queued, None)
+            if item is not None:
+                pending.append(loop.run_in_executor(executor, fn, *item))
+
+        for _ in range(self.workers * 2):
+            submit_next()
+        try:
+            while pending:
+                result = await pending.popleft()
+                submit_next()
+                yield result
+        finally:
+            # Consumer stopped early or an item failed: drop what's still queued
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pools: List[ProcessPool] = []
+
+
+def shutdown_process_pools() -> None:
+    for pool in _pools:
+        pool.shutdown()
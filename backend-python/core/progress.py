@@ -0,0 +1,32 @@
+"""
+Task Progress — lets agent code report partial results for the task it
+is running without threading a callback through every handler.
+process_task installs an emitter in a ContextVar for the duration of the
+task; report_progress() is a no-op outside one.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+ProgressEmitter = Callable[[dict], Awaitable[None]]
+
+_emitter: ContextVar[Optional[ProgressEmitter]] = ContextVar("task_progress_emitter", default=None)
+
+
+@contextmanager
+def progress_scope(emit: ProgressEmitter):
+    token = _emitter.set(emit)
+    try:
+        yield
+    finally:
+        _emitter.reset(token)
+
+
+def progress_enabled() -> bool:
+    return _emitter.get() is not None
+
+
+async def report_progress(**fields) -> None:
+    emit = _emitter.get()
+    if emit is not None:
+        await emit(fields)
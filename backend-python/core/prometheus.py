@@ -0,0 +1,179 @@
+"""
+Prometheus Instruments — minimal counters, gauges and histograms with
+OpenMetrics-style text exposition.
+Instruments are plain dict-backed accumulators updated on the hot path;
+a scrape only formats what has already been counted.
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _Instrument:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+    def _key(self, labels: dict) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _fmt_labels(self, values: LabelValues, extra: str = "") -> str:
+        parts = [f'{name}="{_escape(v)}"' for name, v in zip(self.labels, values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Instrument):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}_total{self._fmt_labels(k)} {_num(v)}" for k, v in self._values.items()
+        ]
+
+
+class Gauge(_Instrument):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), collect: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        # Unlabelled gauges may read an O(1) value at scrape time instead
+        self._collect = collect
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        if self._collect is not None:
+            return self.header() + [f"{self.name} {_num(self._collect())}"]
+        return self.header() + [
+            f"{self.name}{self._fmt_labels(k)} {_num(v)}" for k, v in self._values.items()
+        ]
+
+
+class Histogram(_Instrument):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{self._fmt_labels(key, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._fmt_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._fmt_labels(key)} {_num(self._sums[key])}")
+            lines.append(f"{self.name}_count{self._fmt_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._instruments: List[_Instrument] = []
+
+    def register(self, instrument):
+        self._instruments.append(instrument)
+        return instrument
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), collect=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def exposition(self) -> str:
+        lines: List[str] = []
+        for instrument in self._instruments:
+            lines.extend(instrument.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# ── Platform instruments ──────────────────────────────────────────────────────
+registry = Registry()
+
+TASKS = registry.counter(
+    "workforce_tasks", "Tasks that reached a status", ("status", "task_type", "agent_type"))
+TASK_LATENCY = registry.histogram(
+    "workforce_task_latency_seconds", "End-to-end task latency from submission to finish",
+    ("status", "task_type", "agent_type"))
+TASK_EXECUTION = registry.histogram(
+    "workforce_task_execution_seconds", "Time spent inside agent.execute", ("task_type", "agent_type"))
+MONGO_OPS = registry.histogram(
+    "workforce_mongo_operation_seconds", "MongoDB operation latency", ("collection", "operation"))
+LLM_CALLS = registry.histogram(
+    "workforce_llm_call_seconds", "Claude API call latency", ("model", "mode", "outcome"))
+LLM_TOKENS = registry.counter(
+    "workforce_llm_tokens", "Claude tokens used", ("model", "kind"))
+LLM_CACHE = registry.counter(
+    "workforce_llm_cache_lookups", "LLM response cache lookups", ("result",))
+BROADCAST = registry.histogram(
+    "workforce_broadcast_seconds", "Time to fan a message out to WebSocket send queues",
+    ("event",), buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
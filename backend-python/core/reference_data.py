@@ -0,0 +1,412 @@
+"""
+Reference Data — locally indexed lookup tables for record enrichment.
+Datasets (company lists, geo/zip tables, ...) are loaded from CSV or JSONL
+into one SQLite file each, keyed on a single normalized column. Lookups
+take the distinct keys of a whole batch, answer what they can from an
+in-process LRU (which also remembers misses) and resolve the rest with
+chunked `IN (...)` queries, so enrichment cost scales with distinct keys
+rather than records.
+
+The built file is stored in the `reference_data` GridFS bucket, which is
+the source of truth: every host keeps a local copy in REFERENCE_DATA_DIR,
+downloads it on first use and re-checks for a newer version at most every
+REFERENCE_SYNC_SECONDS, so a task enriches the same way whichever worker
+runs it. Local copies are swapped in atomically; other processes on the
+host notice the swap and reopen.
+"""
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import IO, Dict, Iterable, Iterator, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from .database import get_db
+from .prometheus import MONGO_OPS
+
+REFERENCE_DATA_DIR = os.getenv(
+    "REFERENCE_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data", "reference"))
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", "100000"))
+REFERENCE_SYNC_SECONDS = float(os.getenv("REFERENCE_SYNC_SECONDS", "5"))
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_LOAD_BATCH = 10000
+_QUERY_BATCH = 900  # below SQLite's host-parameter limit
+_COPY_CHUNK = 1024 * 1024
+
+
+def normalize_key(value) -> Optional[str]:
+    if value is None:
+        return None
+    key = str(value).strip().lower()
+    return key or None
+
+
+class _Dataset:
+    """An open dataset file plus its LRU. Reads are serialized on one
+    connection; SQLite calls run in worker threads."""
+
+    def __init__(self, path: str, cache_size: int):
+        self.path = path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._inode = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        inode = os.stat(self.path).st_ino
+        if self._conn is None or inode != self._inode:
+            # First use, or the dataset was reloaded (possibly by another process)
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._inode = inode
+            self._cache.clear()
+        return self._conn
+
+    def lookup(self, keys: Iterable[str]) -> Dict[str, dict]:
+        found: Dict[str, dict] = {}
+        with self._lock:
+            conn = self._connection()
+            cache = self._cache
+            missing = []
+            for key in keys:
+                if key in cache:
+                    cache.move_to_end(key)
+                    self.hits += 1
+                    row = cache[key]
+                    if row is not None:
+                        found[key] = row
+                else:
+                    missing.append(key)
+            self.misses += len(missing)
+            for start in range(0, len(missing), _QUERY_BATCH):
+                chunk = missing[start:start + _QUERY_BATCH]
+                rows = conn.execute(
+                    f"SELECT key, data FROM records WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                resolved = {key: json.loads(data) for key, data in rows}
+                found.update(resolved)
+                for key in chunk:
+                    cache[key] = resolved.get(key)  # None remembers a miss
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return found
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ReferenceStore:
+    def __init__(self, directory: str = REFERENCE_DATA_DIR, cache_size: int = REFERENCE_CACHE_SIZE,
+                 bucket: str = "reference_data", sync_seconds: float = REFERENCE_SYNC_SECONDS):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.bucket_name = bucket
+        self.sync_seconds = sync_seconds
+        self._datasets: Dict[str, _Dataset] = {}
+        self._checked: Dict[str, float] = {}  # name → when the local copy was last verified
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _bucket(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(get_db(), bucket_name=self.bucket_name)
+
+    # ── loading ───────────────────────────────────────────────────────────
+    async def load(self, name: str, source: IO[bytes], key_field: str, fmt: str = "csv") -> dict:
+        """Build dataset `name` from a CSV or JSONL byte stream, replacing any
+        previous version on every host. Returns the dataset metadata."""
+        path = self._path(name)
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError("format must be csv or jsonl")
+        tmp, meta = await asyncio.to_thread(self._build, path, source, key_field, fmt)
+        try:
+            version = await self._upload(name, tmp, meta)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        await asyncio.to_thread(self._install, name, tmp, version)
+        self._checked[name] = time.monotonic()
+        await self._prune(name, keep=version)
+        return meta
+
+    def _build(self, path: str, source: IO[bytes], key_field: str, fmt: str) -> tuple:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        text = io.TextIOWrapper(source, encoding="utf-8", newline="")
+        rows = csv.DictReader(text) if fmt == "csv" else _jsonl(text)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE records (key TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE TABLE meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+            columns: List[str] = []
+            loaded = skipped = 0
+            for batch in _batches(rows, _LOAD_BATCH):
+                pairs = []
+                for row in batch:
+                    key = normalize_key(row.get(key_field))
+                    if key is None:
+                        skipped += 1
+                        continue
+                    if not columns:
+                        columns = list(row)
+                    pairs.append((key, json.dumps(row)))
+                # Later rows win on duplicate keys
+                conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?)", pairs)
+                loaded += len(pairs)
+            if not loaded:
+                raise ValueError(f"No rows with a '{key_field}' value")
+            rows_indexed = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            meta = {
+                "name": os.path.basename(path)[:-len(".sqlite")],
+                "key_field": key_field,
+                "columns": columns,
+                "rows": rows_indexed,
+                "rows_read": loaded + skipped,
+                "rows_skipped": skipped,
+                "format": fmt,
+                "loaded_at": datetime.utcnow().isoformat(),
+            }
+            conn.execute("INSERT INTO meta VALUES ('meta', ?)", (json.dumps(meta),))
+            conn.commit()
+        except Exception as e:
+            conn.close()
+            os.remove(tmp)
+            if isinstance(e, csv.Error):
+                raise ValueError(f"Malformed CSV: {e}") from e
+            raise
+        finally:
+            text.detach()  # the caller owns (and closes) the upload
+        conn.close()
+        return tmp, meta
+
+    # ── reads ─────────────────────────────────────────────────────────────
+    async def lookup_many(self, name: str, keys: Iterable) -> Dict[str, dict]:
+        """Resolve distinct normalized keys in bulk. Returns {key: row} for
+        the keys that exist."""
+        dataset = await self._dataset(name)
+        distinct = {k for k in (normalize_key(v) for v in keys) if k is not None}
+        if not distinct:
+            return {}
+        return await asyncio.to_thread(dataset.lookup, distinct)
+
+    async def list(self) -> List[dict]:
+        files = get_db()[f"{self.bucket_name}.files"]
+        latest = await files.aggregate([
+            {"$sort": {"uploadDate": -1}},
+            {"$group": {"_id": "$filename", "meta": {"$first": "$metadata"}}},
+            {"$sort": {"_id": 1}},
+        ]).to_list(length=None)
+        return [self._describe(d["_id"], d["meta"]) for d in latest]
+
+    async def describe(self, name: str) -> dict:
+        latest = await self._latest(self._validated(name))
+        if latest is None:
+            raise KeyError(name)
+        return self._describe(name, latest.get("metadata"))
+
+    async def delete(self, name: str) -> None:
+        self._validated(name)
+        files = await get_db()[f"{self.bucket_name}.files"].find(
+            {"filename": name}, {"_id": 1}).to_list(length=None)
+        bucket = self._bucket()
+        for f in files:
+            await bucket.delete(f["_id"])
+        await asyncio.to_thread(self._drop_local, name)
+        if not files:
+            raise KeyError(name)
+
+    # ── internals ─────────────────────────────────────────────────────────
+    def _validated(self, name: str) -> str:
+        if not _NAME.match(name or ""):
+            raise ValueError("Dataset names may only contain letters, digits, '_' and '-'")
+        return name
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{self._validated(name)}.sqlite")
+
+    def _describe(self, name: str, meta: Optional[dict]) -> dict:
+        meta = dict(meta or {"name": name})
+        dataset = self._datasets.get(name)
+        if dataset is not None:
+            meta["cache"] = {"hits": dataset.hits, "misses": dataset.misses, "entries": len(dataset._cache)}
+        return meta
+
+    async def _latest(self, name: str) -> Optional[dict]:
+        with MONGO_OPS.time(collection=f"{self.bucket_name}.files", operation="find_one"):
+            return await get_db()[f"{self.bucket_name}.files"].find_one(
+                {"filename": name}, {"_id": 1, "metadata": 1}, sort=[("uploadDate", -1)])
+
+    async def _dataset(self, name: str) -> _Dataset:
+        """The open local copy of `name`, first downloading it (or a newer
+        version) from GridFS if needed. Raises KeyError if it doesn't exist."""
+        path = self._path(name)
+        checked = self._checked.get(name)
+        if checked is None or time.monotonic() - checked >= self.sync_seconds:
+            async with self._locks.setdefault(name, asyncio.Lock()):
+                checked = self._checked.get(name)
+                if checked is None or time.monotonic() - checked >= self.sync_seconds:
+                    await self._sync(name, path)
+        dataset = self._datasets.get(name)
+        if dataset is None:
+            dataset = self._datasets[name] = _Dataset(path, self.cache_size)
+        return dataset
+
+    async def _sync(self, name: str, path: str) -> None:
+        latest = await self._latest(name)
+        if latest is None:
+            self._checked.pop(name, None)
+            await asyncio.to_thread(self._drop_local, name)
+            raise KeyError(name)
+        version = str(latest["_id"])
+        if version != await asyncio.to_thread(self._local_version, name):
+            tmp = f"{path}.{os.getpid()}.download"
+            os.makedirs(self.directory, exist_ok=True)
+            grid_out = await self._bucket().open_download_stream(latest["_id"])
+            try:
+                with open(tmp, "wb") as out:
+                    while True:
+                        chunk = await grid_out.readchunk()
+                        if not chunk:
+                            break
+                        await asyncio.to_thread(out.write, chunk)
+            except BaseException:
+                os.remove(tmp)
+                raise
+            await asyncio.to_thread(self._install, name, tmp, version)
+            print(f"✓ Synced reference dataset {name} ({version})")
+        self._checked[name] = time.monotonic()
+
+    async def _upload(self, name: str, tmp: str, meta: dict) -> str:
+        grid_in = self._bucket().open_upload_stream(name, metadata=meta)
+        try:
+            with open(tmp, "rb") as f:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, _COPY_CHUNK)
+                    if not chunk:
+                        break
+                    await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        return str(grid_in._id)
+
+    async def _prune(self, name: str, keep: str) -> None:
+        """Delete superseded versions of `name` from GridFS."""
+        old = await get_db()[f"{self.bucket_name}.files"].find(
+            {"filename": name, "_id": {"$ne": ObjectId(keep)}}, {"_id": 1}).to_list(length=None)
+        bucket = self._bucket()
+        for f in old:
+            try:
+                await bucket.delete(f["_id"])
+            except Exception as e:
+                print(f"✗ could not delete old reference dataset version {f['_id']}: {e}")
+
+    def _install(self, name: str, tmp: str, version: str) -> None:
+        os.replace(tmp, self._path(name))
+        with open(self._path(name)[:-len(".sqlite")] + ".version", "w") as f:
+            f.write(version)
+
+    def _local_version(self, name: str) -> Optional[str]:
+        if not os.path.exists(self._path(name)):
+            return None
+        try:
+            with open(self._path(name)[:-len(".sqlite")] + ".version") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _drop_local(self, name: str) -> None:
+        dataset = self._datasets.pop(name, None)
+        if dataset is not None:
+            dataset.close()
+        base = self._path(name)[:-len(".sqlite")]
+        for suffix in (".sqlite", ".version"):
+            try:
+                os.remove(base + suffix)
+            except OSError:
+                pass
+
+
+async def join_lookups(records: List[dict], lookups: List[dict], store: "ReferenceStore" = None) -> tuple:
+    """Join reference rows onto copies of `records`. Each lookup is
+    {"dataset", "key_field", "fields"?: [...], "prefix"?: ""}; keys are
+    resolved once per batch. Listed fields are always written; without a
+    list, every column the record doesn't already have is added. Returns
+    (records, per-lookup stats)."""
+    store = store or reference_store
+    joined = [dict(r) for r in records]
+    stats = []
+    for spec in lookups:
+        name, key_field = spec.get("dataset"), spec.get("key_field")
+        if not name or not key_field:
+            raise ValueError("Each lookup needs a dataset and a key_field")
+        fields, prefix = spec.get("fields"), spec.get("prefix", "")
+        keys = [normalize_key(r.get(key_field)) for r in records]
+        try:
+            rows = await store.lookup_many(name, keys)
+        except KeyError:
+            raise ValueError(f"Unknown reference dataset: {name}")
+        matched = 0
+        for record, key in zip(joined, keys):
+            row = rows.get(key)
+            if row is None:
+                continue
+            matched += 1
+            if fields:
+                for column in fields:
+                    if column in row:
+                        record[prefix + column] = row[column]
+            else:
+                # Without an explicit field list, never overwrite the record's own values
+                for column, value in row.items():
+                    record.setdefault(prefix + column, value)
+        stats.append({
+            "dataset": name,
+            "key_field": key_field,
+            "distinct_keys": len({k for k in keys if k is not None}),
+            "keys_found": len(rows),
+            "matched": matched,
+            "unmatched": len(records) - matched,
+        })
+    return joined, stats
+
+
+def _jsonl(text: IO[str]) -> Iterator[dict]:
+    for line in text:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch: List[dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+reference_store = ReferenceStore()
@@ -0,0 +1,246 @@
+"""
+Result Store — keeps large task results out of the tasks collection.
+Results whose JSON encoding exceeds RESULT_INLINE_MAX_BYTES are gzip
+compressed and written to a GridFS bucket; the task document keeps a
+summary (scalar fields plus the size of each omitted collection) and a
+`result_ref` pointing at the blob. GET /tasks/{id}/result streams the blob
+back chunk by chunk.
+
+Tasks whose output is too large to build in memory can instead write it
+through a ResultStream (open_result_stream() inside a running task): items
+are gzip-compressed as they arrive and uploaded to GridFS in chunks, and
+the task document gets the summary and ref as if the result had been
+offloaded.
+"""
+import asyncio
+import gzip
+import json
+import os
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from .database import get_db
+from .prometheus import MONGO_OPS
+
+RESULT_INLINE_MAX_BYTES = int(os.getenv("RESULT_INLINE_MAX_BYTES", str(256 * 1024)))
+RESULT_CHUNK_BYTES = int(os.getenv("RESULT_CHUNK_BYTES", str(255 * 1024)))
+RESULT_COMPRESS_LEVEL = int(os.getenv("RESULT_COMPRESS_LEVEL", "6"))
+
+# Scalar strings longer than this are left out of the inline summary
+SUMMARY_MAX_STRING = 1000
+
+
+class ResultStore:
+    def __init__(self, bucket: str = "task_results", inline_max_bytes: int = RESULT_INLINE_MAX_BYTES):
+        self.bucket_name = bucket
+        self.inline_max_bytes = inline_max_bytes
+        self._offloaded = 0
+        self._bytes_in = 0
+        self._bytes_stored = 0
+        self._streamed: Dict[str, dict] = {}  # task_id → ref, until the task's result is saved
+
+    def _bucket(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(get_db(), bucket_name=self.bucket_name, chunk_size_bytes=RESULT_CHUNK_BYTES)
+
+    # ── public API ────────────────────────────────────────────────────────
+    async def offload(self, task_id: str, result: Any) -> Tuple[Any, Optional[dict]]:
+        """Return (result to store inline, result_ref). Small results come
+        back unchanged with no ref; results already written through a
+        ResultStream come back summarized with that stream's ref."""
+        ref = self._streamed.pop(task_id, None)
+        if ref is not None:
+            summary = summarize(result)
+            summary["offloaded_fields"].setdefault(ref["field"], ref["items"])
+            return summary, ref
+        # Serializing and compressing multi-MB payloads would stall the event loop
+        raw = await asyncio.to_thread(_encode, result)
+        if len(raw) <= self.inline_max_bytes:
+            return result, None
+
+        compressed = await asyncio.to_thread(gzip.compress, raw, RESULT_COMPRESS_LEVEL)
+        with MONGO_OPS.time(collection=self.bucket_name, operation="upload"):
+            blob_id = await self._bucket().upload_from_stream(
+                f"{task_id}.json.gz", compressed,
+                metadata={"task_id": task_id, "encoding": "gzip", "content_type": "application/json",
+                          "size_bytes": len(raw)},
+            )
+        self._offloaded += 1
+        self._bytes_in += len(raw)
+        self._bytes_stored += len(compressed)
+        ref = {
+            "blob_id": str(blob_id),
+            "encoding": "gzip",
+            "size_bytes": len(raw),
+            "stored_bytes": len(compressed),
+        }
+        return summarize(result), ref
+
+    async def open(self, ref: dict, decompress: bool = False) -> AsyncIterator[bytes]:
+        """Open a stored blob and return an iterator over its GridFS chunks —
+        gzip bytes as stored, or plain JSON with `decompress`. Raises
+        gridfs.errors.NoFile if the blob is gone."""
+        grid_out = await self._bucket().open_download_stream(ObjectId(ref["blob_id"]))
+        return _chunks(grid_out, zlib.decompressobj(wbits=31) if decompress else None)
+
+    def stream(self, task_id: str, field: str = "results") -> "ResultStream":
+        return ResultStream(self, task_id, field)
+
+    async def discard_stream(self, task_id: str) -> None:
+        """Drop a finished stream whose task failed before saving its result."""
+        ref = self._streamed.pop(task_id, None)
+        if ref is not None:
+            await self.delete(ref)
+
+    async def delete(self, ref: dict) -> None:
+        await self._bucket().delete(ObjectId(ref["blob_id"]))
+
+    def stats(self) -> dict:
+        return {
+            "inline_max_bytes": self.inline_max_bytes,
+            "offloaded": self._offloaded,
+            "bytes_in": self._bytes_in,
+            "bytes_stored": self._bytes_stored,
+            "compression_ratio": round(self._bytes_in / max(self._bytes_stored, 1), 2),
+        }
+
+
+class ResultStream:
+    """Incrementally written result: {field: [items...], **fields}. Only the
+    compressor's window and GridFS's current chunk are held in memory."""
+
+    def __init__(self, store: ResultStore, task_id: str, field: str):
+        self.store = store
+        self.task_id = task_id
+        self.field = field
+        self.count = 0
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+        self._gzip = zlib.compressobj(RESULT_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        self._grid_in = store._bucket().open_upload_stream(
+            f"{task_id}.json.gz",
+            metadata={"task_id": task_id, "encoding": "gzip", "content_type": "application/json"},
+        )
+        self._pending = [f'{{"{field}": ['.encode()]
+
+    async def write_many(self, items: Iterable[Any]) -> None:
+        pending = self._pending
+        for item in items:
+            if self.count:
+                pending.append(b",")
+            pending.append(json.dumps(item, default=str).encode())
+            self.count += 1
+        await self._flush()
+
+    async def finish(self, fields: Optional[dict] = None) -> dict:
+        """Close the list, append `fields` and complete the upload. The ref is
+        picked up when the task's result (normally `fields` plus the item
+        count) is saved."""
+        tail = json.dumps(fields or {}, default=str)[1:]
+        self._pending.append(b"]" + (b", " + tail.encode() if tail != "}" else b"}"))
+        await self._flush(final=True)
+        await self._grid_in.set("metadata", {
+            "task_id": self.task_id, "encoding": "gzip", "content_type": "application/json",
+            "size_bytes": self._raw_bytes,
+        })
+        with MONGO_OPS.time(collection=self.store.bucket_name, operation="upload"):
+            await self._grid_in.close()
+        store = self.store
+        store._offloaded += 1
+        store._bytes_in += self._raw_bytes
+        store._bytes_stored += self._stored_bytes
+        ref = {
+            "blob_id": str(self._grid_in._id),
+            "encoding": "gzip",
+            "size_bytes": self._raw_bytes,
+            "stored_bytes": self._stored_bytes,
+            "field": self.field,
+            "items": self.count,
+        }
+        store._streamed[self.task_id] = ref
+        return ref
+
+    async def abort(self) -> None:
+        """Discard what was uploaded so far (the task failed)."""
+        await self._grid_in.abort()
+
+    async def _flush(self, final: bool = False) -> None:
+        raw = b"".join(self._pending)
+        self._pending = []
+        self._raw_bytes += len(raw)
+        data = self._gzip.compress(raw)
+        if final:
+            data += self._gzip.flush()
+        if data:
+            self._stored_bytes += len(data)
+            await self._grid_in.write(data)
+
+
+_stream_target: ContextVar[Optional[Tuple[ResultStore, str]]] = ContextVar("result_stream_target", default=None)
+
+
+@contextmanager
+def result_stream_scope(store: ResultStore, task_id: str):
+    """Installed by process_task so agent code can stream its result."""
+    token = _stream_target.set((store, task_id))
+    try:
+        yield
+    finally:
+        _stream_target.reset(token)
+
+
+def open_result_stream(field: str = "results") -> Optional[ResultStream]:
+    """A stream for the running task's result, or None outside a task (the
+    caller should then return its result inline)."""
+    target = _stream_target.get()
+    if target is None:
+        return None
+    store, task_id = target
+    return store.stream(task_id, field)
+
+
+async def _chunks(grid_out, inflater) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        if inflater is not None:
+            chunk = inflater.decompress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+    if inflater is not None:
+        tail = inflater.flush()
+        if tail:
+            yield tail
+
+
+def _encode(result: Any) -> bytes:
+    return json.dumps(result, default=str).encode()
+
+
+def summarize(result: Any) -> Any:
+    """Inline stand-in for an offloaded result: scalar fields are kept so
+    counts and labels still render; lists and dicts are replaced by their
+    sizes under `offloaded_fields`."""
+    if not isinstance(result, dict):
+        return {"offloaded_fields": {"result": _size(result)}}
+    summary: dict = {}
+    omitted: dict = {}
+    for key, value in result.items():
+        if isinstance(value, (bool, int, float)) or value is None:
+            summary[key] = value
+        elif isinstance(value, str) and len(value) <= SUMMARY_MAX_STRING:
+            summary[key] = value
+        else:
+            omitted[key] = _size(value)
+    summary["offloaded_fields"] = omitted
+    return summary
+
+
+def _size(value: Any) -> int:
+    return len(value) if isinstance(value, (list, dict, str)) else 1
@@ -0,0 +1,123 @@
+"""
+Task Scheduler — bounded, priority-aware worker pool.
+Replaces FastAPI BackgroundTasks: tasks wait in a priority queue (10 runs
+before 1, FIFO within a priority) and a fixed number of async workers
+drain it, so a burst of submissions can't start unbounded coroutines.
+"""
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "10000"))
+
+MIN_PRIORITY = 1
+MAX_PRIORITY = 10
+
+
+class TaskScheduler:
+    def __init__(self, workers: int = SCHEDULER_WORKERS, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self._handler: Optional[Callable[[str, Any, dict], Awaitable[None]]] = None
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._busy = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._wait_samples: deque = deque(maxlen=1000)
+
+    # ── lifecycle ─────────────────────────────────────────────────────────
+    def start(self, handler: Callable[[str, Any, dict], Awaitable[None]]) -> None:
+        """Spawn the worker pool; `handler(task_id, agent, task)` runs each task."""
+        if self._workers:
+            return
+        self._handler = handler
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"task-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # ── public API ────────────────────────────────────────────────────────
+    def is_full(self) -> bool:
+        return self._queue is not None and self._queue.full()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def busy(self) -> int:
+        return self._busy
+
+    def free_slots(self) -> int:
+        return self.max_queue - self.depth()
+
+    def submit(self, task_id: str, agent, task: dict) -> int:
+        """Queue a task for execution and return the new queue depth.
+        Raises asyncio.QueueFull when admission control rejects it."""
+        if self._queue is None:
+            raise RuntimeError("TaskScheduler.start() has not been called")
+        priority = min(max(int(task.get("priority", 5)), MIN_PRIORITY), MAX_PRIORITY)
+        entry = (-priority, next(self._seq), time.monotonic(), task_id, agent, task)
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise
+        self._submitted += 1
+        return self._queue.qsize()
+
+    def submit_many(self, items: List[Tuple[str, Any, dict]]) -> int:
+        """Queue (task_id, agent, task) triples all-or-nothing and return the
+        new queue depth. Raises asyncio.QueueFull if they don't all fit."""
+        if len(items) > self.free_slots():
+            self._rejected += len(items)
+            raise asyncio.QueueFull
+        for task_id, agent, task in items:
+            self.submit(task_id, agent, task)
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_samples)
+        n = len(waits)
+        return {
+            "workers": self.workers,
+            "busy_workers": self._busy,
+            "queue_depth": self.depth(),
+            "max_queue": self.max_queue,
+            "submitted": self._submitted,
+            "rejected": self._rejected,
+            "processed": self._processed,
+            "wait_seconds": {
+                "avg": round(sum(waits) / n, 4) if n else 0.0,
+                "p50": round(waits[n // 2], 4) if n else 0.0,
+                "p95": round(waits[min(n - 1, int(n * 0.95))], 4) if n else 0.0,
+                "max": round(waits[-1], 4) if n else 0.0,
+            },
+        }
+
+    # ── internals ─────────────────────────────────────────────────────────
+    async def _worker(self, index: int) -> None:
+        while True:
+            _, _, enqueued_at, task_id, agent, task = await self._queue.get()
+            self._wait_samples.append(time.monotonic() - enqueued_at)
+            self._busy += 1
+            try:
+                await self._handler(task_id, agent, task)
+            except Exception as e:
+                print(f"✗ task {task_id} crashed in worker {index}: {e}")
+            finally:
+                self._busy -= 1
+                self._processed += 1
+                self._queue.task_done()
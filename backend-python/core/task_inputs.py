@@ -0,0 +1,92 @@
+"""
+Task Inputs — large task inputs kept out of the task document.
+A JSONL upload is copied into the `task_inputs` GridFS bucket in bounded
+chunks and the task payload carries only its `input_id`, so a job of any
+size stays well under MongoDB's 16 MB document limit and can be run by
+whichever worker claims it. Agents read the records back page by page.
+"""
+import asyncio
+import json
+import os
+from typing import IO, AsyncIterator, List
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from .database import get_db
+from .prometheus import MONGO_OPS
+
+TASK_INPUT_MAX_BYTES = int(os.getenv("TASK_INPUT_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+_COPY_CHUNK = 1024 * 1024
+
+
+class TaskInputStore:
+    def __init__(self, bucket: str = "task_inputs"):
+        self.bucket_name = bucket
+
+    def _bucket(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(get_db(), bucket_name=self.bucket_name)
+
+    async def save(self, source: IO[bytes], filename: str, max_bytes: int = TASK_INPUT_MAX_BYTES) -> dict:
+        """Copy an upload into GridFS. Returns {"input_id", "bytes"}; raises
+        ValueError past `max_bytes`."""
+        grid_in = self._bucket().open_upload_stream(filename or "input.jsonl",
+                                                    metadata={"content_type": "application/x-ndjson"})
+        size = 0
+        try:
+            while True:
+                chunk = await asyncio.to_thread(source.read, _COPY_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"Input exceeds {max_bytes} bytes")
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        with MONGO_OPS.time(collection=self.bucket_name, operation="upload"):
+            await grid_in.close()
+        return {"input_id": str(grid_in._id), "bytes": size}
+
+    async def pages(self, input_id: str) -> AsyncIterator[List[dict]]:
+        """Yield the records of a JSONL input, one GridFS chunk's worth at a
+        time. Raises ValueError on a line that isn't a JSON object."""
+        grid_out = await self._bucket().open_download_stream(ObjectId(input_id))
+        tail = b""
+        line_no = 0
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            page = []
+            for line in lines:
+                line_no += 1
+                if line.strip():
+                    page.append(_record(line, line_no))
+            if page:
+                yield page
+        if tail.strip():
+            yield [_record(tail, line_no + 1)]
+
+    async def delete(self, input_id: str) -> None:
+        try:
+            await self._bucket().delete(ObjectId(input_id))
+        except Exception:
+            pass
+
+
+def _record(line: bytes, line_no: int) -> dict:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Input line {line_no} is not valid JSON: {e}") from e
+    if not isinstance(record, dict):
+        raise ValueError(f"Input line {line_no} is not a JSON object")
+    return record
+
+
+task_inputs = TaskInputStore()
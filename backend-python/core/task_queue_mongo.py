@@ -1,32 +1,124 @@
 """
 Task Queue — MongoDB-backed, replaces the old JSON file persistence.
 """
-from typing import List, Optional, Any
-from collections import deque
+from typing import AsyncIterator, List, Optional, Any, Tuple
 from datetime import datetime
+import base64
+import json
 import time
 
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
 from .database import get_db
+from .lease import TASK_MAX_ATTEMPTS
+from .prometheus import MONGO_OPS
+from .write_behind import WriteBehindBuffer, TASK_WRITE_BEHIND_MS
+
+
+# Newest first; `id` breaks ties between tasks created in the same instant
+TASK_SORT = [("created_at", -1), ("id", -1)]
+
+
+def encode_cursor(task: dict) -> str:
+    """Opaque keyset cursor pointing just past `task`."""
+    raw = json.dumps([task["created_at"], task["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Inverse of encode_cursor. Raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, task_id = json.loads(raw)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    return str(created_at), str(task_id)
+
+
+def _owned_by(runner: Optional[str]) -> dict:
+    # Tasks from before runners were recorded count as everyone's
+    return {"runner": {"$in": [runner, None]}} if runner else {}
 
 
 class TaskQueue:
-    def __init__(self):
-        self._completed_timestamps: deque = deque(maxlen=1000)
+    def __init__(self, metrics=None, write_behind_ms: float = TASK_WRITE_BEHIND_MS, results=None):
+        # Optional MetricsAggregator kept in step with every status change
+        self._metrics = metrics
+        # Optional ResultStore; large results go to GridFS instead of inline
+        self._results = results
+        # Status updates are batched into bulk_writes when a delay is set
+        self._writer = WriteBehindBuffer("tasks", write_behind_ms) if write_behind_ms > 0 else None
+        # (count, monotonic time) of the last queued-task count
+        self._queued_count: Optional[Tuple[int, float]] = None
 
     # ── public API ────────────────────────────────────────────────────────
     async def enqueue(self, task: dict) -> None:
         db = get_db()
-        await db.tasks.insert_one(task)
+        with MONGO_OPS.time(collection="tasks", operation="insert_one"):
+            await db.tasks.insert_one(task)
+        self._bump_queued(1)
+        if self._metrics:
+            self._metrics.task_enqueued(task["id"], task.get("status", "queued"))
+
+    async def enqueue_many(self, tasks: List[dict]) -> List[dict]:
+        """Persist a batch of tasks with a single unordered insert_many.
+        Returns the tasks that were stored; any the server rejected (e.g. a
+        duplicate id) are left out rather than raising for the whole batch."""
+        if not tasks:
+            return []
+        db = get_db()
+        try:
+            with MONGO_OPS.time(collection="tasks", operation="insert_many"):
+                await db.tasks.insert_many(tasks, ordered=False)
+            inserted = tasks
+        except BulkWriteError as e:
+            rejected = {err["index"] for err in e.details.get("writeErrors", [])}
+            if e.details.get("writeConcernErrors") or not rejected:
+                raise
+            print(f"✗ {len(rejected)} of {len(tasks)} tasks not inserted: {e.details['writeErrors'][0].get('errmsg')}")
+            inserted = [t for i, t in enumerate(tasks) if i not in rejected]
+        self._bump_queued(len(inserted))
+        if self._metrics:
+            for task in inserted:
+                self._metrics.task_enqueued(task["id"], task.get("status", "queued"))
+        return inserted
 
     async def get(self, task_id: str) -> Optional[dict]:
+        if self._writer and self._writer.is_pending(task_id):
+            # Read-your-writes: don't return a document missing buffered updates
+            await self._writer.flush()
         db = get_db()
-        doc = await db.tasks.find_one({"id": task_id}, {"_id": 0})
+        with MONGO_OPS.time(collection="tasks", operation="find_one"):
+            doc = await db.tasks.find_one({"id": task_id}, {"_id": 0})
         return doc
 
+    async def count_queued(self, max_age: float = 0) -> int:
+        """Queued tasks across every process, re-counted at most every
+        `max_age` seconds. Tasks this process enqueues in between are added
+        to the cached count."""
+        now = time.monotonic()
+        if self._queued_count is None or now - self._queued_count[1] >= max_age:
+            with MONGO_OPS.time(collection="tasks", operation="count_documents"):
+                count = await get_db().tasks.count_documents({"status": "queued"})
+            self._queued_count = (count, now)
+        return self._queued_count[0]
+
     async def update_status(
         self, task_id: str, status: str,
-        result: Any = None, error: str = None
-    ) -> None:
+        result: Any = None, error: str = None,
+        return_document: bool = False, current: Optional[dict] = None,
+        fence: Optional[dict] = None,
+    ) -> Optional[dict]:
+        """Apply a status transition. With `return_document`, return the
+        post-update task in the same round trip (find_one_and_update). When
+        updates are write-behind buffered, the returned task is `current`
+        (the caller's copy) with the update applied, so no read is needed;
+        without `current` the buffer is flushed and the task re-read.
+
+        `fence` adds conditions the task must still meet (e.g. a lease
+        owner). Fenced updates are written immediately and return the task,
+        or None — with nothing written — when the fence no longer holds."""
         db = get_db()
         update: dict = {"$set": {"status": status}}
 
@@ -34,28 +126,178 @@ class TaskQueue:
             update["$set"]["started_at"] = datetime.utcnow().isoformat()
         if status in ("completed", "failed"):
             update["$set"]["finished_at"] = datetime.utcnow().isoformat()
-            if status == "completed":
-                self._completed_timestamps.append(time.time())
         if result is not None:
+            if self._results:
+                result, ref = await self._results.offload(task_id, result)
+                if ref is not None:
+                    update["$set"]["result_ref"] = ref
             update["$set"]["result"] = result
         if error is not None:
             update["$set"]["error"] = error
 
-        await db.tasks.update_one({"id": task_id}, update)
+        doc = None
+        if fence is not None:
+            if self._writer and self._writer.is_pending(task_id):
+                await self._writer.flush()
+            with MONGO_OPS.time(collection="tasks", operation="find_one_and_update"):
+                doc = await db.tasks.find_one_and_update(
+                    {**fence, "id": task_id}, update,
+                    projection={"_id": 0},
+                    return_document=ReturnDocument.AFTER,
+                )
+            if doc is None:
+                if "result_ref" in update["$set"]:
+                    await self._results.delete(update["$set"]["result_ref"])
+                return None
+        elif self._writer:
+            self._writer.add(task_id, update)
+            if return_document:
+                if current is not None:
+                    doc = {k: v for k, v in current.items() if k != "_id"}
+                else:
+                    # No caller copy: flush the buffer so the read isn't stale
+                    doc = await self.get(task_id) or {}
+                # Re-apply in case the flush failed and the update is still buffered
+                doc.update(update["$set"])
+        elif return_document:
+            with MONGO_OPS.time(collection="tasks", operation="find_one_and_update"):
+                doc = await db.tasks.find_one_and_update(
+                    {"id": task_id}, update,
+                    projection={"_id": 0},
+                    return_document=ReturnDocument.AFTER,
+                )
+        else:
+            with MONGO_OPS.time(collection="tasks", operation="update_one"):
+                await db.tasks.update_one({"id": task_id}, update)
+        if self._metrics:
+            self._metrics.task_transition(task_id, status)
+        return doc
+
+    async def fail_many(self, task_ids: List[str], error: str) -> int:
+        """Fail a batch of tasks with one update_many (e.g. a submission the
+        scheduler couldn't take)."""
+        if not task_ids:
+            return 0
+        db = get_db()
+        with MONGO_OPS.time(collection="tasks", operation="update_many"):
+            result = await db.tasks.update_many(
+                {"id": {"$in": task_ids}},
+                {"$set": {"status": "failed", "error": error, "finished_at": datetime.utcnow().isoformat()}},
+            )
+        if self._metrics:
+            self._metrics.tasks_transition(task_ids, "failed")
+        return result.modified_count
 
     async def list_tasks(
         self, agent_id: Optional[str] = None, limit: int = 50
     ) -> List[dict]:
+        tasks, _ = await self.list_tasks_page(agent_id=agent_id, limit=limit)
+        return tasks
+
+    async def list_tasks_page(
+        self, agent_id: Optional[str] = None, limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Keyset pagination over (created_at, id), newest first. Returns the
+        page and a cursor for the next one (None on the last page)."""
+        db = get_db()
+        query: dict = {}
+        if agent_id:
+            query["agent_id"] = agent_id
+        if cursor:
+            created_at, task_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": task_id}},
+            ]
+
+        with MONGO_OPS.time(collection="tasks", operation="find"):
+            docs = await (
+                db.tasks.find(query, {"_id": 0}).sort(TASK_SORT).limit(limit + 1)
+            ).to_list(length=limit + 1)
+        if len(docs) > limit:
+            docs = docs[:limit]
+            return docs, encode_cursor(docs[-1])
+        return docs, None
+
+    async def iter_tasks(
+        self, agent_id: Optional[str] = None, status: Optional[str] = None,
+        since: Optional[str] = None, batch_size: int = 1000,
+    ) -> AsyncIterator[dict]:
+        """Yield matching tasks oldest first straight off the Motor cursor,
+        holding at most one batch in memory."""
         db = get_db()
         query: dict = {}
         if agent_id:
             query["agent_id"] = agent_id
+        if status:
+            query["status"] = status
+        if since:
+            query["created_at"] = {"$gte": since}
+
+        cursor = db.tasks.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).batch_size(batch_size)
+        async for doc in cursor:
+            yield doc
+
+    async def queued_page(
+        self, runner: Optional[str] = None, before: Optional[str] = None,
+        after: Optional[Tuple[str, str]] = None, limit: int = 500,
+    ) -> List[dict]:
+        """Queued tasks oldest first, one page at a time: those owned by
+        `runner`, created before `before`, past the (created_at, id) keyset
+        `after`. Pages don't hold a cursor open between calls."""
+        query: dict = {"status": "queued", **_owned_by(runner)}
+        if before:
+            query["created_at"] = {"$lt": before}
+        if after:
+            query["$or"] = [
+                {"created_at": {"$gt": after[0]}},
+                {"created_at": after[0], "id": {"$gt": after[1]}},
+            ]
+        db = get_db()
+        return await db.tasks.find(query, {"_id": 0}).sort(
+            [("created_at", 1), ("id", 1)]).limit(limit).to_list(length=None)
+
+    async def requeue_interrupted(self, max_attempts: int = TASK_MAX_ATTEMPTS, runner: Optional[str] = None) -> int:
+        """Put tasks a previous run of `runner` left running back in the
+        queue. Tasks already requeued `max_attempts` times (e.g. because they
+        take the process down) are failed instead of retried forever. Tasks
+        owned by other processes sharing the database are left alone."""
+        db = get_db()
+        failed = await db.tasks.update_many(
+            {"status": "running", "attempts": {"$gte": max_attempts}, **_owned_by(runner)},
+            {"$set": {
+                "status": "failed",
+                "error": f"Interrupted by {max_attempts} server restarts",
+                "finished_at": datetime.utcnow().isoformat(),
+            }},
+        )
+        if failed.modified_count:
+            print(f"✗ failed {failed.modified_count} tasks interrupted {max_attempts} times")
+        result = await db.tasks.update_many(
+            {"status": "running", **_owned_by(runner)},
+            {"$set": {"status": "queued"}, "$unset": {"started_at": ""}, "$inc": {"attempts": 1}},
+        )
+        return result.modified_count
+
+    async def fail_unfinished(self, error: str, runner: Optional[str] = None) -> int:
+        """Fail every queued or running task of `runner` (used by the "fail"
+        recovery policy)."""
+        db = get_db()
+        result = await db.tasks.update_many(
+            {"status": {"$in": ["queued", "running"]}, **_owned_by(runner)},
+            {"$set": {"status": "failed", "error": error, "finished_at": datetime.utcnow().isoformat()}},
+        )
+        return result.modified_count
+
+    async def close(self) -> None:
+        """Flush any buffered status updates. Call on shutdown."""
+        if self._writer:
+            await self._writer.close()
 
-        cursor = db.tasks.find(query, {"_id": 0}).sort("created_at", -1).limit(limit)
-        return await cursor.to_list(length=limit)
+    def _bump_queued(self, n: int) -> None:
+        if self._queued_count is not None:
+            self._queued_count = (self._queued_count[0] + n, self._queued_count[1])
 
-    def get_throughput(self) -> dict:
-        now = time.time()
-        last_60s = sum(1 for ts in self._completed_timestamps if now - ts < 60)
-        last_300s = sum(1 for ts in self._completed_timestamps if now - ts < 300)
-        return {"per_minute": last_60s, "per_5_minutes": last_300s}
+    def write_stats(self) -> dict:
+        return self._writer.stats() if self._writer else {"enabled": False}
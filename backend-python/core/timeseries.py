@@ -0,0 +1,221 @@
+"""
+Task Time Series — ring buffers of per-second and per-minute buckets.
+Each finished task is counted once per resolution, split by agent type and
+task type, together with queue-wait and execution-time histograms. Reads
+touch only the buckets in the requested window. Minute buckets are also
+$inc-flushed to MongoDB so the series survives restarts and can be read
+across every worker process.
+"""
+import asyncio
+import bisect
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from .database import get_db
+
+TIMESERIES_FLUSH_SECONDS = float(os.getenv("TIMESERIES_FLUSH_SECONDS", "10"))
+
+# Histogram upper bounds in seconds; the last bucket is open-ended
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+RESOLUTIONS = {
+    "second": (1, 300),     # bucket width (s), slots kept: 5 minutes
+    "minute": (60, 1440),   # 24 hours
+}
+
+Key = Tuple[str, str]  # (agent_type, task_type)
+
+
+def _empty_stats() -> dict:
+    return {
+        "completed": 0,
+        "failed": 0,
+        "wait_sum": 0.0,
+        "exec_sum": 0.0,
+        "wait_hist": [0] * (len(LATENCY_BUCKETS) + 1),
+        "exec_hist": [0] * (len(LATENCY_BUCKETS) + 1),
+    }
+
+
+class _Ring:
+    def __init__(self, width: int, slots: int):
+        self.width = width
+        self.slots = slots
+        self._epoch = [-1] * slots
+        self._data: List[Dict[Key, dict]] = [{} for _ in range(slots)]
+
+    def bucket(self, now: float) -> Dict[Key, dict]:
+        index = int(now // self.width)
+        slot = index % self.slots
+        if self._epoch[slot] != index:
+            self._epoch[slot] = index
+            self._data[slot] = {}
+        return self._data[slot]
+
+    def window(self, buckets: int, now: float):
+        """Yield (bucket_start, data) for the last `buckets` buckets, oldest first."""
+        current = int(now // self.width)
+        for index in range(current - min(buckets, self.slots) + 1, current + 1):
+            slot = index % self.slots
+            data = self._data[slot] if self._epoch[slot] == index else {}
+            yield index * self.width, data
+
+
+class TaskTimeSeries:
+    def __init__(self, flush_seconds: float = TIMESERIES_FLUSH_SECONDS):
+        self._rings = {name: _Ring(*spec) for name, spec in RESOLUTIONS.items()}
+        self.flush_seconds = flush_seconds
+        # Unflushed minute-bucket increments: (minute, agent_type, task_type) → stats
+        self._pending: Dict[Tuple[int, str, str], dict] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    # ── recording ─────────────────────────────────────────────────────────
+    def record(self, agent_type: str, task_type: str, status: str,
+               queue_wait: float, exec_time: float, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        key = (agent_type, task_type)
+        wait_bin = bisect.bisect_left(LATENCY_BUCKETS, queue_wait)
+        exec_bin = bisect.bisect_left(LATENCY_BUCKETS, exec_time)
+        targets = [ring.bucket(now).setdefault(key, _empty_stats()) for ring in self._rings.values()]
+        targets.append(self._pending.setdefault((int(now // 60), agent_type, task_type), _empty_stats()))
+        for stats in targets:
+            stats[status] = stats.get(status, 0) + 1
+            stats["wait_sum"] += queue_wait
+            stats["exec_sum"] += exec_time
+            stats["wait_hist"][wait_bin] += 1
+            stats["exec_hist"][exec_bin] += 1
+
+    # ── reads ─────────────────────────────────────────────────────────────
+    def get_throughput(self) -> dict:
+        now = time.time()
+        per_second = [sum(s["completed"] for s in data.values())
+                      for _, data in self._rings["second"].window(300, now)]
+        return {"per_minute": sum(per_second[-60:]), "per_5_minutes": sum(per_second)}
+
+    def series(self, resolution: str = "minute", buckets: int = 60,
+               agent_type: Optional[str] = None, task_type: Optional[str] = None) -> dict:
+        ring = self._rings[resolution]
+        points = []
+        totals = _empty_stats()
+        for start, data in ring.window(buckets, time.time()):
+            point = _empty_stats()
+            for (a_type, t_type), stats in data.items():
+                if (agent_type and a_type != agent_type) or (task_type and t_type != task_type):
+                    continue
+                _merge(point, stats)
+            _merge(totals, point)
+            points.append({"t": start, "completed": point["completed"], "failed": point["failed"]})
+        return _shape(resolution, ring.width, points, totals)
+
+    async def shared_series(self, buckets: int = 60, agent_type: Optional[str] = None,
+                            task_type: Optional[str] = None) -> dict:
+        """Minute series summed across every process, from MongoDB."""
+        current = int(time.time() // 60)
+        query: dict = {"minute": {"$gt": current - buckets}}
+        if agent_type:
+            query["agent_type"] = agent_type
+        if task_type:
+            query["task_type"] = task_type
+        by_minute: Dict[int, dict] = {}
+        async for doc in get_db().task_timeseries.find(query, {"_id": 0}):
+            stats = by_minute.setdefault(doc["minute"], _empty_stats())
+            _merge(stats, _from_doc(doc))
+        points = []
+        totals = _empty_stats()
+        for minute in range(current - buckets + 1, current + 1):
+            stats = by_minute.get(minute, _empty_stats())
+            _merge(totals, stats)
+            points.append({"t": minute * 60, "completed": stats["completed"], "failed": stats["failed"]})
+        return _shape("minute", 60, points, totals)
+
+    # ── persistence ───────────────────────────────────────────────────────
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop(), name="timeseries-flush")
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        ops = []
+        for (minute, agent_type, task_type), stats in pending.items():
+            inc = {
+                "completed": stats["completed"],
+                "failed": stats["failed"],
+                "wait_sum": stats["wait_sum"],
+                "exec_sum": stats["exec_sum"],
+            }
+            for i, n in enumerate(stats["wait_hist"]):
+                if n:
+                    inc[f"wait_hist.{i}"] = n
+            for i, n in enumerate(stats["exec_hist"]):
+                if n:
+                    inc[f"exec_hist.{i}"] = n
+            ops.append(UpdateOne(
+                {"_id": f"{minute}:{agent_type}:{task_type}"},
+                {"$inc": inc, "$setOnInsert": {"minute": minute, "agent_type": agent_type, "task_type": task_type}},
+                upsert=True,
+            ))
+        try:
+            await get_db().task_timeseries.bulk_write(ops, ordered=False)
+        except Exception as e:
+            print(f"✗ time series flush failed: {e}")
+            # Keep the increments for the next attempt
+            for key, stats in pending.items():
+                _merge(self._pending.setdefault(key, _empty_stats()), stats)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+
+def _merge(into: dict, stats: dict) -> None:
+    for field in ("completed", "failed", "wait_sum", "exec_sum"):
+        into[field] += stats.get(field, 0)
+    for field in ("wait_hist", "exec_hist"):
+        for i, n in enumerate(stats[field]):
+            into[field][i] += n
+
+
+def _from_doc(doc: dict) -> dict:
+    stats = _empty_stats()
+    for field in ("completed", "failed", "wait_sum", "exec_sum"):
+        stats[field] = doc.get(field, 0)
+    for field in ("wait_hist", "exec_hist"):
+        for i, n in (doc.get(field) or {}).items():
+            stats[field][int(i)] = n
+    return stats
+
+
+def _histogram(counts: List[int]) -> List[dict]:
+    bounds = [str(b) for b in LATENCY_BUCKETS] + ["+Inf"]
+    return [{"le": le, "count": n} for le, n in zip(bounds, counts)]
+
+
+def _shape(resolution: str, width: int, points: List[dict], totals: dict) -> dict:
+    finished = totals["completed"] + totals["failed"]
+    return {
+        "resolution": resolution,
+        "bucket_seconds": width,
+        "points": points,
+        "totals": {"completed": totals["completed"], "failed": totals["failed"]},
+        "queue_wait": {
+            "avg_seconds": round(totals["wait_sum"] / max(finished, 1), 4),
+            "histogram": _histogram(totals["wait_hist"]),
+        },
+        "execution": {
+            "avg_seconds": round(totals["exec_sum"] / max(finished, 1), 4),
+            "histogram": _histogram(totals["exec_hist"]),
+        },
+    }
@@ -0,0 +1,151 @@
+"""
+Write-Behind Buffer — batches task status updates into bulk_write calls.
+Updates are buffered for a few milliseconds (or until the batch is full)
+and flushed as one ordered bulk_write. Flushes are serialized, so updates
+to the same task are applied in the order they were made. A failed flush
+puts its updates back at the front of the buffer and retries with backoff
+(the $set updates are idempotent, so re-applying a partly written batch is
+safe); after TASK_WRITE_BEHIND_RETRIES failures in a row the batch is
+written one update_one at a time so a single bad update can't hold up the
+rest.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from .database import get_db
+from .prometheus import MONGO_OPS
+
+TASK_WRITE_BEHIND_MS = float(os.getenv("TASK_WRITE_BEHIND_MS", "0"))  # 0 = disabled
+TASK_WRITE_BEHIND_MAX_BATCH = int(os.getenv("TASK_WRITE_BEHIND_MAX_BATCH", "500"))
+TASK_WRITE_BEHIND_RETRIES = int(os.getenv("TASK_WRITE_BEHIND_RETRIES", "5"))
+_MAX_BACKOFF = 5.0
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        collection: str = "tasks",
+        delay_ms: float = TASK_WRITE_BEHIND_MS,
+        max_batch: int = TASK_WRITE_BEHIND_MAX_BATCH,
+    ):
+        self.collection = collection
+        self.delay = max(delay_ms, 0) / 1000
+        self.max_batch = max(1, max_batch)
+        self._ops: List[Tuple[str, dict]] = []
+        self._pending_ids: Set[str] = set()
+        self._flushing_ids: Set[str] = set()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Strong refs to scheduled flushes so they can't be collected mid-write
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+        self._consecutive_failures = 0
+        self._flushes = 0
+        self._written = 0
+        self._failed = 0
+        self._retried = 0
+        self._max_batch_seen = 0
+        self._flush_ms: deque = deque(maxlen=200)
+
+    def add(self, task_id: str, update: dict) -> None:
+        self._ops.append((task_id, update))
+        self._pending_ids.add(task_id)
+        if len(self._ops) >= self.max_batch and not self._consecutive_failures:
+            self._cancel_timer()
+            self._spawn_flush()
+        elif self._timer is None:
+            self._schedule(self.delay)
+
+    def is_pending(self, task_id: str) -> bool:
+        """True while an update to task_id is buffered or being written."""
+        return task_id in self._pending_ids or task_id in self._flushing_ids
+
+    async def flush(self) -> None:
+        async with self._lock:
+            self._cancel_timer()
+            if not self._ops:
+                return
+            ops, self._ops = self._ops, []
+            self._flushing_ids, self._pending_ids = self._pending_ids, set()
+            started = time.perf_counter()
+            try:
+                if self._consecutive_failures >= TASK_WRITE_BEHIND_RETRIES:
+                    await self._write_individually(ops)
+                else:
+                    with MONGO_OPS.time(collection=self.collection, operation="bulk_write"):
+                        await get_db()[self.collection].bulk_write(
+                            [UpdateOne({"id": task_id}, update) for task_id, update in ops], ordered=True)
+                    self._written += len(ops)
+                self._consecutive_failures = 0
+            except Exception as e:
+                # Keep the updates (ahead of newer ones) and try again later
+                self._consecutive_failures += 1
+                self._retried += len(ops)
+                self._ops = ops + self._ops
+                self._pending_ids |= self._flushing_ids
+                backoff = min(max(self.delay, 0.1) * 2 ** (self._consecutive_failures - 1), _MAX_BACKOFF)
+                print(f"✗ write-behind flush of {len(ops)} task updates failed, retrying in {backoff:.2f}s: {e}")
+                self._schedule(backoff)
+            finally:
+                self._flushing_ids = set()
+            self._flushes += 1
+            self._max_batch_seen = max(self._max_batch_seen, len(ops))
+            self._flush_ms.append((time.perf_counter() - started) * 1000)
+
+    async def _write_individually(self, ops: List[Tuple[str, dict]]) -> None:
+        coll = get_db()[self.collection]
+        for task_id, update in ops:
+            try:
+                with MONGO_OPS.time(collection=self.collection, operation="update_one"):
+                    await coll.update_one({"id": task_id}, update)
+                self._written += 1
+            except Exception as e:
+                self._failed += 1
+                print(f"✗ dropping update to task {task_id} after repeated failures: {e}")
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._ops:
+            # Shutting down: no time left for backoff, write what we can one by one
+            self._consecutive_failures = TASK_WRITE_BEHIND_RETRIES
+            await self.flush()
+        self._cancel_timer()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        latencies = list(self._flush_ms)
+        return {
+            "enabled": True,
+            "delay_ms": self.delay * 1000,
+            "max_batch": self.max_batch,
+            "pending": len(self._ops),
+            "flushes": self._flushes,
+            "written": self._written,
+            "failed": self._failed,
+            "retried": self._retried,
+            "avg_batch_size": round((self._written + self._failed) / max(self._flushes, 1), 1),
+            "largest_batch": self._max_batch_seen,
+            "flush_latency_ms": {
+                "avg": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "max": round(max(latencies), 2) if latencies else 0.0,
+            },
+        }
+
+    def _spawn_flush(self) -> None:
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    def _schedule(self, delay: float) -> None:
+        self._cancel_timer()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._spawn_flush)
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
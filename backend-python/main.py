@@ -7,21 +7,38 @@ from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks, Request, Response, UploadFile, File, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from gridfs.errors import NoFile
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
 import asyncio
 import json
+import socket
 import uuid
 import time
-from datetime import datetime
-from agents.customer_support import CustomerSupportAgent
-from agents.data_entry import DataEntryAgent
-from agents.software_engineer import SoftwareEngineerAgent
+from datetime import datetime, timezone
+from agents.registry import AGENT_CLASSES
 from core.orchestrator_mongo import AgentOrchestrator
 from core.task_queue_mongo import TaskQueue
+from core.metrics import MetricsAggregator
+from core.scheduler import TaskScheduler, MIN_PRIORITY, MAX_PRIORITY
+from core.broadcast import BroadcastHub, SUBSCRIPTION_FIELDS
+from core.event_bus import create_event_bus
 from core.database import ensure_indexes, ping
+from core.llm import close_llm_client, llm_stats
+from agents.documents import spool_document, discard_document, sweep_spool
+from core.llm_cache import llm_cache
+from core.progress import progress_scope
+from core.timeseries import TaskTimeSeries, RESOLUTIONS
+from core.result_store import ResultStore, result_stream_scope
+from core.dedup_index import dedup_indexes
+from core.reference_data import reference_store
+from core.task_inputs import task_inputs
+from core.process_pool import shutdown_process_pools
+from core.lease import TaskLeaseManager, TASK_EXECUTION_MODE
+from core.prometheus import registry, TASKS, TASK_LATENCY, TASK_EXECUTION, BROADCAST
 
 
 # ─── Lifecycle ────────────────────────────────────────────────────────────────
@@ -34,8 +51,46 @@ async def lifespan(app):
     else:
         print("✗ MongoDB unreachable — check MONGODB_URI")
     await ensure_indexes()
+    # Before anything below can broadcast (requeued and claimed tasks do)
+    hub.set_snapshot_provider(build_snapshot)
+    await event_bus.start(deliver_event)
+    restored = await orchestrator.rehydrate()
+    print(f"✓ {restored} agents restored")
+    boot_time = datetime.utcnow().isoformat()
+    recovery = None
+    if not LEASE_MODE and ORPHAN_TASK_POLICY == "fail":
+        await task_queue.fail_unfinished("Interrupted by a server restart", runner=TASK_RUNNER)
+    elif not LEASE_MODE:
+        await task_queue.requeue_interrupted(runner=TASK_RUNNER)
+    await metrics.seed()
+    scheduler.start(process_task)
+    if LEASE_MODE:
+        # Orphans are reclaimed when their leases expire
+        leases.start(orchestrator, scheduler, fail_unrunnable)
+        # Other processes enqueue and finish tasks too; keep counts in step
+        metrics.start_refresh()
+    elif ORPHAN_TASK_POLICY != "fail":
+        recovery = asyncio.create_task(resubmit_queued_tasks(boot_time), name="resubmit-queued")
+    timeseries.start()
+    swept = await asyncio.to_thread(sweep_spool)
+    if swept:
+        print(f"✓ removed {swept} stale spooled documents")
     yield
-    # Shutdown (nothing to clean up — motor handles pool)
+    # Shutdown — motor handles its own pool
+    if recovery is not None:
+        recovery.cancel()
+        await asyncio.gather(recovery, return_exceptions=True)
+    await event_bus.stop()
+    await hub.close()
+    if LEASE_MODE:
+        await leases.stop()
+        await metrics.stop()
+    await scheduler.stop()
+    await dedup_indexes.flush_all()
+    await task_queue.close()
+    await timeseries.stop()
+    await close_llm_client()
+    shutdown_process_pools()
 
 
 app = FastAPI(title="AI Workforce Platform", version="1.0.0", lifespan=lifespan)
@@ -45,12 +100,39 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # MongoDB-backed stores
-orchestrator = AgentOrchestrator()
-task_queue = TaskQueue()
-active_connections: Dict[str, WebSocket] = {}
+metrics = MetricsAggregator()
+orchestrator = AgentOrchestrator(metrics=metrics, agent_classes=AGENT_CLASSES)
+result_store = ResultStore()
+task_queue = TaskQueue(metrics=metrics, results=result_store)
+scheduler = TaskScheduler()
+timeseries = TaskTimeSeries()
+TASK_BATCH_MAX = int(os.getenv("TASK_BATCH_MAX", "5000"))
+hub = BroadcastHub()
+# Every update goes through the bus so each process's hub sees all of them:
+# EVENT_BUS=mongo when running several workers, "memory" for a single process
+event_bus = create_event_bus()
+# "lease": every process claims queued tasks from MongoDB, so the backend
+# can run several uvicorn workers or hosts. "local": run in the accepting process.
+LEASE_MODE = TASK_EXECUTION_MODE == "lease"
+leases = TaskLeaseManager()
+# What a restarted process does with tasks left queued/running: "requeue" | "fail"
+ORPHAN_TASK_POLICY = os.getenv("ORPHAN_TASK_POLICY", "requeue")
+# Local mode: tasks belong to the process that accepted them, and a restart
+# only recovers its own. Give each local-mode process sharing a database a
+# stable, distinct id (several workers on one host need lease mode instead).
+TASK_INSTANCE_ID = os.getenv("TASK_INSTANCE_ID", socket.gethostname())
+TASK_RUNNER = None if LEASE_MODE else TASK_INSTANCE_ID
+# Lease mode admission control re-counts queued tasks at most this often
+QUEUE_DEPTH_CACHE_SECONDS = float(os.getenv("QUEUE_DEPTH_CACHE_SECONDS", "1"))
+
+# Gauges read O(1) state at scrape time; everything else is counted on the hot path
+registry.gauge("workforce_task_queue_depth", "Tasks waiting for a scheduler worker", collect=scheduler.depth)
+registry.gauge("workforce_task_workers_busy", "Scheduler workers executing a task", collect=scheduler.busy)
+registry.gauge("workforce_websocket_connections", "Open WebSocket connections", collect=hub.connection_count)
 
 # ─── Models ──────────────────────────────────────────────────────────────────
 
@@ -64,7 +146,13 @@ class SubmitTaskRequest(BaseModel):
     agent_id: str
     task_type: str
     payload: Dict[str, Any]
-    priority: int = 5  # 1-10
+    priority: int = Field(5, ge=MIN_PRIORITY, le=MAX_PRIORITY)  # 10 runs first
+
+class SubmitBatchRequest(BaseModel):
+    tasks: List[SubmitTaskRequest] = Field(..., min_length=1, max_length=TASK_BATCH_MAX)
+
+class DedupIndexRequest(BaseModel):
+    key_fields: List[str] = Field(..., min_length=1)
 
 class AgentResponse(BaseModel):
     id: str
@@ -81,12 +169,6 @@ class AgentResponse(BaseModel):
 
 ALLOWED_AGENT_TYPES = {"software_engineer"}
 
-AGENT_CLASSES = {
-    "customer_support": CustomerSupportAgent,
-    "data_entry": DataEntryAgent,
-    "software_engineer": SoftwareEngineerAgent,
-}
-
 # ─── REST Endpoints ──────────────────────────────────────────────────────────
 
 @app.get("/health")
@@ -104,7 +186,7 @@ async def deploy_agent(req: DeployAgentRequest, background_tasks: BackgroundTask
     if req.agent_type not in ALLOWED_AGENT_TYPES:
         raise HTTPException(403, f"Agent type '{req.agent_type}' is not enabled")
     
-    agent_id = str(uuid.uuid4())[:8]
+    agent_id = uuid.uuid4().hex
     AgentClass = AGENT_CLASSES[req.agent_type]
     agent = AgentClass(
         agent_id=agent_id,
@@ -132,18 +214,95 @@ async def terminate_agent(agent_id: str):
 
 @app.get("/agents/{agent_id}/status")
 async def agent_status(agent_id: str):
-    agent = orchestrator.get(agent_id)
+    agent = await orchestrator.get_or_load(agent_id)
     if not agent:
         raise HTTPException(404, "Agent not found")
     return agent.get_status()
 
+@app.get("/agents/{agent_id}/dedup_indexes")
+async def list_dedup_indexes(agent_id: str):
+    if not await orchestrator.get_or_load(agent_id):
+        raise HTTPException(404, "Agent not found")
+    return await dedup_indexes.list(agent_id)
+
+@app.post("/agents/{agent_id}/dedup_indexes/reset")
+async def reset_dedup_index(agent_id: str, req: DedupIndexRequest):
+    if not await orchestrator.get_or_load(agent_id):
+        raise HTTPException(404, "Agent not found")
+    removed = await dedup_indexes.reset(agent_id, req.key_fields)
+    return {"agent_id": agent_id, "key_fields": req.key_fields, "keys_removed": removed}
+
+@app.post("/agents/{agent_id}/dedup_indexes/rebuild")
+async def rebuild_dedup_index(agent_id: str, req: DedupIndexRequest):
+    if not await orchestrator.get_or_load(agent_id):
+        raise HTTPException(404, "Agent not found")
+    return await dedup_indexes.rebuild(agent_id, req.key_fields)
+
+@app.get("/reference")
+async def list_reference_datasets():
+    return await reference_store.list()
+
+@app.get("/reference/{name}")
+async def describe_reference_dataset(name: str):
+    try:
+        return await reference_store.describe(name)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except KeyError:
+        raise HTTPException(404, "Reference dataset not found")
+
+@app.post("/reference/{name}")
+async def load_reference_dataset(name: str, key_field: str, format: str = "csv", file: UploadFile = File(...)):
+    # Replaces any existing dataset of the same name once the new one is built
+    try:
+        meta = await reference_store.load(name, file.file, key_field, format)
+    except (ValueError, KeyError, UnicodeDecodeError) as e:
+        raise HTTPException(400, f"Could not load dataset: {e}")
+    finally:
+        await file.close()
+    print(f"✓ Loaded reference dataset {name}: {meta['rows']} rows keyed on {key_field}")
+    return meta
+
+@app.delete("/reference/{name}")
+async def delete_reference_dataset(name: str):
+    try:
+        await reference_store.delete(name)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except KeyError:
+        raise HTTPException(404, "Reference dataset not found")
+    return {"status": "deleted", "name": name}
+
+async def queue_depth() -> int:
+    # In lease mode the queue is the tasks collection, shared by every process;
+    # this process's counters never see tasks other processes enqueue
+    if LEASE_MODE:
+        return await task_queue.count_queued(QUEUE_DEPTH_CACHE_SECONDS)
+    return scheduler.depth()
+
+async def queue_has_room(n: int) -> bool:
+    if LEASE_MODE:
+        return await queue_depth() + n <= scheduler.max_queue
+    return n <= scheduler.free_slots()
+
+async def dispatch(items: List[tuple]) -> int:
+    """Hand freshly persisted (task_id, agent, task) triples to execution and
+    return the queue depth. Raises asyncio.QueueFull in local mode."""
+    if LEASE_MODE:
+        # Already queued in MongoDB; wake this process's claimer
+        leases.notify()
+        return await queue_depth()
+    return scheduler.submit_many(items)
+
 @app.post("/tasks/submit")
-async def submit_task(req: SubmitTaskRequest, background_tasks: BackgroundTasks):
-    agent = orchestrator.get(req.agent_id)
+async def submit_task(req: SubmitTaskRequest):
+    agent = await orchestrator.get_or_load(req.agent_id)
     if not agent:
         raise HTTPException(404, f"Agent {req.agent_id} not found")
+    if not await queue_has_room(1):
+        raise HTTPException(429, {"error": "Task queue is full", "queue_depth": await queue_depth()})
     
-    task_id = str(uuid.uuid4())[:8]
+    task_id = uuid.uuid4().hex
     task = {
         "id": task_id,
         "agent_id": req.agent_id,
@@ -153,12 +312,123 @@ async def submit_task(req: SubmitTaskRequest, background_tasks: BackgroundTasks)
         "status": "queued",
         "created_at": datetime.utcnow().isoformat(),
         "result": None,
-        "error": None
+        "error": None,
+        "runner": TASK_RUNNER,
     }
     await task_queue.enqueue(task)
-    background_tasks.add_task(process_task, task_id, agent, task)
+    TASKS.inc(status="queued", task_type=req.task_type, agent_type=agent.agent_type)
+    try:
+        depth = await dispatch([(task_id, agent, task)])
+    except asyncio.QueueFull:
+        # Filled up while we were inserting — don't leave the task dangling
+        await task_queue.update_status(task_id, "failed", error="Rejected: task queue is full")
+        raise HTTPException(429, {"error": "Task queue is full", "queue_depth": await queue_depth()})
     
-    return {"task_id": task_id, "status": "queued"}
+    return {"task_id": task_id, "status": "queued", "queue_depth": depth}
+
+@app.post("/agents/{agent_id}/documents")
+async def upload_document(agent_id: str, document_type: str = "invoice",
+                          priority: int = Query(5, ge=MIN_PRIORITY, le=MAX_PRIORITY), file: UploadFile = File(...)):
+    """Spool an uploaded document to disk and queue a parse_document task for it."""
+    agent = await orchestrator.get_or_load(agent_id)
+    if not agent:
+        raise HTTPException(404, f"Agent {agent_id} not found")
+    if agent.agent_type != "data_entry":
+        raise HTTPException(400, "Documents can only be parsed by data entry agents")
+    try:
+        document_id, fmt, size = await asyncio.to_thread(spool_document, file.file, file.filename)
+    except ValueError as e:
+        raise HTTPException(413, str(e))
+    finally:
+        await file.close()
+    payload = {"document_id": document_id, "document_type": document_type, "filename": file.filename}
+    try:
+        queued = await submit_task(SubmitTaskRequest(
+            agent_id=agent_id, task_type="parse_document", payload=payload, priority=priority))
+    except HTTPException:
+        discard_document(document_id)
+        raise
+    return {**queued, "document_id": document_id, "format": fmt, "bytes": size}
+
+@app.post("/agents/{agent_id}/tickets")
+async def upload_tickets(agent_id: str, priority: int = Query(5, ge=MIN_PRIORITY, le=MAX_PRIORITY),
+                         batch_size: Optional[int] = Query(None, ge=1), file: UploadFile = File(...)):
+    """Store a JSONL file of tickets in GridFS and queue a bulk_classify task
+    that reads it from there, for jobs too large to send inline."""
+    agent = await orchestrator.get_or_load(agent_id)
+    if not agent:
+        raise HTTPException(404, f"Agent {agent_id} not found")
+    if agent.agent_type != "customer_support":
+        raise HTTPException(400, "Tickets can only be classified by customer support agents")
+    try:
+        stored = await task_inputs.save(file.file, file.filename)
+    except ValueError as e:
+        raise HTTPException(413, str(e))
+    finally:
+        await file.close()
+    payload = {"input_id": stored["input_id"], "filename": file.filename}
+    if batch_size:
+        payload["batch_size"] = batch_size
+    try:
+        queued = await submit_task(SubmitTaskRequest(
+            agent_id=agent_id, task_type="bulk_classify", payload=payload, priority=priority))
+    except HTTPException:
+        await task_inputs.delete(stored["input_id"])
+        raise
+    return {**queued, **stored}
+
+@app.post("/tasks/submit_batch")
+async def submit_task_batch(req: SubmitBatchRequest):
+    # Pydantic has already validated every entry; resolve each agent once
+    agents = {aid: await orchestrator.get_or_load(aid) for aid in {t.agent_id for t in req.tasks}}
+    missing = sorted(aid for aid, agent in agents.items() if not agent)
+    if missing:
+        raise HTTPException(404, f"Agents not found: {', '.join(missing)}")
+    if not await queue_has_room(len(req.tasks)):
+        raise HTTPException(429, {"error": "Task queue is full", "queue_depth": await queue_depth()})
+
+    created_at = datetime.utcnow().isoformat()
+    tasks = [
+        {
+            "id": uuid.uuid4().hex,
+            "agent_id": t.agent_id,
+            "type": t.task_type,
+            "payload": t.payload,
+            "priority": t.priority,
+            "status": "queued",
+            "created_at": created_at,
+            "result": None,
+            "error": None,
+            "runner": TASK_RUNNER,
+        }
+        for t in req.tasks
+    ]
+    tasks = await task_queue.enqueue_many(tasks)
+    if not tasks:
+        raise HTTPException(500, "No tasks could be stored")
+    for t in tasks:
+        TASKS.inc(status="queued", task_type=t["type"], agent_type=agents[t["agent_id"]].agent_type)
+    try:
+        depth = await dispatch([(t["id"], agents[t["agent_id"]], t) for t in tasks])
+    except asyncio.QueueFull:
+        await task_queue.fail_many([t["id"] for t in tasks], "Rejected: task queue is full")
+        raise HTTPException(429, {"error": "Task queue is full", "queue_depth": await queue_depth()})
+
+    return {"task_ids": [t["id"] for t in tasks], "status": "queued", "queue_depth": depth,
+            "rejected": len(req.tasks) - len(tasks)}
+
+@app.get("/tasks/export")
+async def export_tasks(agent_id: Optional[str] = None, status: Optional[str] = None,
+                       since: Optional[str] = None):
+    async def ndjson():
+        async for task in task_queue.iter_tasks(agent_id=agent_id, status=status, since=since):
+            yield json.dumps(task, default=str) + "\n"
+
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="tasks.ndjson"'},
+    )
 
 @app.get("/tasks/{task_id}")
 async def get_task(task_id: str):
@@ -167,90 +437,239 @@ async def get_task(task_id: str):
         raise HTTPException(404, "Task not found")
     return task
 
+@app.get("/tasks/{task_id}/result")
+async def get_task_result(task_id: str, request: Request):
+    """Full task result. Offloaded results stream from GridFS, gzip-encoded
+    when the client accepts it."""
+    task = await task_queue.get(task_id)
+    if not task:
+        raise HTTPException(404, "Task not found")
+    ref = task.get("result_ref")
+    if not ref:
+        return JSONResponse(task.get("result"))
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    try:
+        chunks = await result_store.open(ref, decompress=not accepts_gzip)
+    except NoFile:
+        raise HTTPException(404, "Task result blob not found")
+    return StreamingResponse(
+        chunks,
+        media_type="application/json",
+        headers={"Content-Encoding": "gzip"} if accepts_gzip else None,
+    )
+
 @app.get("/tasks")
-async def list_tasks(agent_id: Optional[str] = None, limit: int = 50):
-    return await task_queue.list_tasks(agent_id=agent_id, limit=limit)
+async def list_tasks(response: Response, agent_id: Optional[str] = None, limit: int = 50,
+                     cursor: Optional[str] = None):
+    try:
+        tasks, next_cursor = await task_queue.list_tasks_page(
+            agent_id=agent_id, limit=max(1, min(limit, 1000)), cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tasks
 
 @app.get("/metrics")
 async def platform_metrics():
-    agents = await orchestrator.list_agents()
-    tasks = await task_queue.list_tasks(limit=1000)
-    
-    total_tasks = len(tasks)
-    completed = sum(1 for t in tasks if t["status"] == "completed")
-    failed = sum(1 for t in tasks if t["status"] == "failed")
-    running = sum(1 for t in tasks if t["status"] == "running")
-    
     return {
-        "agents": {
-            "total": len(agents),
-            "running": sum(1 for a in agents if a["status"] == "running"),
-            "idle": sum(1 for a in agents if a["status"] == "idle"),
-        },
-        "tasks": {
-            "total": total_tasks,
-            "completed": completed,
-            "failed": failed,
-            "running": running,
-            "success_rate": round(completed / max(total_tasks, 1) * 100, 1)
-        },
-        "throughput": task_queue.get_throughput()
+        **metrics.snapshot(),
+        "throughput": timeseries.get_throughput(),
+        "scheduler": scheduler.stats(),
     }
 
+@app.get("/metrics/prometheus")
+async def prometheus_metrics():
+    return PlainTextResponse(
+        registry.exposition(),
+        media_type="application/openmetrics-text; version=1.0.0; charset=utf-8",
+    )
+
+@app.get("/metrics/timeseries")
+async def timeseries_metrics(resolution: str = "minute", buckets: int = 60,
+                             agent_type: Optional[str] = None, task_type: Optional[str] = None,
+                             scope: str = "local"):
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(400, f"resolution must be one of: {', '.join(RESOLUTIONS)}")
+    buckets = max(1, min(buckets, RESOLUTIONS[resolution][1]))
+    if scope == "cluster":
+        if resolution != "minute":
+            raise HTTPException(400, "cluster scope is only kept at minute resolution")
+        return await timeseries.shared_series(buckets, agent_type=agent_type, task_type=task_type)
+    return timeseries.series(resolution, buckets, agent_type=agent_type, task_type=task_type)
+
+@app.get("/metrics/scheduler")
+async def scheduler_metrics():
+    return scheduler.stats()
+
+@app.get("/metrics/task_writes")
+async def task_write_metrics():
+    return task_queue.write_stats()
+
+@app.get("/metrics/leases")
+async def lease_metrics():
+    return leases.stats()
+
+@app.get("/metrics/results")
+async def result_metrics():
+    return result_store.stats()
+
+@app.get("/metrics/llm")
+async def llm_metrics():
+    return {**llm_stats(), "cache": llm_cache.stats()}
+
+@app.get("/metrics/websocket")
+async def websocket_metrics():
+    return {**hub.stats(), "event_bus": event_bus.stats()}
+
 # ─── WebSocket ────────────────────────────────────────────────────────────────
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await websocket.accept()
-    active_connections[client_id] = websocket
+    # Initial state is the first item in the client's outbound queue
+    await hub.connect(client_id, websocket, initial=await build_snapshot())
     try:
-        # Send initial state
-        await websocket.send_json({
-            "type": "init",
-            "agents": await orchestrator.list_agents(),
-            "tasks": await task_queue.list_tasks(limit=20),
-            "metrics": (await platform_metrics())
-        })
         while True:
             data = await websocket.receive_text()
             msg = json.loads(data)
             if msg.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+                hub.send(client_id, {"type": "pong"})
+            elif msg.get("type") in ("subscribe", "unsubscribe"):
+                # {"type": "subscribe", "agent_ids": [...], "task_types": [...], "events": [...]}
+                fields = {k: msg.get(k) or [] for k in SUBSCRIPTION_FIELDS}
+                if msg["type"] == "subscribe":
+                    subscriptions = hub.subscribe(client_id, **fields)
+                else:
+                    subscriptions = hub.unsubscribe(client_id, **fields)
+                hub.send(client_id, {"type": "subscriptions", "subscriptions": subscriptions})
     except WebSocketDisconnect:
-        del active_connections[client_id]
-
-async def broadcast(message: dict):
-    dead = []
-    for cid, ws in active_connections.items():
-        try:
-            await ws.send_json(message)
-        except:
-            dead.append(cid)
-    for cid in dead:
-        del active_connections[cid]
+        pass
+    finally:
+        await hub.disconnect(client_id, websocket)
+
+async def build_snapshot() -> dict:
+    """Full state sent on connect and to clients resynced after overflow."""
+    return {
+        "type": "init",
+        "agents": await orchestrator.list_agents(),
+        "tasks": await task_queue.list_tasks(limit=20),
+        "metrics": (await platform_metrics())
+    }
+
+async def broadcast(message: dict, **routing):
+    await event_bus.publish(message, routing)
+
+async def deliver_event(message: dict, routing: dict):
+    # Queues onto each interested local client's writer; never waits on a socket
+    with BROADCAST.time(event=message.get("type", "")):
+        hub.publish(message, **routing)
 
 async def broadcast_agent_update(agent_id: str):
     await asyncio.sleep(0.1)
     agents = await orchestrator.list_agents()
-    await broadcast({"type": "agents_update", "agents": agents})
+    await broadcast({"type": "agents_update", "agents": agents}, agent_id=agent_id)
+
+async def resubmit_queued_tasks(before: str):
+    """Local mode: hand this process's tasks queued before a restart back to
+    the scheduler as it has room for them. Tasks it can't take yet stay
+    queued until a worker frees up."""
+    resubmitted = failed = 0
+    after = None
+    while True:
+        page = await task_queue.queued_page(runner=TASK_RUNNER, before=before, after=after)
+        if not page:
+            break
+        for task in page:
+            after = (task["created_at"], task["id"])
+            metrics.track(task["id"], "queued")
+            agent = orchestrator.get(task["agent_id"])
+            if agent is None:
+                await task_queue.update_status(task["id"], "failed", error=f"Agent {task['agent_id']} not found or terminated")
+                failed += 1
+                continue
+            while not scheduler.free_slots():
+                await asyncio.sleep(0.5)
+            scheduler.submit(task["id"], agent, task)
+            resubmitted += 1
+    if resubmitted or failed:
+        print(f"✓ recovered {resubmitted} queued tasks ({failed} failed)")
+
+async def discard_task_files(task: dict):
+    """Delete files a task owns once it has reached a terminal status. Not
+    before: a task retried after a crash or lease expiry needs them again."""
+    payload = task.get("payload") or {}
+    if task["type"] == "parse_document" and payload.get("document_id"):
+        discard_document(payload["document_id"])
+    if payload.get("input_id"):
+        await task_inputs.delete(payload["input_id"])
+
+async def fail_unrunnable(task: dict, reason: str, fence: Optional[dict] = None) -> bool:
+    """Fail a leased task that can't run (its agent is gone, or its lease
+    kept expiring). Returns False if the task no longer matches `fence`."""
+    failed = await task_queue.update_status(
+        task["id"], "failed", error=reason, return_document=True, current=task, fence=fence)
+    if failed is None:
+        return False
+    agent = orchestrator.get(task["agent_id"])
+    TASKS.inc(status="failed", task_type=task["type"], agent_type=agent.agent_type if agent else "unknown")
+    await discard_task_files(task)
+    await broadcast({"type": "task_update", "task": failed})
+    return True
+
+def _seconds_since(iso_timestamp: str) -> float:
+    created = datetime.fromisoformat(iso_timestamp).replace(tzinfo=timezone.utc)
+    return max(time.time() - created.timestamp(), 0.0)
 
 async def process_task(task_id: str, agent, task: dict):
     await asyncio.sleep(0.05)
-    await task_queue.update_status(task_id, "running")
-    await broadcast({"type": "task_update", "task": await task_queue.get(task_id)})
+    queue_wait = _seconds_since(task["created_at"])
+    started = time.monotonic()
+    running = await task_queue.update_status(task_id, "running", return_document=True, current=task)
+    await broadcast({"type": "task_update", "task": running})
     
+    async def emit_progress(fields: dict):
+        await broadcast({
+            "type": "task_progress",
+            "task_id": task_id,
+            "agent_id": agent.agent_id,
+            "task_type": task["type"],
+            **fields,
+        })
+
+    # Lease mode: only write the outcome if we still hold the task's lease
+    fence = {"lease_owner": leases.owner} if LEASE_MODE else None
     try:
-        result = await agent.execute(task["type"], task["payload"])
-        await task_queue.update_status(task_id, "completed", result=result)
-        agent.increment_completed()
+        with progress_scope(emit_progress), result_stream_scope(result_store, task_id):
+            result = await agent.execute(task["type"], task["payload"])
+        final_task = await task_queue.update_status(
+            task_id, "completed", result=result, return_document=True, current=running, fence=fence)
+        final_status = "completed"
     except Exception as e:
-        await task_queue.update_status(task_id, "failed", error=str(e))
+        await result_store.discard_stream(task_id)
+        final_task = await task_queue.update_status(
+            task_id, "failed", error=str(e), return_document=True, current=running, fence=fence)
+        final_status = "failed"
+    leases.release(task_id)
+    if final_task is None:
+        # Our lease expired and another worker reclaimed the task; its outcome wins
+        print(f"✗ task {task_id}: lease lost to another worker, outcome discarded")
+        return
+    await discard_task_files(task)
+    if final_status == "completed":
+        agent.increment_completed()
+    else:
         agent.increment_failed()
+    exec_time = time.monotonic() - started
+    timeseries.record(agent.agent_type, task["type"], final_status, queue_wait, exec_time)
+    labels = {"task_type": task["type"], "agent_type": agent.agent_type}
+    TASKS.inc(status=final_status, **labels)
+    TASK_EXECUTION.observe(exec_time, **labels)
+    TASK_LATENCY.observe(queue_wait + exec_time, status=final_status, **labels)
     
-    # Sync agent counters to DB
-    await orchestrator.sync_counters(agent.agent_id, agent.tasks_completed, agent.tasks_failed)
+    # Persist agent counters
+    await orchestrator.record_outcome(agent.agent_id, final_status == "completed")
 
-    final_task = await task_queue.get(task_id)
     await broadcast({"type": "task_update", "task": final_task})
     await broadcast({"type": "metrics_update", "metrics": (await platform_metrics())})
     await broadcast_agent_update(agent.agent_id)
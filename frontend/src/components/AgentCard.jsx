@@ -26,7 +26,7 @@ const TASK_LABELS = {
   bulk_classify: "Classify", respond_to_dm: "Reply DM", reply_to_comment: "Reply Comment",
   handle_review: "Handle Review", social_monitor: "Monitor", extract_fields: "Extract",
   validate_records: "Validate", transform_data: "Transform", enrich_records: "Enrich",
-  deduplicate: "Deduplicate", parse_document: "Parse Doc", generate_code: "Generate Code",
+  deduplicate: "Deduplicate", run_pipeline: "Pipeline", parse_document: "Parse Doc", generate_code: "Generate Code",
   generate_project: "Generate Project", review_pr: "Review PR", write_tests: "Write Tests",
   detect_bugs: "Detect Bugs", generate_docs: "Generate Docs", refactor: "Refactor",
   generate_migration: "Migration",
@@ -1,7 +1,8 @@
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { createPortal } from "react-dom";
 import { X, Copy, Check, Code, FileText, Bug, GitPullRequest, TestTube, Database, RefreshCw, Clock, Cpu, FolderOpen, Download, ChevronRight, Layers } from "lucide-react";
 import JSZip from "jszip";
+import api from "../lib/api";
 
 /* ── helpers ────────────────────────────────────────────────────────── */
 
@@ -454,7 +455,24 @@ const TYPE_LABELS = {
 
 /* ── main modal ─────────────────────────────────────────────────────── */
 
+// Large results are stored out of line; the task only carries a summary
+function useFullResult(task) {
+  const [full, setFull] = useState(null);
+  const blobId = task?.result_ref?.blob_id;
+  useEffect(() => {
+    setFull(null);
+    if (!blobId) return;
+    let cancelled = false;
+    api.get(`/tasks/${task.id}/result`, { timeout: 120000 })
+      .then((res) => { if (!cancelled) setFull(res.data); })
+      .catch(() => {});
+    return () => { cancelled = true; };
+  }, [task?.id, blobId]);
+  return full;
+}
+
 export function TaskResultModal({ task, agentName, onClose }) {
+  const fullResult = useFullResult(task);
   if (!task) return null;
 
   const Renderer = RENDERERS[task.type] || GenericResult;
@@ -493,7 +511,7 @@ export function TaskResultModal({ task, agentName, onClose }) {
               <span>{task.error}</span>
             </div>
           ) : task.result ? (
-            <Renderer result={task.result} />
+            <Renderer result={fullResult || task.result} />
           ) : (
             <div style={styles.pending}>
               <div className="animate-spin" style={{ width: 24, height: 24, border: "3px solid rgba(255,255,255,0.08)", borderTopColor: "#00e5ff", borderRadius: "50%" }} />
@@ -234,7 +234,7 @@ export function TaskFeed({ tasks }) {
     bulk_classify: "Bulk Classify", respond_to_dm: "Reply to DM", reply_to_comment: "Reply to Comment",
     handle_review: "Handle Review", social_monitor: "Social Monitor", extract_fields: "Extract Fields",
     validate_records: "Validate Records", transform_data: "Transform Data", enrich_records: "Enrich Records",
-    deduplicate: "Deduplicate", parse_document: "Parse Document", generate_code: "Generate Code",
+    deduplicate: "Deduplicate", run_pipeline: "Run Pipeline", parse_document: "Parse Document", generate_code: "Generate Code",
     generate_project: "Generate Project",
     review_pr: "Review PR", write_tests: "Write Tests", detect_bugs: "Detect Bugs",
     generate_docs: "Generate Docs", refactor: "Refactor", generate_migration: "Migration",
@@ -87,6 +87,10 @@ export function useWebSocket() {
         if (msg.metrics) updateMetricsFromWs(msg.metrics);
         break;
 
+      case "task_progress":
+        // Streaming partial output; the final task_update carries the result
+        break;
+
       case "pong":
         break;
 